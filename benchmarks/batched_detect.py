@@ -0,0 +1,111 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Images/s of the detect.py loop, LoadImages + forward + NMS, over a directory of same-size images for every
+    --batch-size. Checks the batched detections of every image match the ones at batch size 1.
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+
+import torch
+
+from common import save_results
+from common import synthetic_images
+from yolov4_pytorch.data import LoadImages
+from yolov4_pytorch.data import batch_by_shape
+from yolov4_pytorch.model import YOLO
+from yolov4_pytorch.utils import non_max_suppression
+
+
+def run(model, directory, batch_size, device, half):
+    # One pass of detect.py over the directory, returns the seconds taken and the detections per path
+    detections = {}
+    sync = torch.cuda.synchronize if device.type == "cuda" else (lambda: None)
+    sync()
+    start = time.perf_counter()
+    for paths, images, _, _, _, _, _ in batch_by_shape(LoadImages(directory, args.image_size, verbose=False),
+                                                       batch_size):
+        images = torch.from_numpy(images).to(device)
+        images = (images.half() if half else images.float()) / 255.0
+        prediction = non_max_suppression(model(images)[0], confidence_thresholds=args.confidence_thresholds)
+        for path, detect in zip(paths, prediction):
+            detections[path] = detect
+    sync()
+    return time.perf_counter() - start, detections
+
+
+def detection_difference(a, b):
+    # Largest difference of two NMS outputs of an image, inf if they keep a different number of boxes
+    a = torch.zeros(0, 6) if a is None else a.float().cpu()
+    b = torch.zeros(0, 6) if b is None else b.float().cpu()
+    if a.shape != b.shape:
+        return float("inf")
+    return (a - b).abs().max().item() if len(a) else 0.
+
+
+def main():
+    device = torch.device(args.device)
+    half = device.type == "cuda"
+    with contextlib.redirect_stdout(io.StringIO()):  # model summary
+        model = YOLO(args.config_file).to(device).fuse().eval()
+    if half:
+        model.half()
+
+    results = []
+    print(f"{'batch':>8}{'seconds':>10}{'images/s':>12}{'speedup':>10}{'max diff':>12}")
+    with tempfile.TemporaryDirectory() as directory, torch.no_grad():
+        synthetic_images(directory, args.images, args.width, args.height)
+        run(model, directory, max(args.batch_sizes), device, half)  # warmup
+        reference = None
+        for batch_size in sorted(set([1] + args.batch_sizes)):
+            seconds, detections = run(model, directory, batch_size, device, half)
+            if reference is None:
+                reference, reference_seconds = detections, seconds
+            difference = max(detection_difference(detections[p], reference[p]) for p in reference)
+            print(f"{batch_size:>8}{seconds:>10.2f}{args.images / seconds:>12.2f}"
+                  f"{reference_seconds / seconds:>9.2f}x{difference:>12.3g}")
+            results.append({"batch_size": batch_size, "seconds": seconds, "images_per_second": args.images / seconds,
+                            "max_difference": difference})
+
+    if args.output:
+        save_results(args.output, "batched_detect", args, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/batched_detect.py --batch-sizes 1 4 8 16")
+    parser.add_argument("--config-file", type=str, default="configs/COCO-Detection/yolov5-small.yaml",
+                        help="Neural network profile path. (default: `configs/COCO-Detection/yolov5-small.yaml`)")
+    parser.add_argument("--image-size", type=int, default=640,
+                        help="Size of processing picture. (default: 640)")
+    parser.add_argument("--images", type=int, default=64,
+                        help="Number of synthetic images. (default: 64)")
+    parser.add_argument("--width", type=int, default=1280,
+                        help="Width of the synthetic images. (default: 1280)")
+    parser.add_argument("--height", type=int, default=720,
+                        help="Height of the synthetic images. (default: 720)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16],
+                        help="Batch sizes to sweep, 1 is always run as the reference. (default: 1 4 8 16)")
+    parser.add_argument("--confidence-thresholds", type=float, default=0.4,
+                        help="Object confidence threshold. (default=0.4)")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu",
+                        help="Device to run on. (default: cuda if available)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
@@ -0,0 +1,161 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Forward + backward time and autograd memory of bbox_iou() against the per coordinate implementation
+    it replaced, for IoU, GIoU, DIoU and CIoU.
+
+    Memory is the size of the tensors autograd saves for backward, measured with saved tensor hooks,
+    so it is comparable on CPU and GPU. The fused version is timed with autograd recording its graph, the
+    default, and with save_memory=True, which only saves its two inputs and recomputes the rest in a
+    hand-written backward.
+"""
+import argparse
+import math
+
+import torch
+
+from common import measure
+from common import save_results
+from yolov4_pytorch.utils import bbox_iou
+
+variants = {"IoU": {}, "GIoU": {"GIoU": True}, "DIoU": {"DIoU": True}, "CIoU": {"CIoU": True}}
+
+
+def bbox_iou_reference(box1, box2, x1y1x2y2=True, GIoU=False, DIoU=False, CIoU=False):
+    # bbox_iou() before the fused version
+    box2 = box2.t()
+
+    # Get the coordinates of bounding boxes
+    if x1y1x2y2:  # x1, y1, x2, y2 = box1
+        b1_x1, b1_y1, b1_x2, b1_y2 = box1[0], box1[1], box1[2], box1[3]
+        b2_x1, b2_y1, b2_x2, b2_y2 = box2[0], box2[1], box2[2], box2[3]
+    else:  # transform from xywh to xyxy
+        b1_x1, b1_x2 = box1[0] - box1[2] / 2, box1[0] + box1[2] / 2
+        b1_y1, b1_y2 = box1[1] - box1[3] / 2, box1[1] + box1[3] / 2
+        b2_x1, b2_x2 = box2[0] - box2[2] / 2, box2[0] + box2[2] / 2
+        b2_y1, b2_y2 = box2[1] - box2[3] / 2, box2[1] + box2[3] / 2
+
+    # Intersection area
+    inter = (torch.min(b1_x2, b2_x2) - torch.max(b1_x1, b2_x1)).clamp(0) * \
+            (torch.min(b1_y2, b2_y2) - torch.max(b1_y1, b2_y1)).clamp(0)
+
+    # Union Area
+    w1, h1 = b1_x2 - b1_x1, b1_y2 - b1_y1
+    w2, h2 = b2_x2 - b2_x1, b2_y2 - b2_y1
+    union = (w1 * h1 + 1e-16) + w2 * h2 - inter
+
+    iou = inter / union  # iou
+    if GIoU or DIoU or CIoU:
+        cw = torch.max(b1_x2, b2_x2) - torch.min(b1_x1, b2_x1)  # convex (smallest enclosing box) width
+        ch = torch.max(b1_y2, b2_y2) - torch.min(b1_y1, b2_y1)  # convex height
+        if GIoU:  # Generalized IoU https://arxiv.org/pdf/1902.09630.pdf
+            c_area = cw * ch + 1e-16  # convex area
+            return iou - (c_area - union) / c_area  # GIoU
+        if DIoU or CIoU:  # Distance or Complete IoU https://arxiv.org/abs/1911.08287v1
+            c2 = cw ** 2 + ch ** 2 + 1e-16
+            rho2 = ((b2_x1 + b2_x2) - (b1_x1 + b1_x2)) ** 2 / 4 + ((b2_y1 + b2_y2) - (b1_y1 + b1_y2)) ** 2 / 4
+            if DIoU:
+                return iou - rho2 / c2  # DIoU
+            elif CIoU:
+                v = (4 / math.pi ** 2) * torch.pow(torch.atan(w2 / h2) - torch.atan(w1 / h1), 2)
+                with torch.no_grad():
+                    alpha = v / (1 - iou + v)
+                return iou - (rho2 / c2 + v * alpha)  # CIoU
+
+    return iou
+
+
+def random_boxes(n, device):
+    # Predicted and target xywh boxes in grid units, like in YOLOLoss
+    target = torch.cat((torch.rand(n, 2), torch.rand(n, 2) * 4 + 0.1), 1).to(device)
+    prediction = (target + torch.randn(n, 4, device=device) * 0.2).abs().requires_grad_()
+    return prediction, target
+
+
+def saved_bytes(fn):
+    # Bytes of the distinct tensors autograd saves for the backward of fn()
+    storages = {}
+
+    def pack(x):
+        storages[x.untyped_storage().data_ptr()] = x.untyped_storage().nbytes()
+        return x
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda x: x):
+        fn()
+    return sum(storages.values())
+
+
+def main():
+    device = torch.device(args.device)
+    sync = torch.cuda.synchronize if device.type == "cuda" else None
+    results = []
+    print(f"{'variant':>8}{'boxes':>10}{'reference':>14}{'fused':>14}{'save memory':>14}{'speedup':>16}"
+          f"{'saved MB':>26}")
+    for n in args.boxes:
+        prediction, target = random_boxes(n, device)
+        for name, flags in variants.items():
+            def reference():
+                bbox_iou_reference(prediction.t(), target, x1y1x2y2=False, **flags).mean().backward()
+
+            def fused():
+                bbox_iou(prediction.t(), target, x1y1x2y2=False, **flags).mean().backward()
+
+            def save_memory():
+                bbox_iou(prediction.t(), target, x1y1x2y2=False, save_memory=True, **flags).mean().backward()
+
+            # Same values and gradients
+            x = bbox_iou_reference(prediction.t(), target, x1y1x2y2=False, **flags)
+            gx, = torch.autograd.grad(x.mean(), prediction)
+            for memory in (False, True):
+                y = bbox_iou(prediction.t(), target, x1y1x2y2=False, save_memory=memory, **flags)
+                gy, = torch.autograd.grad(y.mean(), prediction)
+                assert torch.allclose(x, y, atol=1E-5) and torch.allclose(gx, gy, atol=1E-7), f"{name} differs"
+
+            time_reference = measure(reference, number=args.number, repeat=args.repeat, warmup=3, sync=sync)
+            time_fused = measure(fused, number=args.number, repeat=args.repeat, warmup=3, sync=sync)
+            time_memory = measure(save_memory, number=args.number, repeat=args.repeat, warmup=3, sync=sync)
+            memory_reference = saved_bytes(lambda: bbox_iou_reference(prediction.t(), target, False, **flags))
+            memory_fused = saved_bytes(lambda: bbox_iou(prediction.t(), target, False, **flags))
+            memory_memory = saved_bytes(lambda: bbox_iou(prediction.t(), target, False, save_memory=True, **flags))
+            print(f"{name:>8}{n:>10}{time_reference * 1E3:>11.3f} ms{time_fused * 1E3:>11.3f} ms"
+                  f"{time_memory * 1E3:>11.3f} ms"
+                  f"{time_reference / time_fused:>8.2f}x /{time_reference / time_memory:>5.2f}x"
+                  f"{memory_reference / 1E6:>9.2f} /{memory_fused / 1E6:>6.2f} /{memory_memory / 1E6:>6.2f}")
+            results.append({"variant": name, "boxes": n,
+                            "reference_ms": time_reference * 1E3, "ms": time_fused * 1E3,
+                            "save_memory_ms": time_memory * 1E3, "speedup": time_reference / time_fused,
+                            "save_memory_speedup": time_reference / time_memory,
+                            "reference_saved_mb": memory_reference / 1E6, "saved_mb": memory_fused / 1E6,
+                            "save_memory_saved_mb": memory_memory / 1E6})
+
+    if args.output:
+        save_results(args.output, "bbox_iou", args, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/bbox_iou.py --boxes 1000 10000 100000")
+    parser.add_argument("--boxes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Numbers of box pairs to sweep. (default: 1000 10000 100000)")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu",
+                        help="Device to run on. (default: cuda if available)")
+    parser.add_argument("--number", type=int, default=10,
+                        help="Calls per measurement. (default: 10)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Measurements, the median is reported. (default: 5)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
@@ -0,0 +1,136 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    YOLOLoss.build_targets() against the per layer implementation it replaced, on dense scenes.
+"""
+import argparse
+from types import SimpleNamespace
+
+import torch
+
+from common import measure
+from common import save_results
+from yolov4_pytorch.model import Detect
+from yolov4_pytorch.utils import YOLOLoss
+
+anchors = [[10, 13, 16, 30, 33, 23], [30, 61, 62, 45, 59, 119], [116, 90, 156, 198, 373, 326]]  # P3-5
+strides = [8, 16, 32]
+
+
+def build_targets_reference(p, targets, model):
+    # build_targets() before the single pass version, 'rect4' style
+    det = model.model[-1]
+    na, nt = det.na, targets.shape[0]  # number of anchors, targets
+    tcls, tbox, indices, anch = [], [], [], []
+    gain = torch.ones(6, device=targets.device)  # normalized to gridspace gain
+    off = torch.tensor([[1, 0], [0, 1], [-1, 0], [0, -1]], device=targets.device).float()  # overlap offsets
+    at = torch.arange(na, device=targets.device).view(na, 1).repeat(1, nt)  # anchor tensor
+
+    g = 0.5  # offset
+    for i in range(det.nl):
+        anchors = det.anchors[i]
+        gain[2:] = torch.tensor(p[i].shape)[[3, 2, 3, 2]]  # xyxy gain
+
+        # Match targets to anchors
+        a, t, offsets = [], targets * gain, 0
+        if nt:
+            r = t[None, :, 4:6] / anchors[:, None]  # wh ratio
+            j = torch.max(r, 1. / r).max(2)[0] < model.hyper_parameters['anchor_t']  # compare
+            a, t = at[j], t.repeat(na, 1, 1)[j]  # filter
+
+            # overlaps
+            gxy = t[:, 2:4]  # grid xy
+            z = torch.zeros_like(gxy)
+            j, k = ((gxy % 1. < g) & (gxy > 1.)).T
+            l, m = ((gxy % 1. > (1 - g)) & (gxy < (gain[[2, 3]] - 1.))).T
+            a, t = torch.cat((a, a[j], a[k], a[l], a[m]), 0), torch.cat((t, t[j], t[k], t[l], t[m]), 0)
+            offsets = torch.cat((z, z[j] + off[0], z[k] + off[1], z[l] + off[2], z[m] + off[3]), 0) * g
+
+        # Define
+        b, c = t[:, :2].long().T  # image, class
+        gxy = t[:, 2:4]  # grid xy
+        gwh = t[:, 4:6]  # grid wh
+        gij = (gxy - offsets).long()
+        gi, gj = gij.T  # grid xy indices
+
+        # Append
+        indices.append((b, a, gj, gi))  # image, anchor, grid indices
+        tbox.append(torch.cat((gxy - gij, gwh), 1))  # box
+        anch.append(anchors[a])  # anchors
+        tcls.append(c)  # class
+
+    return tcls, tbox, indices, anch
+
+
+def dense_targets(batch_size, objects, classes=80):
+    # objects random boxes per image, image, class, x, y, w, h normalized
+    n = batch_size * objects
+    wh = torch.rand(n, 2) ** 2 * 0.5 + 0.01  # mostly small objects
+    xy = torch.rand(n, 2) * (1 - wh) + wh / 2
+    image = torch.arange(batch_size).repeat_interleave(objects)[:, None].float()
+    return torch.cat((image, torch.randint(0, classes, (n, 1)).float(), xy, wh), 1)
+
+
+def main():
+    device = torch.device(args.device)
+    det = Detect(80, anchors, ch=()).to(device)
+    det.anchors /= torch.tensor(strides, device=device).view(-1, 1, 1)  # grid units, like after the model build
+    hyper_parameters = {"anchor_t": 4.0, "giou": 0.05, "obj": 1.0, "cls": 0.5, "cls_pw": 1.0, "obj_pw": 1.0,
+                        "fl_gamma": 0.0}
+    model = SimpleNamespace(model=[det], hyper_parameters=hyper_parameters, number_classes=80)
+    build_targets = YOLOLoss(model).to(device).build_targets
+    sync = torch.cuda.synchronize if device.type == "cuda" else None
+
+    results = []
+    print(f"{'batch':>8}{'targets':>10}{'reference':>14}{'single pass':>14}{'speedup':>10}")
+    for batch_size in args.batch_sizes:
+        p = [torch.empty(batch_size, det.na, args.image_size // s, args.image_size // s, 85, device=device)
+             for s in strides]  # only the shapes are used
+        targets = dense_targets(batch_size, args.objects).to(device)
+
+        # Same targets in the same order
+        for x, y in zip(build_targets_reference(p, targets, model), build_targets(p, targets)):
+            for xi, yi in zip(x, y):
+                for u, v in zip(xi if isinstance(xi, tuple) else [xi], yi if isinstance(yi, tuple) else [yi]):
+                    assert torch.equal(u.to(device), v), "build_targets() differs from the reference"
+
+        reference = measure(lambda: build_targets_reference(p, targets, model), repeat=args.repeat, sync=sync)
+        single = measure(lambda: build_targets(p, targets), repeat=args.repeat, sync=sync)
+        print(f"{batch_size:>8}{len(targets):>10}{reference * 1E3:>11.2f} ms{single * 1E3:>11.2f} ms"
+              f"{reference / single:>9.2f}x")
+        results.append({"batch_size": batch_size, "targets": len(targets),
+                        "reference_ms": reference * 1E3, "ms": single * 1E3, "speedup": reference / single})
+
+    if args.output:
+        save_results(args.output, "build_targets", args, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/build_targets.py --batch-sizes 16 32 64 128")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64, 128],
+                        help="Batch sizes to sweep. (default: 16 32 64 128)")
+    parser.add_argument("--objects", type=int, default=50,
+                        help="Objects per image. (default: 50)")
+    parser.add_argument("--image-size", type=int, default=640,
+                        help="Size of processing picture. (default: 640)")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu",
+                        help="Device to run on. (default: cuda if available)")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="Measurements per batch size, the median is reported. (default: 20)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
@@ -0,0 +1,71 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Peak memory and training throughput of a model with and without activation checkpointing.
+
+    Every measurement runs in a fresh process. Peak memory is ``torch.cuda.max_memory_allocated()``
+    on GPU and the growth of the peak resident set size during the training steps on CPU.
+"""
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from common import save_results
+from common import train_step_memory
+
+
+def measure_in_process(layers, batch_size):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(train_step_memory, args.config_file, args.image_size, batch_size, args.device,
+                               args.iterations, checkpoint_layers=layers).result()
+
+
+def main():
+    layers = args.layers or True
+    results = []
+    print(f"{'batch':>8}{'checkpoint':>12}{'peak MB':>12}{'images/s':>12}")
+    for batch_size in args.batch_sizes:
+        for name, mode in (("off", False), ("on", layers)):
+            peak, seconds = measure_in_process(mode, batch_size)
+            print(f"{batch_size:>8}{name:>12}{peak / 1E6:>12.1f}{batch_size / seconds:>12.2f}")
+            results.append({"batch_size": batch_size, "checkpoint": name, "peak_mb": peak / 1E6,
+                            "images_per_second": batch_size / seconds})
+
+    if args.output:
+        save_results(args.output, "checkpoint", args, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/checkpoint.py "
+                                           "--config-file configs/COCO-Detection/yolov4.yaml --batch-sizes 4 8")
+    parser.add_argument("--config-file", type=str, default="configs/COCO-Detection/yolov4.yaml",
+                        help="Neural network profile path. (default: `configs/COCO-Detection/yolov4.yaml`)")
+    parser.add_argument("--image-size", type=int, default=640,
+                        help="Size of processing picture. (default: 640)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[2, 4],
+                        help="Batch sizes to sweep. (default: 2 4)")
+    parser.add_argument("--layers", type=int, nargs="*", default=None,
+                        help="Layers to checkpoint. (default: every backbone layer)")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu",
+                        help="Device to run on. (default: cuda if available)")
+    parser.add_argument("--iterations", type=int, default=3,
+                        help="Timed training steps per measurement. (default: 3)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
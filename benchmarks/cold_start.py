@@ -0,0 +1,112 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Cold start of inference, from a fresh process to the first prediction, building YOLO from its YAML
+    config and weights as detect.py does, the same with ``verbose=False`` (no layer table and thop FLOPs),
+    and loading the TorchScript file of export.py.
+
+    Weights are random and written to a temporary directory, ``torch`` is imported before the clock starts.
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from common import save_results
+
+
+def start_from_config(config_file, weights, image_size, device, verbose=True):
+    from yolov4_pytorch.model import YOLO
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # model summary
+        model = YOLO(config_file, verbose=verbose).to(device)
+        model.load_state_dict(torch.load(weights, map_location=device)["state_dict"])
+        model.float().fuse(verbose=verbose).eval()
+    loaded = time.perf_counter()
+    with torch.no_grad():
+        model(torch.zeros(1, 3, image_size, image_size, device=device))
+    return loaded - start, time.perf_counter() - start
+
+
+def start_from_torchscript(path, image_size, device):
+    from yolov4_pytorch.model import load_torchscript
+
+    start = time.perf_counter()
+    model, _ = load_torchscript(path, device)
+    loaded = time.perf_counter()
+    with torch.no_grad():
+        model(torch.zeros(1, 3, image_size, image_size, device=device))
+    return loaded - start, time.perf_counter() - start
+
+
+def in_process(fn, *args):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(fn, *args).result()
+
+
+def main():
+    from yolov4_pytorch.model import YOLO
+    from yolov4_pytorch.model import export_torchscript
+
+    results = []
+    print(f"{'config':>45}{'source':>14}{'load s':>10}{'first pred s':>14}")
+    with tempfile.TemporaryDirectory() as directory:
+        for config_file in args.config_files:
+            weights = os.path.join(directory, "weights.pth")
+            artifact = os.path.join(directory, "model.torchscript")
+            with contextlib.redirect_stdout(io.StringIO()):
+                model = YOLO(config_file)
+                torch.save({"state_dict": model.state_dict()}, weights)
+                export_torchscript(model, artifact, [str(i) for i in range(model.yaml["number_classes"])],
+                                   image_size=args.image_size)
+
+            for source, (fn, fn_args) in {"config": (start_from_config, (config_file, weights)),
+                                          "config quiet": (start_from_config, (config_file, weights)),
+                                          "torchscript": (start_from_torchscript, (artifact,))}.items():
+                fn_args += (args.image_size, args.device) + ((False,) if source == "config quiet" else ())
+                load, first = min((in_process(fn, *fn_args)
+                                   for _ in range(args.repeat)), key=lambda x: x[1])
+                print(f"{config_file:>45}{source:>14}{load:>10.3f}{first:>14.3f}")
+                results.append({"config_file": config_file, "source": source, "load_seconds": load,
+                                "first_prediction_seconds": first})
+
+    if args.output:
+        save_results(args.output, "cold_start", args, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/cold_start.py "
+                                           "--config-files configs/COCO-Detection/yolov5-small.yaml")
+    parser.add_argument("--config-files", type=str, nargs="+",
+                        default=["configs/COCO-Detection/yolov5-small.yaml", "configs/COCO-Detection/yolov4.yaml"],
+                        help="Model configs to compare. (default: yolov5-small and yolov4 of COCO-Detection)")
+    parser.add_argument("--image-size", type=int, default=640,
+                        help="Size of processing picture. (default: 640)")
+    parser.add_argument("--device", type=str, default="cpu",
+                        help="Device to run on. (default: cpu)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Fresh processes per measurement, the fastest is reported. (default: 3)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
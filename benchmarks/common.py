@@ -0,0 +1,182 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Helpers shared by the benchmarks: synthetic data, timing and JSON results.
+"""
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+
+import cv2
+import numpy as np
+import torch
+
+
+def synthetic_images(directory, number, width, height, seed=0):
+    # Smooth random images compress like photos, unlike uniform noise
+    rng = np.random.RandomState(seed)
+    files = []
+    for i in range(number):
+        noise = rng.randint(0, 255, (max(height // 32, 1), max(width // 32, 1), 3)).astype(np.uint8)
+        img = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+        files.append(os.path.join(directory, f"{i:04d}.jpg"))
+        cv2.imwrite(files[-1], img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return files
+
+
+def synthetic_dataset(directory, number, width, height, boxes=8, classes=80, seed=0):
+    """ Write a dataset in the ``images/`` + ``labels/`` layout of ``LoadImagesAndLabels``.
+
+    Image sizes vary around ``width`` x ``height`` so aspect ratios differ, every image gets
+    ``boxes`` random labels.
+
+    Returns:
+        The images directory.
+
+    """
+    rng = np.random.RandomState(seed)
+    images, labels = os.path.join(directory, "images"), os.path.join(directory, "labels")
+    os.makedirs(images, exist_ok=True)
+    os.makedirs(labels, exist_ok=True)
+    for i in range(number):
+        w, h = (np.array([width, height]) * rng.uniform(0.75, 1.25, 2)).astype(int)
+        synthetic_images(images, 1, w, h, seed=seed + i)
+        os.replace(os.path.join(images, "0000.jpg"), os.path.join(images, f"{i:06d}.jpg"))
+        wh = rng.uniform(0.05, 0.5, (boxes, 2))
+        xy = rng.uniform(0, 1, (boxes, 2)) * (1 - wh) + wh / 2
+        c = rng.randint(0, classes, (boxes, 1))
+        np.savetxt(os.path.join(labels, f"{i:06d}.txt"), np.concatenate((c, xy, wh), 1), fmt="%g")
+    return images
+
+
+def measure(fn, number=1, repeat=5, warmup=1, sync=None):
+    """ Median wall time of ``number`` calls of ``fn``, in seconds per call.
+
+    Args:
+        fn (callable): Function to time, called without arguments.
+        number (int, optional): Calls per measurement. (default: ``1``)
+        repeat (int, optional): Number of measurements. (default: ``5``)
+        warmup (int, optional): Untimed calls first. (default: ``1``)
+        sync (callable, optional): Called before reading the clock, e.g. ``torch.cuda.synchronize``. (default: ``None``)
+
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        if sync is not None:
+            sync()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if sync is not None:
+            sync()
+        times.append((time.perf_counter() - start) / number)
+    return float(np.median(times))
+
+
+def train_step_memory(config, image_size, batch_size, device, iterations, **model_kwargs):
+    """ Peak memory in bytes and seconds per iteration of training steps of a ``YOLO`` model.
+
+    Run it in a fresh process, peak memory is ``torch.cuda.max_memory_allocated()`` on GPU and the growth
+    of the peak resident set size during the timed steps on CPU.
+
+    Args:
+        config (str or dict): Model YAML file or dict.
+        image_size (int): Size of the random square input images.
+        batch_size (int): Images per step.
+        device (str): Device to run on.
+        iterations (int): Timed training steps, after one untimed warmup step.
+        **model_kwargs: Passed to ``YOLO``.
+
+    """
+    from yolov4_pytorch.model import YOLO
+
+    device = torch.device(device)
+    with contextlib.redirect_stdout(io.StringIO()):  # model summary
+        model = YOLO(config, **model_kwargs).to(device).train()
+    images = torch.rand(batch_size, 3, image_size, image_size, device=device)
+    sync = torch.cuda.synchronize if device.type == "cuda" else lambda: None
+
+    def step():
+        loss = sum(x.float().pow(2).mean() for x in model(images))  # all outputs take part in backward
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+
+    step()  # warmup, allocates the gradients
+    sync()
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        start_memory = torch.cuda.memory_allocated(device)
+    else:
+        start_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    start = time.perf_counter()
+    for _ in range(iterations):
+        step()
+    sync()
+    seconds = (time.perf_counter() - start) / iterations
+    if device.type == "cuda":
+        peak = torch.cuda.max_memory_allocated(device) - start_memory
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - start_memory
+    return peak, seconds
+
+
+def environment():
+    # Where and on what the results were measured, to compare them across commits
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit,
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+            "threads": torch.get_num_threads(),
+            "cuda": torch.cuda.get_device_name() if torch.cuda.is_available() else None}
+
+
+def save_results(path, benchmark, args, results):
+    """ Write results as JSON, ``{"benchmark", "environment", "args", "results": [{...}, ...]}``. """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"benchmark": benchmark,
+                   "environment": environment(),
+                   "args": vars(args),
+                   "results": results}, f, indent=2)
+    print(f"Results saved to {path}")
+
+
+def compare(results, baseline, keys, metric):
+    """ Print ``metric`` of every result next to the result with the same ``keys`` in a baseline JSON file. """
+    with open(baseline) as f:
+        baseline = json.load(f)
+    old = {tuple(r.get(k) for k in keys): r[metric] for r in baseline["results"]}
+    print(f"\nCompared to {baseline['environment'].get('commit') or 'baseline'}:")
+    for r in results:
+        key = tuple(r.get(k) for k in keys)
+        if key in old and old[key]:
+            print(f"{' '.join(str(x) for x in key):>40}{old[key]:>12.2f}{r[metric]:>12.2f}"
+                  f"{r[metric] / old[key]:>8.2f}x")
@@ -0,0 +1,87 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Latency and throughput of a fused model on CPU, the float32 NCHW path of detect.py against CPUInference
+    eager in channels last, traced and pre-packed in float32, and traced under bfloat16 autocast.
+
+    Every engine is checked against the float32 NCHW predictions, the largest absolute difference of the
+    box and score outputs is reported. Weights are random, no checkpoint is needed.
+"""
+import argparse
+import contextlib
+import copy
+import io
+
+import torch
+
+from common import measure
+from common import save_results
+from yolov4_pytorch.model import CPUInference
+from yolov4_pytorch.model import YOLO
+
+engines = {"fp32 nchw": None,
+           "channels last": {"trace": False},
+           "traced fp32": {"trace": True},
+           "traced bf16": {"trace": True, "bfloat16": True}}
+
+
+def main():
+    with contextlib.redirect_stdout(io.StringIO()):  # model summary
+        model = YOLO(args.config_file).fuse().eval()
+
+    results = []
+    print(f"{'engine':>16}{'batch':>8}{'ms/batch':>12}{'images/s':>12}{'max diff':>12}")
+    for batch_size in args.batch_sizes:
+        images = torch.rand(batch_size, 3, args.image_size, args.image_size)
+        with torch.no_grad():
+            reference = model(images)[0]
+        for name, kwargs in engines.items():
+            if name not in args.engines:
+                continue
+            engine = model if kwargs is None else CPUInference(copy.deepcopy(model), **kwargs)
+            with torch.no_grad():
+                prediction = engine(images)[0]  # traces and caches the input shape
+                seconds = measure(lambda: engine(images), repeat=args.repeat)
+            difference = (prediction - reference).abs().max().item()
+            print(f"{name:>16}{batch_size:>8}{seconds * 1E3:>12.1f}{batch_size / seconds:>12.2f}{difference:>12.3g}")
+            results.append({"engine": name, "batch_size": batch_size, "ms_per_batch": seconds * 1E3,
+                            "images_per_second": batch_size / seconds, "max_difference": difference})
+
+    if args.output:
+        save_results(args.output, "cpu_inference", args, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/cpu_inference.py "
+                                           "--config-file configs/COCO-Detection/yolov5-small.yaml --batch-sizes 1 8")
+    parser.add_argument("--config-file", type=str, default="configs/COCO-Detection/yolov5-small.yaml",
+                        help="Neural network profile path. (default: `configs/COCO-Detection/yolov5-small.yaml`)")
+    parser.add_argument("--image-size", type=int, default=640,
+                        help="Size of processing picture. (default: 640)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8],
+                        help="Batch sizes to sweep. (default: 1 8)")
+    parser.add_argument("--engines", type=str, nargs="+", default=list(engines),
+                        help=f"Engines to compare. (default: {' '.join(engines)})")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Number of intra-op threads, 0 keeps the torch default. (default: 0)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Timed runs per measurement. (default: 5)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    print(args)
+
+    main()
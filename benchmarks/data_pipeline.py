@@ -0,0 +1,164 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Time every stage of the training data pipeline on a synthetic dataset, then the DataLoader end to end.
+
+    Stages are timed in this process on one thread, like a dataloader worker: ``load_image`` decode,
+    ``letterbox``, ``load_mosaic``, ``random_affine``, ``augment_hsv``, a whole ``__getitem__`` and
+    ``collate_fn``. The DataLoader is swept over worker counts. Everything is repeated for every
+    cache mode and image size, results are written as JSON to compare across commits.
+"""
+import argparse
+import itertools
+import shutil
+import tempfile
+import time
+
+import cv2
+import torch
+
+from common import compare
+from common import measure
+from common import save_results
+from common import synthetic_dataset
+from yolov4_pytorch.data import LoadImagesAndLabels
+from yolov4_pytorch.data import augment_hsv
+from yolov4_pytorch.data import create_dataloader
+from yolov4_pytorch.data import letterbox
+from yolov4_pytorch.data import load_image
+from yolov4_pytorch.data import load_mosaic
+from yolov4_pytorch.data import random_affine
+from yolov4_pytorch.utils import xywh2xyxy
+
+# Augmentation defaults of train.py
+hyper_parameters = {"hsv_h": 0.015,
+                    "hsv_s": 0.7,
+                    "hsv_v": 0.4,
+                    "degrees": 0.0,
+                    "translate": 0.0,
+                    "scale": 0.5,
+                    "shear": 0.0}
+
+
+def benchmark_stages(dataset, image_size, batch_size):
+    # Seconds per image of every stage, cycling over the dataset
+    indices = itertools.cycle(range(len(dataset)))
+    img, _, _ = load_image(dataset, 0)
+    padded = letterbox(img, image_size, auto=False)[0]
+    labels = dataset.labels[0].copy()
+    labels[:, 1:] = xywh2xyxy(labels[:, 1:]) * image_size
+    samples = [dataset[i % len(dataset)] for i in range(batch_size)]
+
+    stages = {"load_image": lambda: load_image(dataset, next(indices)),
+              "letterbox": lambda: letterbox(img, image_size, auto=False),
+              "load_mosaic": lambda: load_mosaic(dataset, next(indices)),
+              "random_affine": lambda: random_affine(padded, labels.copy(),
+                                                     degrees=hyper_parameters["degrees"],
+                                                     translate=hyper_parameters["translate"],
+                                                     scale=hyper_parameters["scale"],
+                                                     shear=hyper_parameters["shear"]),
+              "augment_hsv": lambda: augment_hsv(padded.copy(),
+                                                 hgain=hyper_parameters["hsv_h"],
+                                                 sgain=hyper_parameters["hsv_s"],
+                                                 vgain=hyper_parameters["hsv_v"]),
+              "getitem": lambda: dataset[next(indices)],
+              "collate_fn": lambda: LoadImagesAndLabels.collate_fn([(x[0], x[1].clone(), x[2], x[3]) for x in samples])}
+    results = {}
+    for name, fn in stages.items():
+        seconds = measure(fn, number=args.number, repeat=args.repeat)
+        results[name] = seconds / batch_size if name == "collate_fn" else seconds  # per image
+    return results
+
+
+def benchmark_dataloader(dataroot, image_size, cache, workers):
+    # Images per second of the training DataLoader, after its first batch
+    _, dataloader = create_dataloader(dataroot, image_size, args.batch_size, hyper_parameters,
+                                      augment=True,
+                                      cache=cache,
+                                      workers=workers,
+                                      persistent_workers=False,
+                                      shuffle=True)
+    iterator = iter(dataloader)
+    next(iterator)  # worker start up
+    images, start = 0, time.perf_counter()
+    for _ in range(args.batches):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            iterator = iter(dataloader)
+            batch = next(iterator)
+        images += batch[0].shape[0]
+    return images / (time.perf_counter() - start), dataloader.num_workers
+
+
+def main():
+    cv2.setNumThreads(0)  # single threaded, like a dataloader worker
+    torch.set_num_threads(1)
+    directory = tempfile.mkdtemp()
+    try:
+        dataroot = synthetic_dataset(directory, args.images, args.width, args.height)
+        results = []
+        for image_size, cache in itertools.product(args.image_sizes, args.cache):
+            print(f"\nimage size {image_size}, cache {cache}")
+            dataset = LoadImagesAndLabels(dataroot, image_size, args.batch_size, augment=True,
+                                          hyper_parameters=hyper_parameters, cache_images=cache == "mmap")
+            for stage, seconds in benchmark_stages(dataset, image_size, args.batch_size).items():
+                print(f"{stage:>24}{seconds * 1E3:>10.2f} ms{1 / seconds:>10.1f} images/s")
+                results.append({"stage": stage, "image_size": image_size, "cache": cache, "workers": 0,
+                                "ms": seconds * 1E3, "images_per_second": 1 / seconds})
+
+            for workers in args.workers:
+                speed, num_workers = benchmark_dataloader(dataroot, image_size, cache == "mmap", workers)
+                print(f"{'dataloader':>24}{num_workers:>3} workers{speed:>10.1f} images/s")
+                results.append({"stage": "dataloader", "image_size": image_size, "cache": cache,
+                                "workers": num_workers, "ms": 1E3 / speed, "images_per_second": speed})
+    finally:
+        shutil.rmtree(directory)
+
+    save_results(args.output, "data_pipeline", args, results)
+    if args.baseline:
+        compare(results, args.baseline, ("stage", "image_size", "cache", "workers"), "images_per_second")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/data_pipeline.py --image-sizes 416 640 "
+                                           "--workers 0 4 8 --output data_pipeline.json")
+    parser.add_argument("--images", type=int, default=64,
+                        help="Number of synthetic images. (default: 64)")
+    parser.add_argument("--width", type=int, default=1280,
+                        help="Mean width of the synthetic images. (default: 1280)")
+    parser.add_argument("--height", type=int, default=720,
+                        help="Mean height of the synthetic images. (default: 720)")
+    parser.add_argument("--image-sizes", type=int, nargs="+", default=[640],
+                        help="Image sizes to sweep. (default: 640)")
+    parser.add_argument("--cache", type=str, nargs="+", default=["none", "mmap"], choices=["none", "mmap"],
+                        help="Image cache modes to sweep. (default: none mmap)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4, 8],
+                        help="DataLoader worker counts to sweep, limited by the available CPUs. (default: 0 2 4 8)")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="Mini-batch size. (default: 16)")
+    parser.add_argument("--batches", type=int, default=20,
+                        help="Batches timed per DataLoader run. (default: 20)")
+    parser.add_argument("--number", type=int, default=8,
+                        help="Calls per stage measurement. (default: 8)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Measurements per stage, the median is reported. (default: 5)")
+    parser.add_argument("--output", type=str, default="data_pipeline.json",
+                        help="JSON results file. (default: data_pipeline.json)")
+    parser.add_argument("--baseline", type=str, default="",
+                        help="JSON results of an earlier run to compare to. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
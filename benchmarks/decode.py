@@ -0,0 +1,79 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Images/sec of read_image() with full resolution decode + resize, and with reduced resolution JPEG decode.
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import cv2
+
+from common import save_results
+from common import synthetic_images
+from yolov4_pytorch.data import read_image
+
+
+def benchmark(files, image_size, reduced, repeat):
+    for f in files[:4]:  # warm up the page cache
+        read_image(f, image_size, reduced=reduced)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for f in files:
+            read_image(f, image_size, reduced=reduced)
+    return len(files) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    cv2.setNumThreads(0)  # single threaded, like a dataloader worker
+    with tempfile.TemporaryDirectory() as directory:
+        if args.source:
+            files = sorted(glob.glob(os.path.join(args.source, "*.jpg")))[:args.number]
+        else:
+            files = synthetic_images(directory, args.number, args.width, args.height)
+        assert files, f"No *.jpg images found in {args.source}"
+        h, w = cv2.imread(files[0]).shape[:2]
+        print(f"{len(files)} images, first is {w}x{h}, image size {args.image_size}")
+
+        full = benchmark(files, args.image_size, reduced=False, repeat=args.repeat)
+        reduced = benchmark(files, args.image_size, reduced=True, repeat=args.repeat)
+        print(f"{'full decode + resize':>24}{full:>10.1f} images/s")
+        print(f"{'reduced decode + resize':>24}{reduced:>10.1f} images/s{reduced / full:>8.2f}x")
+        if args.output:
+            save_results(args.output, "decode", args, [{"stage": "full", "images_per_second": full},
+                                                       {"stage": "reduced", "images_per_second": reduced}])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/decode.py --image-size 640")
+    parser.add_argument("--source", type=str, default="",
+                        help="Directory of *.jpg images, synthetic 4K images if empty. (default: ``)")
+    parser.add_argument("--number", type=int, default=32,
+                        help="Number of images. (default: 32)")
+    parser.add_argument("--width", type=int, default=3840,
+                        help="Width of synthetic images. (default: 3840)")
+    parser.add_argument("--height", type=int, default=2160,
+                        help="Height of synthetic images. (default: 2160)")
+    parser.add_argument("--image-size", type=int, default=640,
+                        help="Size of processing picture. (default: 640)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Passes over the images. (default: 3)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
@@ -0,0 +1,99 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Inference time of Detect.forward() with cached grids and a fused decode against the version it replaced,
+    which rebuilt the grids whenever the input shape changed, for a fixed shape and for shapes alternating
+    between calls as in rect batches. Checks both decode the same boxes.
+"""
+import argparse
+
+import torch
+
+from common import measure
+from common import save_results
+from yolov4_pytorch.model import Detect
+
+anchors = [[10, 13, 16, 30, 33, 23], [30, 61, 62, 45, 59, 119], [116, 90, 156, 198, 373, 326]]
+strides = [8., 16., 32.]
+
+
+def forward_reference(self, x):
+    # Detect.forward() before the grid cache, the grids live in self.grid
+    z = []
+    for i in range(self.nl):
+        x[i] = self.m[i](x[i])
+        bs, _, ny, nx = x[i].shape
+        x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()
+        if self.grid[i].shape[2:4] != x[i].shape[2:4]:
+            self.grid[i] = self._make_grid(nx, ny).to(x[i].device)
+        y = x[i].sigmoid()
+        y[..., 0:2] = (y[..., 0:2] * 2. - 0.5 + self.grid[i].to(x[i].device)) * self.stride[i]
+        y[..., 2:4] = (y[..., 2:4] * 2) ** 2 * self.anchor_grid[i]
+        z.append(y.view(bs, -1, self.no))
+    return torch.cat(z, 1), x
+
+
+def features(shape, channels, batch_size, device):
+    return [torch.rand(batch_size, c, shape[0] // int(s), shape[1] // int(s), device=device)
+            for c, s in zip(channels, strides)]
+
+
+def main():
+    device = torch.device(args.device)
+    channels = [128, 256, 512]
+    detect = Detect(80, anchors, channels).to(device).eval()
+    detect.stride = torch.tensor(strides)
+    detect.grid = [torch.zeros(1)] * detect.nl
+    sync = torch.cuda.synchronize if device.type == "cuda" else None
+
+    cases = {"fixed": [(args.image_size, args.image_size)],
+             "alternating": [(args.image_size, args.image_size), (args.image_size, args.image_size * 3 // 4),
+                             (args.image_size * 3 // 4, args.image_size)]}
+    results = []
+    print(f"{'shapes':>12}{'batch':>8}{'old ms':>10}{'new ms':>10}{'speedup':>10}{'max diff':>12}")
+    for name, shapes in cases.items():
+        for batch_size in args.batch_sizes:
+            inputs = [features(shape, channels, batch_size, device) for shape in shapes]
+            with torch.no_grad():
+                difference = max((forward_reference(detect, list(x))[0] - detect(list(x))[0]).abs().max().item()
+                                 for x in inputs)
+                calls = iter(range(1 << 62))
+                old = measure(lambda: forward_reference(detect, list(inputs[next(calls) % len(inputs)])),
+                              number=len(inputs) * 5, repeat=args.repeat, sync=sync)
+                new = measure(lambda: detect(list(inputs[next(calls) % len(inputs)])),
+                              number=len(inputs) * 5, repeat=args.repeat, sync=sync)
+            print(f"{name:>12}{batch_size:>8}{old * 1E3:>10.3f}{new * 1E3:>10.3f}{old / new:>9.2f}x{difference:>12.3g}")
+            results.append({"shapes": name, "batch_size": batch_size, "old_ms": old * 1E3, "new_ms": new * 1E3,
+                            "max_difference": difference})
+
+    if args.output:
+        save_results(args.output, "detect_head", args, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/detect_head.py --batch-sizes 1 16")
+    parser.add_argument("--image-size", type=int, default=640,
+                        help="Size of processing picture. (default: 640)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16],
+                        help="Batch sizes to sweep. (default: 1 16)")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu",
+                        help="Device to run on. (default: cuda if available)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Timed runs per measurement. (default: 5)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
@@ -0,0 +1,97 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Inference latency of every model config before and after YOLO.fuse(), and a check that fusing does not
+    change the predictions.
+
+    BatchNorm statistics and affine parameters are randomized first, so folding them is not a no-op.
+    The check fails when the predictions differ by more than ``--tolerance`` or a BatchNorm2d is left.
+"""
+import argparse
+import contextlib
+import glob
+import io
+
+import torch
+import torch.nn as nn
+
+from common import measure
+from common import save_results
+from yolov4_pytorch.model import YOLO
+
+
+def randomize_batchnorm(model, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    with torch.no_grad():
+        for m in model.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.weight.copy_(torch.rand(m.num_features, generator=generator) + 0.5)
+                m.bias.copy_(torch.randn(m.num_features, generator=generator) * 0.1)
+                m.running_mean.copy_(torch.randn(m.num_features, generator=generator) * 0.1)
+                m.running_var.copy_(torch.rand(m.num_features, generator=generator) + 0.5)
+
+
+def main():
+    results, failed = [], []
+    print(f"{'config':>45}{'unfused ms':>12}{'fused ms':>12}{'speedup':>10}{'max diff':>12}{'BN left':>9}")
+    for config_file in args.config_files:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):  # model summary
+                model = YOLO(config_file).eval()
+        except Exception as e:  # configs that do not build are reported, not benchmarked
+            print(f"{config_file:>45}  does not build: {e}")
+            continue
+        randomize_batchnorm(model)
+        images = torch.rand(args.batch_size, 3, args.image_size, args.image_size)
+        with torch.no_grad():
+            reference = model(images)[0]
+            unfused = measure(lambda: model(images), repeat=args.repeat)
+            with contextlib.redirect_stdout(io.StringIO()):
+                model.fuse()
+            prediction = model(images)[0]
+            fused = measure(lambda: model(images), repeat=args.repeat)
+        difference = (prediction - reference).abs().max().item()
+        remaining = sum(isinstance(m, nn.BatchNorm2d) for m in model.modules())
+        print(f"{config_file:>45}{unfused * 1E3:>12.1f}{fused * 1E3:>12.1f}{unfused / fused:>9.2f}x"
+              f"{difference:>12.3g}{remaining:>9}")
+        results.append({"config_file": config_file, "unfused_ms": unfused * 1E3, "fused_ms": fused * 1E3,
+                         "max_difference": difference, "batchnorm_left": remaining})
+        if difference > args.tolerance or remaining:
+            failed.append(config_file)
+
+    if args.output:
+        save_results(args.output, "fuse", args, results)
+    assert not failed, f"Fusing changed the predictions or left BatchNorm2d layers of {', '.join(failed)}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/fuse.py --image-size 320")
+    parser.add_argument("--config-files", type=str, nargs="+",
+                        default=sorted(glob.glob("configs/**/*.yaml", recursive=True)),
+                        help="Model configs to fuse. (default: every YAML file in `configs/`)")
+    parser.add_argument("--image-size", type=int, default=320,
+                        help="Size of processing picture. (default: 320)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Images per forward pass. (default: 1)")
+    parser.add_argument("--tolerance", type=float, default=1E-2,
+                        help="Largest allowed difference of the predictions, in pixels or probability. "
+                             "(default: 0.01)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Timed runs per measurement. (default: 5)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
@@ -0,0 +1,71 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Import time of the package entry points, measured with ``python -X importtime`` in fresh processes.
+
+    ``torch`` and ``numpy`` are imported first, the time and modules reported are what importing the package adds.
+    Inference entry points fail the run when they exceed ``--budget-ms`` or load a module of ``--forbidden``,
+    the training entry point is reported for comparison only.
+"""
+import argparse
+import sys
+
+from common import save_results
+from yolov4_pytorch.utils import import_time
+
+PRELOAD = "import torch, numpy"
+targets = {"non_max_suppression": ("from yolov4_pytorch.utils import non_max_suppression", True),
+           "YOLO": ("from yolov4_pytorch.model import YOLO", True),
+           "load_torchscript": ("from yolov4_pytorch.model import load_torchscript", True),
+           "training": ("from yolov4_pytorch.data import create_dataloader; "
+                        "from yolov4_pytorch.utils import YOLOLoss, plot_images", False)}
+
+
+def main():
+    preloaded = set(import_time(PRELOAD)[1])  # modules of torch and numpy
+    results, failed = [], []
+    print(f"{'entry point':>22}{'ms':>10}{'modules':>10}  forbidden modules loaded")
+    for name, (statement, budgeted) in targets.items():
+        statement = f"{PRELOAD}; {statement}"
+        us = min(import_time(statement)[0] for _ in range(args.repeat))
+        modules = [m for m in import_time(statement)[1] if m not in preloaded]
+        forbidden = sorted({m for m in modules for f in args.forbidden if m == f or m.startswith(f + ".")})
+        print(f"{name:>22}{us / 1E3:>10.1f}{len(modules):>10}  {', '.join(forbidden) if budgeted else '-'}")
+        results.append({"entry_point": name, "ms": us / 1E3, "modules": len(modules), "forbidden": forbidden})
+        if budgeted and (us / 1E3 > args.budget_ms or forbidden):
+            failed.append(name)
+
+    if args.output:
+        save_results(args.output, "import_time", args, results)
+    if failed:
+        sys.exit(f"Over the {args.budget_ms}ms import budget or loading {' '.join(args.forbidden)}: "
+                 f"{', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/import_time.py --budget-ms 250")
+    parser.add_argument("--budget-ms", type=float, default=250,
+                        help="Largest import time of an inference entry point, in ms. (default: 250)")
+    parser.add_argument("--forbidden", type=str, nargs="+",
+                        default=["matplotlib", "scipy", "tqdm", "torchvision", "PIL", "yaml"],
+                        help="Modules inference entry points must not load. "
+                             "(default: matplotlib scipy tqdm torchvision PIL yaml)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Fresh processes per entry point, the fastest is reported. (default: 3)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
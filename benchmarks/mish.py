@@ -0,0 +1,83 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Peak memory and training step time of a model for every Mish implementation.
+
+    Only ``ConvBNMish``, ``YOLOv4_Bottleneck`` and ``YOLOv4_BottleneckCSP`` take the implementation, so the config
+    has to be built from them, e.g. ``yolov4-mish.yaml``. Every measurement runs in a fresh process.
+"""
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+import yaml
+
+from common import save_results
+from common import train_step_memory
+
+MISH_MODULES = ("ConvBNMish", "YOLOv4_Bottleneck", "YOLOv4_BottleneckCSP")
+
+
+def load_config(config_file):
+    with open(config_file) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    assert any(m in MISH_MODULES for _, _, m, _ in config["backbone"] + config["head"]), \
+        f"{config_file} has no Mish modules, every implementation would build the same model"
+    return config
+
+
+def measure_in_process(config, mish, batch_size):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(train_step_memory, config, args.image_size, batch_size, args.device,
+                               args.iterations, mish=mish).result()
+
+
+def main():
+    config = load_config(args.config_file)
+    results = []
+    print(f"{'batch':>8}{'mish':>18}{'peak MB':>12}{'step ms':>12}")
+    for batch_size in args.batch_sizes:
+        for mish in args.implementations:
+            peak, seconds = measure_in_process(config, mish, batch_size)
+            print(f"{batch_size:>8}{mish:>18}{peak / 1E6:>12.1f}{seconds * 1E3:>12.1f}")
+            results.append({"batch_size": batch_size, "mish": mish, "peak_mb": peak / 1E6,
+                            "step_ms": seconds * 1E3})
+
+    if args.output:
+        save_results(args.output, "mish", args, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython benchmarks/mish.py "
+                                           "--config-file configs/COCO-Detection/yolov4-mish.yaml --batch-sizes 4 8")
+    parser.add_argument("--config-file", type=str, default="configs/COCO-Detection/yolov4-mish.yaml",
+                        help="Neural network profile path. (default: `configs/COCO-Detection/yolov4-mish.yaml`)")
+    parser.add_argument("--implementations", type=str, nargs="+",
+                        default=["plain", "memory_efficient", "scripted"],
+                        help="Mish implementations to compare. (default: plain memory_efficient scripted)")
+    parser.add_argument("--image-size", type=int, default=640,
+                        help="Size of processing picture. (default: 640)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[2, 4],
+                        help="Batch sizes to sweep. (default: 2 4)")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu",
+                        help="Device to run on. (default: cuda if available)")
+    parser.add_argument("--iterations", type=int, default=3,
+                        help="Timed training steps per measurement. (default: 3)")
+    parser.add_argument("--output", type=str, default="",
+                        help="Write the results to this JSON file. (default: ``)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
@@ -25,10 +25,13 @@ import yaml
 
 from yolov4_pytorch.data import LoadImages
 from yolov4_pytorch.data import LoadStreams
+from yolov4_pytorch.data import batch_by_shape
 from yolov4_pytorch.data import check_image_size
+from yolov4_pytorch.model import CPUInference
 from yolov4_pytorch.model import YOLO
 from yolov4_pytorch.model import apply_classifier
 from yolov4_pytorch.model import load_classifier
+from yolov4_pytorch.model import load_torchscript
 from yolov4_pytorch.utils import non_max_suppression
 from yolov4_pytorch.utils import plot_one_box
 from yolov4_pytorch.utils import scale_coords
@@ -69,17 +72,25 @@ def detect():
     os.makedirs(output)  # make new output folder
     half = device.type != "cpu"  # half precision only supported on CUDA
 
-    # Create model
-    model = YOLO(config_file=config_file, number_classes=number_classes).to(device)
-    image_size = check_image_size(args.image_size, stride=32)
-
-    # Load model
-    model.load_state_dict(torch.load(weights)["state_dict"])
-    model.float()
-    model.fuse()
-    model.eval()
-    if half:
-        model.half()  # to FP16
+    if weights.endswith(".torchscript"):  # written by export.py, no model config needed
+        model, metadata = load_torchscript(weights, device)
+        assert not metadata["half"] or half, f"{weights} is exported in FP16, which only runs on CUDA, " \
+                                             f"export it without --half to run on {device.type}"
+        names, image_size, half = metadata["names"], metadata["image_size"], metadata["half"]
+    else:
+        # Create model
+        model = YOLO(config_file=config_file, number_classes=number_classes).to(device)
+        image_size = check_image_size(args.image_size, stride=32)
+
+        # Load model
+        model.load_state_dict(torch.load(weights)["state_dict"])
+        model.float()
+        model.fuse()
+        model.eval()
+        if half:
+            model.half()  # to FP16
+        elif args.cpu_inference:
+            model = CPUInference(model, bfloat16=args.bfloat16)  # channels last, traced per image shape
 
     # Second-stage classifier
     classify = False
@@ -105,7 +116,8 @@ def detect():
         dataset = LoadStreams(source, image_size=image_size)
     else:
         save_image = True
-        dataset = LoadImages(source, image_size=image_size)
+        # Consecutive images of the same letterboxed shape run in one forward pass
+        dataset = batch_by_shape(LoadImages(source, image_size=image_size, verbose=False), args.batch_size)
 
     # Get names and colors
     colors = [[random.randint(0, 255) for _ in range(3)] for _ in range(len(names))]
@@ -115,7 +127,14 @@ def detect():
 
     image = torch.zeros((1, 3, image_size, image_size), device=device)  # init image
     _ = model(image.half() if half else image) if device.type != "cpu" else None  # run once
-    for filename, image, raw_images, video_capture in dataset:
+    for batch in dataset:
+        if camera:  # one frame per stream
+            filename, image, raw_images, _ = batch
+            contexts, frames, mode = [f"{i:g}: " for i in range(len(filename))], None, dataset.mode
+            raw_images = [x.copy() for x in raw_images]
+        else:
+            filename, image, raw_images, video, contexts, frames, mode = batch
+
         image = torch.from_numpy(image).to(device)
         image = image.half() if half else image.float()  # uint8 to fp16/32
         image /= 255.0  # 0 - 255 to 0.0 - 1.0
@@ -140,13 +159,10 @@ def detect():
 
         # Process detections
         for i, detect in enumerate(prediction):  # detections per image
-            if camera:  # batch_size >= 1
-                p, context, raw_image = filename[i], f"{i:g}: ", raw_images[i].copy()
-            else:
-                p, context, raw_image = filename, "", raw_images
+            p, context, raw_image = filename[i], contexts[i], raw_images[i]
 
             save_path = os.path.join(output, p.split("/")[-1])
-            txt_filename = f"_{dataset.frame if dataset.mode == 'video' else ''}"
+            txt_filename = f"_{frames[i] if mode == 'video' else ''}"
             txt_path = os.path.join(output, p.split("/")[-1][-4:] + txt_filename)
 
             context += f"{image.shape[2]}*{image.shape[3]} "  # get image size
@@ -186,12 +202,12 @@ def detect():
                 if cv2.waitKey(1) == ord("q"):  # q to quit
                     raise StopIteration
 
-            # Print time (inference + NMS)
-            print(f"{context}Done. {nms_time - inference_time:.3f}s")
+            # Print time (inference + NMS), shared by the images of the batch
+            print(f"{context}Done. {(nms_time - inference_time) / len(prediction):.3f}s")
 
             # Save results (image with detections)
             if save_image:
-                if dataset.mode == "images":
+                if mode == "images":
                     cv2.imwrite(save_path, raw_image)
                 else:
                     if video_path != save_path:  # new video
@@ -200,9 +216,7 @@ def detect():
                             video_writer.release()  # release previous video writer
 
                         fourcc = "mp4v"  # output video codec
-                        fps = video_capture.get(cv2.CAP_PROP_FPS)
-                        w = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
-                        h = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                        fps, w, h = video  # read by batch_by_shape() while the capture was open
                         video_writer = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*fourcc), fps, (w, h))
                     video_writer.write(raw_image)
 
@@ -220,7 +234,10 @@ if __name__ == "__main__":
     parser.add_argument("--image-size", type=int, default=640,
                         help="Size of processing picture. (default: 640)")
     parser.add_argument("--weights", type=str, default="weights/COCO-Detection/yolov5-small.pth",
-                        help="Initial weights path. (default: `weights/COCO-Detection/yolov5-small.pth`)")
+                        help="Initial weights path, or a `.torchscript` file of export.py. "
+                             "(default: `weights/COCO-Detection/yolov5-small.pth`)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Images of the same letterboxed shape run in one forward pass. (default: 1)")
     parser.add_argument("--confidence-thresholds", type=float, default=0.4,
                         help="Object confidence threshold. (default=0.4)")
     parser.add_argument("--iou-thresholds", type=float, default=0.5,
@@ -240,6 +257,10 @@ if __name__ == "__main__":
     parser.add_argument("--augment", action="store_true",
                         help="augmented inference")
     parser.add_argument("--update", action="store_true", help="update all models")
+    parser.add_argument("--cpu-inference", action="store_true",
+                        help="On CPU, run a channels last model traced and pre-packed per image shape.")
+    parser.add_argument("--bfloat16", action="store_true",
+                        help="With --cpu-inference, run under bfloat16 autocast.")
     parser.add_argument("--device", default="",
                         help="device id i.e. `0` or `0,1` or `cpu`. (default: ``).")
     args = parser.parse_args()
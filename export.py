@@ -0,0 +1,74 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import os
+import time
+
+import torch
+import yaml
+
+from yolov4_pytorch.data import check_image_size
+from yolov4_pytorch.model import YOLO
+from yolov4_pytorch.model import export_torchscript
+from yolov4_pytorch.model import load_torchscript
+from yolov4_pytorch.utils import select_device
+
+
+def export():
+    with open(args.data) as f:
+        data_dict = yaml.load(f, Loader=yaml.FullLoader)
+    number_classes, names = int(data_dict["number_classes"]), data_dict["names"]
+    output = args.output or os.path.splitext(args.weights)[0] + ".torchscript"
+
+    device = select_device(args.device)
+    half = args.half and device.type != "cpu"  # half precision only supported on CUDA
+    image_size = check_image_size(args.image_size, stride=32)
+
+    # Create and load model
+    model = YOLO(config_file=args.config_file, number_classes=number_classes).to(device)
+    model.load_state_dict(torch.load(args.weights, map_location=device)["state_dict"])
+
+    export_torchscript(model, output, names, image_size=image_size, half=half)
+    print(f"TorchScript model saved to {output} ({os.path.getsize(output) / 1E6:.1f}MB)")
+
+    # Check the file loads and runs
+    start_time = time.time()
+    module, metadata = load_torchscript(output, device)
+    image = torch.zeros((1, 3, image_size, image_size), device=device)
+    module(image.half() if half else image)
+    print(f"Loaded and ran in {time.time() - start_time:.3f}s, metadata: {metadata}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython export.py --config-file configs/COCO-Detection/yolov5-small.yaml"
+                                           " --data data/coco2017.yaml"
+                                           " --weights weights/COCO-Detection/yolov5-small.pth")
+    parser.add_argument("--config-file", type=str, default="configs/COCO-Detection/yolov5-small.yaml",
+                        help="Neural network profile path. (default: `configs/COCO-Detection/yolov5-small.yaml`)")
+    parser.add_argument("--data", type=str, default="data/coco2017.yaml",
+                        help="Path to dataset. (default: data/coco2017.yaml)")
+    parser.add_argument("--image-size", type=int, default=640,
+                        help="Size of processing picture. (default: 640)")
+    parser.add_argument("--weights", type=str, default="weights/COCO-Detection/yolov5-small.pth",
+                        help="Initial weights path. (default: `weights/COCO-Detection/yolov5-small.pth`)")
+    parser.add_argument("--output", type=str, default="",
+                        help="TorchScript file to write. (default: --weights with a `.torchscript` suffix)")
+    parser.add_argument("--half", action="store_true",
+                        help="Export in FP16, only on CUDA devices.")
+    parser.add_argument("--device", default="",
+                        help="device id i.e. `0` or `0,1` or `cpu`. (default: ``).")
+    args = parser.parse_args()
+    print(args)
+
+    export()
@@ -23,37 +23,46 @@ from rest_framework.views import APIView
 
 from yolov4_pytorch.data import LoadImages
 from yolov4_pytorch.model import YOLO
+from yolov4_pytorch.model import load_torchscript
 from yolov4_pytorch.utils import non_max_suppression
 from yolov4_pytorch.utils import plot_one_box
 from yolov4_pytorch.utils import scale_coords
 from yolov4_pytorch.utils import select_device
 
 device = select_device()
-
-# move the model to GPU for speed if available
-model = YOLO("../configs/COCO-Detection/mobilenet-v1.yaml").to(device)
-# Load weight
-model.load_state_dict(
-    torch.load("../weights/COCO-Detection/mobilenetv1.pth", map_location=device)["state_dict"])
-model.float()
-model.fuse()
-model.eval()
+weights = "../weights/COCO-Detection/mobilenetv1.pth"  # or a `.torchscript` file of export.py
 
 # Half precision
 half = device.type != "cpu"  # half precision only supported on CUDA
-if half:
-    model.half()
 
-# Get names and colors
-with open("../data/coco2017.yaml") as data_file:
-    data_dict = yaml.load(data_file, Loader=yaml.FullLoader)  # model dict
-names = data_dict["names"]
+if weights.endswith(".torchscript"):  # written by export.py, no model config needed
+    model, metadata = load_torchscript(weights, device)
+    assert not metadata["half"] or half, f"{weights} is exported in FP16, which only runs on CUDA, " \
+                                         f"export it without --half to run on {device.type}"
+    names, image_size, half = metadata["names"], metadata["image_size"], metadata["half"]
+else:
+    # move the model to GPU for speed if available
+    model = YOLO("../configs/COCO-Detection/mobilenet-v1.yaml", verbose=False).to(device)
+    # Load weight
+    model.load_state_dict(torch.load(weights, map_location=device)["state_dict"])
+    model.float()
+    model.fuse(verbose=False)
+    model.eval()
+    if half:
+        model.half()
+
+    # Get names
+    with open("../data/coco2017.yaml") as data_file:
+        data_dict = yaml.load(data_file, Loader=yaml.FullLoader)  # model dict
+    names, image_size = data_dict["names"], 640
+
+# Get colors
 colors = [[random.randint(0, 255) for _ in range(3)] for _ in range(len(names))]
 
 
 def preprocess(filename):
     # Set Dataloader
-    dataset = LoadImages(filename)
+    dataset = LoadImages(filename, image_size)
     return dataset
 
 
@@ -0,0 +1,53 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import os
+
+import yaml
+
+from yolov4_pytorch.data import LoadImagesAndLabels
+from yolov4_pytorch.data import write_shards
+
+
+def main():
+    with open(args.data) as f:
+        data_dict = yaml.load(f, Loader=yaml.FullLoader)
+
+    for split in args.splits:
+        dataset = LoadImagesAndLabels(data_dict[split])  # checks images and labels
+        output = os.path.join(args.output, split)
+        shards = write_shards(dataset, output, shard_size=int(args.shard_size * 1E6),
+                               min_shards=args.min_shards)
+        print(f"Packed {len(dataset)} images into {len(shards)} shards in {output}. "
+              f"Set `{split}: {output}` in {args.data} to train on them.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="\n\tpython scripts/pack_shards.py --data data/coco2017.yaml "
+                                           "--output ../data/coco2017/shards")
+    parser.add_argument("--data", type=str, default="data/coco2017.yaml",
+                        help="Path to dataset. (default: data/coco2017.yaml)")
+    parser.add_argument("--output", type=str, required=True,
+                        help="Output directory, every split is written to a sub directory.")
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"],
+                        help="Dataset splits to pack. (default: train val)")
+    parser.add_argument("--shard-size", type=float, default=1000,
+                        help="Approximate size of every shard in MB. (default: 1000)")
+    parser.add_argument("--min-shards", type=int, default=1,
+                        help="Write at least this many shards per split, the number of DDP ranks x dataloader workers "
+                             "of the training runs, smaller shards are written if needed. (default: 1)")
+    args = parser.parse_args()
+    print(args)
+
+    main()
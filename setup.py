@@ -17,7 +17,7 @@ DESCRIPTION = 'Pytorch implements yolov4.Good performance, easy to use, fast spe
 URL = 'https://github.com/Lornatang/YOLOv4-PyTorch'
 EMAIL = 'liuchangyu1111@gmail.com'
 AUTHOR = 'Liu Changyu'
-REQUIRES_PYTHON = '>=3.6.5'
+REQUIRES_PYTHON = '>=3.7'
 VERSION = '0.1.0'
 
 # What packages are required for this module to be executed?
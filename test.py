@@ -25,12 +25,14 @@ import yaml
 from tqdm import tqdm
 
 from yolov4_pytorch.data import create_dataloader
+from yolov4_pytorch.model import CPUInference
 from yolov4_pytorch.model import YOLO
+from yolov4_pytorch.model import load_torchscript
+from yolov4_pytorch.utils import YOLOLoss
 from yolov4_pytorch.utils import ap_per_class
 from yolov4_pytorch.utils import box_iou
 from yolov4_pytorch.utils import clip_coords
 from yolov4_pytorch.utils import coco80_to_coco91_class
-from yolov4_pytorch.utils import compute_loss
 from yolov4_pytorch.utils import non_max_suppression
 from yolov4_pytorch.utils import scale_coords
 from yolov4_pytorch.utils import select_device
@@ -52,7 +54,12 @@ def evaluate(config_file="configs/COCO-Detection/yolov5-small.yaml",
              verbose=False,
              save_txt=False,
              model=None,
-             dataloader=None):
+             dataloader=None,
+             workers=8,
+             prefetch_factor=2,
+             criterion=None,
+             cpu_inference=False,
+             bfloat16=False):
     with open(data) as f:
         data_dict = yaml.load(f, Loader=yaml.FullLoader)
     number_classes, names = int(data_dict["number_classes"]), data_dict["names"]
@@ -62,6 +69,8 @@ def evaluate(config_file="configs/COCO-Detection/yolov5-small.yaml",
     training = model is not None
     if training:  # called by train.py
         device = next(model.parameters()).device  # get model device
+        if criterion is None:
+            criterion = YOLOLoss(model).to(device)
 
     else:  # called directly
         device = select_device(args.device, batch_size=args.batch_size)
@@ -70,19 +79,31 @@ def evaluate(config_file="configs/COCO-Detection/yolov5-small.yaml",
                 shutil.rmtree("outputs")  # delete output folder
             os.makedirs("outputs")  # make new output folder
 
-        # Create model
-        model = YOLO(config_file=config_file, number_classes=number_classes).to(device)
+        if weights.endswith(".torchscript"):  # written by export.py, no model config needed
+            model, metadata = load_torchscript(weights, device)
+            assert len(metadata["names"]) == number_classes, \
+                f"{weights} has {len(metadata['names'])} classes, {data} has {number_classes}"
+        else:
+            # Create model
+            model = YOLO(config_file=config_file, number_classes=number_classes).to(device)
 
-        # Load model
-        model.load_state_dict(torch.load(weights)["state_dict"])
-        model.float()
-        model.fuse()
-        model.eval()
+            # Load model
+            model.load_state_dict(torch.load(weights)["state_dict"])
+            model.float()
+            model.fuse()
+            model.eval()
 
     # Half
     half = device.type != "cpu"  # half precision only supported on CUDA
-    if half:
+    if isinstance(model, torch.jit.ScriptModule):  # the precision is frozen at export
+        assert not metadata["half"] or half, f"{weights} is exported in FP16, which only runs on CUDA, " \
+                                             f"export it without --half to run on {device.type}"
+        half, image_size = metadata["half"], metadata["image_size"]
+    elif half:
         model.half()
+    elif cpu_inference and not training:
+        # Eager, rect batches change the input shape too often for tracing per shape to pay off
+        model = CPUInference(model, bfloat16=bfloat16, trace=False)
 
     # Configure
     model.eval()
@@ -102,7 +123,10 @@ def evaluate(config_file="configs/COCO-Detection/yolov5-small.yaml",
                                                 hyper_parameters=None,
                                                 augment=False,
                                                 cache=False,
-                                                rect=True)
+                                                rect=True,
+                                                workers=workers,
+                                                prefetch_factor=prefetch_factor,
+                                                persistent_workers=False)  # iterated once
 
     seen = 0
     coco91class = coco80_to_coco91_class()
@@ -127,7 +151,7 @@ def evaluate(config_file="configs/COCO-Detection/yolov5-small.yaml",
 
             # Compute loss
             if training:  # if model has loss hyper parameters
-                loss += compute_loss([x.float() for x in outputs], targets, model)[1][:3]  # GIoU, obj, cls
+                loss += criterion([x.float() for x in outputs], targets)[1][:3]  # GIoU, obj, cls
 
             # Run NMS
             t = time_synchronized()
@@ -283,7 +307,8 @@ if __name__ == "__main__":
     parser.add_argument("--image-size", type=int, default=640,
                         help="Size of processing picture. (default: 640)")
     parser.add_argument("--weights", type=str, default="weights/COCO-Detection/yolov5-small.pth",
-                        help="Initial weights path. (default: `weights/COCO-Detection/yolov5-small.pth`)")
+                        help="Initial weights path, or a `.torchscript` file of export.py. "
+                             "(default: `weights/COCO-Detection/yolov5-small.pth`)")
     parser.add_argument("--confidence-thresholds", type=float, default=0.001,
                         help="Object confidence threshold. (default=0.001)")
     parser.add_argument("--iou-thresholds", type=float, default=0.65,
@@ -297,6 +322,14 @@ if __name__ == "__main__":
     parser.add_argument("--save-txt", action="store_true", help="save results to *.txt")
     parser.add_argument("--device", default="",
                         help="device id i.e. `0` or `0,1` or `cpu`. (default: ``).")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="Maximum number of dataloader workers, limited by the available CPUs. (default: 8)")
+    parser.add_argument("--prefetch-factor", type=int, default=2,
+                        help="Number of batches loaded in advance by each worker. (default: 2)")
+    parser.add_argument("--cpu-inference", action="store_true",
+                        help="On CPU, run a channels last model.")
+    parser.add_argument("--bfloat16", action="store_true",
+                        help="With --cpu-inference, run under bfloat16 autocast.")
     args = parser.parse_args()
     args.save_json |= args.data.endswith("coco2014.yaml") or args.data.endswith("coco2017.yaml")
 
@@ -313,4 +346,8 @@ if __name__ == "__main__":
              merge=args.merge,
              augment=args.augment,
              verbose=args.verbose,
-             save_txt=args.save_txt)
+             save_txt=args.save_txt,
+             workers=args.workers,
+             prefetch_factor=args.prefetch_factor,
+             cpu_inference=args.cpu_inference,
+             bfloat16=args.bfloat16)
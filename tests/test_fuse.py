@@ -0,0 +1,71 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    YOLO.fuse() folds every BatchNorm2d into a convolution without changing the predictions.
+"""
+import glob
+import os
+
+import pytest
+import torch
+import torch.nn as nn
+
+from yolov4_pytorch.model import YOLO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIGS = sorted(glob.glob(os.path.join(ROOT, "configs", "**", "*.yaml"), recursive=True))
+
+# Every block with a BatchNorm, the ones not used by the shipped configs included
+anchors = [[10, 13, 16, 30, 33, 23], [30, 61, 62, 45, 59, 119], [116, 90, 156, 198, 373, 326]]
+BLOCKS = {"number_classes": 4, "depth_multiple": 1.0, "width_multiple": 1.0, "anchors": anchors,
+          "backbone": [[-1, 1, "Focus", [16, 3]],  # 0-P1/2
+                       [-1, 1, "ConvBNMish", [32, 3, 2]],  # 1-P2/4
+                       [-1, 2, "YOLOv4_BottleneckCSP", [32]],  # BN after the concat
+                       [-1, 1, "Conv", [64, 3, 2]],  # 3-P3/8
+                       [-1, 2, "C3", [64]],  # BN after the concat
+                       [-1, 1, "MixConv2d", [64, [1, 3]]],  # BN after the concat
+                       [-1, 1, "Conv", [128, 3, 2]],  # 6-P4/16
+                       [-1, 2, "BottleneckCSP", [128]],  # BN after the concat
+                       [-1, 1, "nn.Conv2d", [128, 3, 2, 1]],  # 8-P5/32
+                       [-1, 1, "nn.BatchNorm2d", []]],  # BN layer in YAML
+          "head": [[[5, 7, 9], 1, "Detect", ["number_classes", "anchors"]]]}
+
+
+def randomize_batchnorm(model, seed=0):
+    # Random statistics and affine parameters, so folding them is not a no-op
+    generator = torch.Generator().manual_seed(seed)
+    with torch.no_grad():
+        for m in model.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.weight.copy_(torch.rand(m.num_features, generator=generator) + 0.5)
+                m.bias.copy_(torch.randn(m.num_features, generator=generator) * 0.1)
+                m.running_mean.copy_(torch.randn(m.num_features, generator=generator) * 0.1)
+                m.running_var.copy_(torch.rand(m.num_features, generator=generator) + 0.5)
+
+
+@pytest.mark.parametrize("config", CONFIGS + [BLOCKS],
+                         ids=[os.path.relpath(c, ROOT) for c in CONFIGS] + ["blocks"])
+def test_fuse(config):
+    torch.manual_seed(0)
+    model = YOLO(config, verbose=False).eval()
+    randomize_batchnorm(model)
+    images = torch.rand(2, 3, 128, 160)
+    with torch.no_grad():
+        reference = model(images)[0]
+        model.fuse(verbose=False)
+        prediction = model(images)[0]
+
+    assert not any(isinstance(m, nn.BatchNorm2d) for m in model.modules()), "BatchNorm2d left after fuse()"
+    assert torch.allclose(prediction, reference, rtol=1e-4, atol=1e-4), \
+        f"fuse() changed the predictions by {(prediction - reference).abs().max().item():.3g}"
@@ -0,0 +1,31 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    The inference entry points import within a time budget and without plotting or training dependencies.
+"""
+from yolov4_pytorch.utils import import_time
+
+PRELOAD = "import torch, numpy"  # not counted, every entry point needs them
+BUDGET_MS = 250
+FORBIDDEN = ("matplotlib", "scipy", "tqdm", "torchvision", "PIL", "yaml")
+
+
+def test_non_max_suppression_import():
+    statement = f"{PRELOAD}; from yolov4_pytorch.utils import non_max_suppression"
+    preloaded = set(import_time(PRELOAD)[1])
+    us, modules = min(import_time(statement) for _ in range(3))  # fastest of 3 fresh processes
+
+    forbidden = sorted({m for m in modules if m not in preloaded and m.split(".")[0] in FORBIDDEN})
+    assert not forbidden, f"non_max_suppression imports {', '.join(forbidden)}"
+    assert us / 1E3 < BUDGET_MS, f"non_max_suppression imports in {us / 1E3:.1f}ms, over {BUDGET_MS}ms"
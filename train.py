@@ -34,7 +34,8 @@ from yolov4_pytorch.data import check_image_size
 from yolov4_pytorch.data import create_dataloader
 from yolov4_pytorch.model import YOLO
 from yolov4_pytorch.solver import ModelEMA
-from yolov4_pytorch.utils import compute_loss
+from yolov4_pytorch.utils import StageTimer
+from yolov4_pytorch.utils import YOLOLoss
 from yolov4_pytorch.utils import fitness
 from yolov4_pytorch.utils import init_seeds
 from yolov4_pytorch.utils import select_device
@@ -57,6 +58,7 @@ hyper_parameters = {"lr0": 0.01,  # initial learning rate
                     "degrees": 0.0,  # image rotation (+/- deg)
                     "translate": 0.0,  # image translation (+/- fraction)
                     "scale": 0.5,  # image scale (+/- gain)
+                    "batch_scale": 0.0,  # batch scale jitter with --batch-augment (+/- gain)
                     "shear": 0.0}  # image shear (+/- deg)
 
 
@@ -71,7 +73,7 @@ def train():
     device = select_device(args.device, batch_size=args.batch_size)
 
     # Configure
-    init_seeds(0)
+    init_seeds(args.seed)
     with open(data) as f:
         data_dict = yaml.load(f, Loader=yaml.FullLoader)
     train_path, val_path = data_dict["train"], data_dict["val"]
@@ -79,7 +81,9 @@ def train():
     assert len(names) == number_classes, f"{len(names)} names found, number_classes={number_classes} dataset in {data}"
 
     # Create model
-    model = YOLO(config_file=config_file, number_classes=number_classes).to(device)
+    model = YOLO(config_file=config_file, number_classes=number_classes, mish=args.mish).to(device)
+    if args.checkpoint_layers is not None:  # else as set in the model YAML
+        model.set_checkpoint(True if args.checkpoint_layers == [] else args.checkpoint_layers)
 
     # Optimizer
     accumulate = max(round(64 / batch_size), 1)  # accumulate loss before optimizing
@@ -156,16 +160,28 @@ def train():
                                                         hyper_parameters=hyper_parameters,
                                                         augment=True,
                                                         cache=args.cache_images,
-                                                        rect=False)
+                                                        rect=False,
+                                                        workers=args.workers,
+                                                        prefetch_factor=args.prefetch_factor,
+                                                        persistent_workers=args.persistent_workers,
+                                                        shuffle=True,
+                                                        seed=args.seed,
+                                                        batch_augment=args.batch_augment,
+                                                        buckets=args.buckets,
+                                                        scales=(0.5, 1.5) if args.multi_scale else None,
+                                                        scale_interval=args.scale_interval)
     _, val_dataloader = create_dataloader(dataroot=val_path,
                                           image_size=image_size,
                                           batch_size=batch_size,
                                           hyper_parameters=hyper_parameters,
                                           augment=False,
                                           cache=args.cache_images,
-                                          rect=True)
+                                          rect=True,
+                                          workers=args.val_workers,  # runs once per epoch, leave cores to training
+                                          prefetch_factor=args.prefetch_factor,
+                                          persistent_workers=args.persistent_workers)
 
-    mlc = np.concatenate(train_dataset.labels, 0)[:, 0].max()  # max label class
+    mlc = train_dataset.labels.flat()[0][:, 0].max()  # max label class
     number_batches = len(train_dataloader)
     assert mlc < number_classes, f"Label class {mlc} exceeds number_classes={number_classes} in {args.data}. " \
                                  f"Possible class labels are 0-{number_classes - 1}"
@@ -181,6 +197,9 @@ def train():
     # Check anchors
     check_anchors(train_dataset, model=model, thr=hyper_parameters["anchor_t"], image_size=image_size)
 
+    # Loss, built once after the anchors are final
+    criterion = YOLOLoss(model).to(device)
+
     # Start training
     start_time = time.time()
     pre_steps = max(3 * number_batches, 1000)  # number of warmup iterations, max(3 epochs, 1k iterations)
@@ -194,8 +213,17 @@ def train():
     # Creates a GradScaler once at the beginning of training.
     scaler = amp.GradScaler()
 
+    # Wall time of every stage of an iteration
+    timer = StageTimer(device, enabled=args.profile_stages)
+
     for epoch in range(start_epoch, epochs):
         model.train()
+        if hasattr(train_dataloader.sampler, "set_epoch"):  # DistributedSampler, reshuffle every epoch
+            train_dataloader.sampler.set_epoch(epoch)
+        if hasattr(train_dataloader.batch_sampler, "set_epoch"):  # AspectRatioBatchSampler, new buckets and sizes
+            train_dataloader.batch_sampler.set_epoch(epoch)
+        if hasattr(train_dataset, "set_epoch"):  # sharded dataset, reshuffle shards
+            train_dataset.set_epoch(epoch)
 
         mean_losses = torch.zeros(4, device=device)
         print("\n")
@@ -205,9 +233,13 @@ def train():
         progress_bar = enumerate(train_dataloader)
         progress_bar = tqdm(progress_bar, total=number_batches)
         optimizer.zero_grad()
+        timer.reset()
         for i, (images, targets, paths, _) in progress_bar:
+            timer.lap("data")  # waiting for the dataloader
             ni = i + number_batches * epoch  # number integrated batches (since train start)
             images = images.to(device, non_blocking=True).float() / 255.0  # uint8 to float32, 0 - 255 to 0.0 - 1.0
+            targets = targets.to(device)
+            timer.lap("to_device")
 
             # Warm up
             if ni <= pre_steps:
@@ -222,7 +254,9 @@ def train():
             # Mixed precision training
             with amp.autocast():
                 outputs = model(images)
-                loss, loss_items = compute_loss(outputs, targets.to(device), model)  # scaled by batch_size
+                timer.lap("forward")
+                loss, loss_items = criterion(outputs, targets)  # scaled by batch_size
+                timer.lap("loss")
 
             if not torch.isfinite(loss):
                 print(f"WARNING: non-finite loss, ending training {loss_items}")
@@ -232,13 +266,16 @@ def train():
             # Backward passes under autocast are not recommended.
             # Backward ops run in the same dtype autocast chose for corresponding forward ops.
             scaler.scale(loss).backward()
+            timer.lap("backward")
 
             # Optimize
             if ni % accumulate == 0:
                 scaler.step(optimizer)
                 scaler.update()
                 optimizer.zero_grad()
+                timer.lap("optimizer")
                 ema.update(model)
+                timer.lap("ema")
 
             # Print
             mean_losses = (mean_losses * i + loss_items) / (i + 1)  # update mean losses
@@ -246,6 +283,13 @@ def train():
                                          f"{mean_losses[0]:>10.4f}{mean_losses[1]:>10.4f}"
                                          f"{mean_losses[2]:>10.4f}{mean_losses[3]:>10.4f}"
                                          f"{targets.shape[0]:>10}{images.shape[-1]:>10}")
+            if ni % args.profile_interval == 0:
+                timer.write(tb_writer, ni)
+            timer.lap("log")
+
+        # Per stage timings of this epoch
+        timer.save(os.path.join(tb_writer.log_dir, "timings.json"), epoch)
+        timer.clear()
 
         # Scheduler
         scheduler.step()
@@ -259,7 +303,8 @@ def train():
                                  image_size=image_size,
                                  save_json=save_json,
                                  model=ema.ema.module if hasattr(ema.ema, "module") else ema.ema,
-                                 dataloader=val_dataloader)
+                                 dataloader=val_dataloader,
+                                 criterion=criterion)
 
         # Tensorboard
         tags = ["train/giou_loss", "train/obj_loss", "train/cls_loss",
@@ -310,14 +355,54 @@ if __name__ == "__main__":
     parser.add_argument("--resume", action="store_true",
                         help="resume training from `weights/checkpoint.pth`")
     parser.add_argument("--cache-images", action="store_true",
-                        help="cache images for faster training.")
+                        help="cache resized images in a memory-mapped file for faster training.")
     parser.add_argument("--weights", type=str, default="",
                         help="Initial weights path. (default: ``)")
     parser.add_argument("--device", default="",
                         help="device id i.e. `0` or `0,1` or `cpu`. (default: ``).")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="Maximum number of dataloader workers, limited by the available CPUs. (default: 8)")
+    parser.add_argument("--val-workers", type=int, default=2,
+                        help="Maximum number of validation dataloader workers. (default: 2)")
+    parser.add_argument("--prefetch-factor", type=int, default=2,
+                        help="Number of batches loaded in advance by each worker. (default: 2)")
+    parser.add_argument("--no-persistent-workers", dest="persistent_workers", action="store_false",
+                        help="Restart dataloader workers every epoch instead of keeping them alive.")
+    parser.add_argument("--batch-augment", action="store_true",
+                        help="HSV jitter and flips on whole batches in a background thread, "
+                             "workers only decode and mosaic. Allows fewer --workers.")
+    parser.add_argument("--buckets", type=int, default=0,
+                        help="Train on rectangular batches of similar aspect ratio from this many buckets, "
+                             "turns off mosaic. (default: 0)")
+    parser.add_argument("--multi-scale", action="store_true",
+                        help="Vary the image size per batch between 0.5x and 1.5x --image-size.")
+    parser.add_argument("--scale-interval", type=int, default=10,
+                        help="Number of batches between image size changes with --multi-scale. (default: 10)")
+    parser.add_argument("--checkpoint-layers", type=int, nargs="*", default=None,
+                        help="Recompute the activations of these layers during backward to save memory, "
+                             "every backbone layer if no index is given. "
+                             "(default: the `checkpoint_layers` key of --config-file)")
+    parser.add_argument("--no-checkpoint-layers", dest="checkpoint_layers", action="store_const", const=False,
+                        help="Keep the activations of every layer, "
+                             "overrides the `checkpoint_layers` key of --config-file.")
+    parser.add_argument("--mish", type=str, default=None, choices=["plain", "memory_efficient", "scripted"],
+                        help="Mish implementation of the YOLOv4 modules, e.g. in `yolov4-mish.yaml`, "
+                             "`memory_efficient` and `scripted` keep only the input for backward. "
+                             "(default: the `mish` key of --config-file, else `plain`)")
+    parser.add_argument("--profile-stages", action="store_true",
+                        help="Time the data, forward, loss, backward, optimizer and EMA stages of every iteration, "
+                             "write them to TensorBoard and a timings.json summary per epoch. "
+                             "Synchronizes the GPU after every stage.")
+    parser.add_argument("--profile-interval", type=int, default=100,
+                        help="Iterations between TensorBoard timing histograms. (default: 100)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for initializing training and shuffling. (default: 0)")
     args = parser.parse_args()
     print(args)
 
+    # format short g, %precision=5
+    np.set_printoptions(linewidth=320, formatter={"float_kind": "{:11.5g}".format})
+
     # Train
     print("Start Tensorboard with `tensorboard --logdir=runs`, view at http://localhost:6006/")
     tb_writer = SummaryWriter()
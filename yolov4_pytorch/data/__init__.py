@@ -11,25 +11,48 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-from .common import check_image_size
-from .common import create_folder
-from .common import exif_size
-from .common import letterbox
-from .common import random_affine
-from .image import LoadImages
-from .image import LoadImagesAndLabels
-from .image import augment_hsv
-from .image import check_anchor_order
-from .image import check_anchors
-from .image import create_dataloader
-from .image import kmean_anchors
-from .image import load_image
-from .image import load_mosaic
-from .image import scale_image
-from .video import LoadStreams
-from .video import LoadWebcam
+"""
+    Attributes are imported from their submodule on first use, so that e.g. the inference core does not
+    load datasets, augmentation and dataloaders until they are needed.
+"""
+from ..utils.lazy import lazy_attributes
+
+_submodules = {
+    "BatchAugment": "augment",
+    "BatchAugmentLoader": "augment",
+    "check_image_size": "common",
+    "create_folder": "common",
+    "exif_size": "common",
+    "letterbox": "common",
+    "random_affine": "common",
+    "LoadImages": "image",
+    "LoadImagesAndLabels": "image",
+    "augment_hsv": "image",
+    "batch_by_shape": "image",
+    "check_anchor_order": "image",
+    "check_anchors": "image",
+    "create_dataloader": "image",
+    "get_num_workers": "image",
+    "kmean_anchors": "image",
+    "load_image": "image",
+    "load_mosaic": "image",
+    "read_image": "image",
+    "scale_image": "image",
+    "LabelStore": "labels",
+    "AspectRatioBatchSampler": "sampler",
+    "LoadShards": "shard",
+    "is_shards": "shard",
+    "read_shard": "shard",
+    "write_shards": "shard",
+    "LoadStreams": "video",
+    "LoadWebcam": "video",
+}
+
+__getattr__, __dir__ = lazy_attributes(__name__, _submodules)
 
 __all__ = [
+    "BatchAugment",
+    "BatchAugmentLoader",
     "check_image_size",
     "create_folder",
     "exif_size",
@@ -38,13 +61,22 @@ __all__ = [
     "LoadImages",
     "LoadImagesAndLabels",
     "augment_hsv",
+    "batch_by_shape",
     "check_anchor_order",
     "check_anchors",
     "create_dataloader",
+    "get_num_workers",
     "kmean_anchors",
     "load_image",
     "load_mosaic",
+    "read_image",
     "scale_image",
+    "LabelStore",
+    "AspectRatioBatchSampler",
+    "LoadShards",
+    "is_shards",
+    "read_shard",
+    "write_shards",
     "LoadStreams",
     "LoadWebcam",
 ]
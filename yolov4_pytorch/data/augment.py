@@ -0,0 +1,173 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Batch level augmentation of collated uint8 batches with vectorized torch ops.
+"""
+from queue import Queue
+from threading import Event
+from threading import Thread
+
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugment:
+    """ HSV jitter, left-right flip and scale jitter of a whole batch.
+
+    Runs on the stacked ``uint8`` batch after collate, so dataloader workers only decode and
+    mosaic. Every image gets its own random gains, flip and scale, and the work is spread over
+    torch intra-op threads.
+
+    Args:
+        hgain (float, optional): Hue gain, like ``hyper_parameters['hsv_h']``. (default: ``0.015``)
+        sgain (float, optional): Saturation gain, like ``hyper_parameters['hsv_s']``. (default: ``0.7``)
+        vgain (float, optional): Value gain, like ``hyper_parameters['hsv_v']``. (default: ``0.4``)
+        lr_flip (float, optional): Probability of a left-right flip. (default: ``0.5``)
+        scale (float, optional): Scale jitter around the image center, in ``1 +/- scale``. (default: ``0.0``)
+        seed (int, optional): Seed of the random generator. (default: ``0``)
+
+    """
+
+    def __init__(self, hgain=0.015, sgain=0.7, vgain=0.4, lr_flip=0.5, scale=0.0, seed=0):
+        self.gains = torch.tensor([hgain, sgain, vgain])
+        self.lr_flip = lr_flip
+        self.scale = scale
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def __call__(self, images, targets):
+        """ Augment a batch.
+
+        Args:
+            images (torch.Tensor): RGB uint8 images, shape(b, 3, h, w).
+            targets (torch.Tensor): Labels ``image, class, x, y, w, h``, normalized, shape(n, 6).
+
+        Returns:
+            The augmented uint8 images and labels.
+
+        """
+        b = images.shape[0]
+        r = torch.rand(b, 3, generator=self.generator)
+
+        x = images.float().div_(255)
+        if self.gains.any():
+            gains = (r * 2 - 1) * self.gains + 1  # random gains, shape(b, 3)
+            x = augment_hsv(x, gains)
+        if self.scale > 0:
+            scale = 1 + (torch.rand(b, generator=self.generator) * 2 - 1) * self.scale
+            x, targets = scale_jitter(x, targets, scale)
+        if self.lr_flip > 0:
+            flip = torch.rand(b, generator=self.generator) < self.lr_flip
+            x[flip] = x[flip].flip(-1)
+            if len(targets):
+                i = flip[targets[:, 0].long()]
+                targets[i, 2] = 1 - targets[i, 2]
+
+        images = x.mul_(255).round_().clamp_(0, 255).to(torch.uint8)
+        return images, targets
+
+
+def augment_hsv(x, gains):
+    # RGB to HSV, scale by gains and back in one pass over the batch
+    # x: RGB in 0 - 1, shape(b, 3, h, w), gains: hue, saturation and value gains, shape(b, 3)
+    gains = gains.to(x.dtype).view(-1, 3, 1, 1)
+    maxc, argmax = x.max(1, keepdim=True)  # shape(b, 1, h, w)
+    delta = maxc - x.min(1, keepdim=True)[0]
+    r, g, b = x.split(1, 1)
+    h = torch.where(argmax == 0, (g - b) / delta, torch.where(argmax == 1, (b - r) / delta + 2, (r - g) / delta + 4))
+    h = h.nan_to_num_(0).remainder_(6).mul_(gains[:, 0:1])  # hue in sixths of the circle, 0 for gray
+    s = (delta / maxc).nan_to_num_(0).mul_(gains[:, 1:2]).clamp_(0, 1)
+    v = (maxc * gains[:, 2:3]).clamp_(0, 1)
+
+    # HSV to RGB, channel c is v - v * s * clamp(min(k, 4 - k), 0, 1) with k = (n_c + h) mod 6
+    k = (torch.tensor([5., 3., 1.], dtype=x.dtype).view(1, 3, 1, 1) + h).remainder_(6)
+    k = torch.min(k, 4 - k).clamp_(0, 1)
+    return k.mul_(s.mul_(v).neg_()).add_(v)
+
+
+def scale_jitter(x, targets, scale, border=114 / 255):
+    # scales every image by scale[i] around its center at constant size, pads with the border color
+    b = x.shape[0]
+    theta = torch.zeros(b, 2, 3, dtype=x.dtype)
+    theta[:, 0, 0] = theta[:, 1, 1] = 1 / scale  # output to input coordinates
+    grid = F.affine_grid(theta, list(x.shape), align_corners=False)
+    x = F.grid_sample(x - border, grid, mode="bilinear", padding_mode="zeros", align_corners=False).add_(border)
+
+    if len(targets):
+        s = scale[targets[:, 0].long()][:, None]
+        xy = (targets[:, 2:4] - 0.5) * s + 0.5
+        wh = targets[:, 4:6] * s
+        x1y1, x2y2 = (xy - wh / 2).clamp(0, 1), (xy + wh / 2).clamp(0, 1)
+        size = torch.tensor([x.shape[3], x.shape[2]], dtype=x.dtype)
+        i = ((x2y2 - x1y1) * size > 2).all(1)  # reject boxes pushed out of the image
+        targets = torch.cat((targets[:, :2], (x1y1 + x2y2) / 2, x2y2 - x1y1), 1)[i]
+    return x, targets
+
+
+class BatchAugmentLoader:
+    """ Wrap a DataLoader and apply a ``BatchAugment`` to every batch in a background thread.
+
+    torch ops release the GIL, so augmenting the next batch overlaps with the training step.
+    Other attributes are forwarded to the DataLoader.
+
+    Args:
+        dataloader (DataLoader): Loader returning ``(images, targets, paths, shapes)`` batches.
+        augment (BatchAugment): Batch augmentation.
+        prefetch (int, optional): Augmented batches kept ready. (default: ``2``)
+
+    """
+
+    def __init__(self, dataloader, augment, prefetch=2):
+        self.dataloader = dataloader
+        self.augment = augment
+        self.prefetch = prefetch
+        self.pin_memory = dataloader.pin_memory and torch.cuda.is_available()
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["dataloader"], name)
+
+    def __iter__(self):
+        queue, stop = Queue(maxsize=self.prefetch), Event()
+        thread = Thread(target=self._run, args=(queue, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = queue.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:  # also reached when the consumer stops early
+            stop.set()
+            while thread.is_alive():
+                if not queue.empty():
+                    queue.get_nowait()  # unblock a pending put()
+                thread.join(0.01)
+
+    def _run(self, queue, stop):
+        try:
+            for images, targets, *rest in self.dataloader:
+                if stop.is_set():
+                    return
+                images, targets = self.augment(images, targets)
+                if self.pin_memory:
+                    images = images.pin_memory()
+                queue.put((images, targets, *rest))
+        except Exception as e:  # re-raised in the consumer
+            queue.put(e)
+            return
+        queue.put(None)
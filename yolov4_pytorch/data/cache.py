@@ -0,0 +1,115 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from tqdm import tqdm
+
+
+class ImageCache:
+    """ Persistent memory-mapped cache of resized dataset images.
+
+    All images are stored back to back in one flat uint8 file, with an index file
+    holding the byte offsets, the original and the resized shapes of every image.
+    The data file is opened with ``np.memmap``, so every DataLoader worker (and every
+    later run) reads the same page cache instead of holding a private copy.
+
+    Args:
+        path (str): Path of the data file, the index is stored at ``path + '.index.npz'``.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        index = np.load(index_path(path))
+        self.offsets = index["offsets"]  # byte offsets, shape(n + 1)
+        self.hw0 = index["hw0"]  # original hw, shape(n, 2)
+        self.hw = index["hw"]  # resized hw, shape(n, 2)
+        self.fingerprint = str(index["fingerprint"])
+        self.nbytes = int(self.offsets[-1])
+        self._data = None
+
+    def __len__(self):
+        return len(self.hw)
+
+    def __getitem__(self, index):
+        if self._data is None:  # open lazily, once per process
+            self._data = np.memmap(self.path, dtype=np.uint8, mode="r", shape=(self.nbytes,))
+        h, w = self.hw[index]
+        image = self._data[self.offsets[index]:self.offsets[index + 1]].reshape(h, w, 3)  # zero-copy view
+        return image, tuple(self.hw0[index]), (h, w)  # img, hw_original, hw_resized
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None  # never pickle the mapped data into spawned workers
+        return state
+
+
+def index_path(path):
+    return path + ".index.npz"
+
+
+def open_image_cache(path, fingerprint):
+    """ Open an existing image cache if it was built for the same dataset.
+
+    Args:
+        path (str): Path of the cache data file.
+        fingerprint (str): Fingerprint of the dataset the cache must match.
+
+    Returns:
+        An ``ImageCache``, or ``None`` if the cache is missing or stale.
+
+    """
+    if not (os.path.isfile(path) and os.path.isfile(index_path(path))):
+        return None
+    try:
+        cache = ImageCache(path)
+    except Exception:  # unreadable or truncated index
+        return None
+    if cache.fingerprint != fingerprint or os.path.getsize(path) != cache.nbytes:
+        return None
+    return cache
+
+
+def create_image_cache(path, files, load_fn, fingerprint, workers=8):
+    """ Decode and resize every image once, and write them into a memory-mapped cache.
+
+    Args:
+        path (str): Path of the cache data file.
+        files (list): Image file paths, in dataset order.
+        load_fn (callable): Maps an image path to ``(img, hw_original, hw_resized)``.
+        fingerprint (str): Fingerprint of the dataset, stored in the index.
+        workers (int, optional): Number of decoding threads. (default: ``8``)
+
+    Returns:
+        The new ``ImageCache``.
+
+    """
+    n = len(files)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    hw0, hw = np.zeros((n, 2), dtype=np.int64), np.zeros((n, 2), dtype=np.int64)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f, ThreadPool(workers) as pool:
+        pbar = tqdm(enumerate(pool.imap(load_fn, files)), total=n, desc="Caching images")
+        for i, (image, image_hw0, image_hw) in pbar:  # cv2 releases the GIL, decode in threads
+            f.write(np.ascontiguousarray(image).tobytes())
+            hw0[i], hw[i] = image_hw0, image_hw
+            offsets[i + 1] = offsets[i] + image.nbytes
+            pbar.desc = f"Caching images ({offsets[i + 1] / 1E9:.1f}GB)"
+
+    np.savez(tmp + ".index.npz", offsets=offsets, hw0=hw0, hw=hw, fingerprint=np.array(fingerprint))
+    os.replace(tmp + ".index.npz", index_path(path))
+    os.replace(tmp, path)  # data last, so a crash never leaves a valid-looking cache
+    return ImageCache(path)
@@ -81,7 +81,26 @@ def exif_size(image):
 
 def letterbox(img, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True):
     # Resize image to a 32-pixel-multiple rectangle https://github.com/ultralytics/yolov3/issues/232
-    shape = img.shape[:2]  # current shape [height, width]
+    ratio, (dw, dh), new_unpad, (top, bottom, left, right) = letterbox_params(img.shape[:2], new_shape, auto,
+                                                                              scaleFill, scaleup)
+    if img.shape[1::-1] != new_unpad:  # resize
+        img = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
+    return img, ratio, (dw, dh)
+
+
+def letterbox_params(shape, new_shape=(640, 640), auto=True, scaleFill=False, scaleup=True):
+    """ Geometry of ``letterbox()`` without touching the image.
+
+    Args:
+        shape (tuple): Image (height, width).
+        new_shape, auto, scaleFill, scaleup: See ``letterbox()``.
+
+    Returns:
+        The (width, height) ratios, the (width, height) padding of each side, the resized (width, height)
+        and the integer (top, bottom, left, right) borders.
+
+    """
     if isinstance(new_shape, int):
         new_shape = (new_shape, new_shape)
 
@@ -104,12 +123,9 @@ def letterbox(img, new_shape=(640, 640), color=(114, 114, 114), auto=True, scale
     dw /= 2  # divide padding into 2 sides
     dh /= 2
 
-    if shape[::-1] != new_unpad:  # resize
-        img = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
     top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
     left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
-    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
-    return img, ratio, (dw, dh)
+    return ratio, (dw, dh), new_unpad, (top, bottom, left, right)
 
 
 def random_affine(image, targets=(), degrees=10, translate=.1, scale=.1, shear=10, border=(0, 0)):
@@ -142,18 +158,39 @@ def random_affine(image, targets=(), degrees=10, translate=.1, scale=.1, shear=1
     height = image.shape[0] + border[0] * 2  # shape(h,w,c)
     width = image.shape[1] + border[1] * 2
 
+    M, s = random_affine_matrix(image.shape[:2], degrees, translate, scale, shear, border)
+    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
+        image = cv2.warpAffine(image, M[:2], dsize=(width, height), flags=cv2.INTER_LINEAR, borderValue=(114, 114, 114))
+
+    # Transform label coordinates
+    targets = warp_targets(targets, M, s, width, height)
+
+    return image, targets
+
+
+def random_affine_matrix(shape, degrees=10, translate=.1, scale=.1, shear=10, border=(0, 0)):
+    """ Draw the random affine transformation of ``random_affine()``.
+
+    Args:
+        shape (tuple): Input image (height, width).
+        degrees, translate, scale, shear, border: See ``random_affine()``.
+
+    Returns:
+        The 3x3 matrix mapping input to output pixel coordinates, and the random scale gain.
+
+    """
     # Rotation and Scale
     R = np.eye(3)
     a = random.uniform(-degrees, degrees)
     # a += random.choice([-180, -90, 0, 90])  # add 90deg rotations to small rotations
     s = random.uniform(1 - scale, 1 + scale)
     # s = 2 ** random.uniform(-scale, scale)
-    R[:2] = cv2.getRotationMatrix2D(angle=a, center=(image.shape[1] / 2, image.shape[0] / 2), scale=s)
+    R[:2] = cv2.getRotationMatrix2D(angle=a, center=(shape[1] / 2, shape[0] / 2), scale=s)
 
     # Translation
     T = np.eye(3)
-    T[0, 2] = random.uniform(-translate, translate) * image.shape[1] + border[1]  # x translation (pixels)
-    T[1, 2] = random.uniform(-translate, translate) * image.shape[0] + border[0]  # y translation (pixels)
+    T[0, 2] = random.uniform(-translate, translate) * shape[1] + border[1]  # x translation (pixels)
+    T[1, 2] = random.uniform(-translate, translate) * shape[0] + border[0]  # y translation (pixels)
 
     # Shear
     S = np.eye(3)
@@ -162,10 +199,20 @@ def random_affine(image, targets=(), degrees=10, translate=.1, scale=.1, shear=1
 
     # Combined rotation matrix
     M = S @ T @ R  # ORDER IS IMPORTANT HERE!!
-    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
-        image = cv2.warpAffine(image, M[:2], dsize=(width, height), flags=cv2.INTER_LINEAR, borderValue=(114, 114, 114))
+    return M, s
 
-    # Transform label coordinates
+
+def warp_targets(targets, M, s, width, height):
+    """ Warp pixel xyxy labels with an affine matrix, and reject boxes that left the image or degenerated.
+
+    Args:
+        targets (np.ndarray): Labels, shape(n, 5).
+        M (np.ndarray): 3x3 affine matrix.
+        s (float): Scale gain of ``M``, used for the area criterion.
+        width (int): Output image width.
+        height (int): Output image height.
+
+    """
     n = len(targets)
     if n:
         # warp points
@@ -191,4 +238,4 @@ def random_affine(image, targets=(), degrees=10, translate=.1, scale=.1, shear=1
         targets = targets[i]
         targets[:, 1:5] = xy[i]
 
-    return image, targets
+    return targets
@@ -0,0 +1,67 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Dataset fingerprints used to detect stale caches.
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def file_stat(path):
+    """ Returns ``(size, mtime_ns)`` of a file, or ``(0, 0)`` if it does not exist. """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0, 0
+    return st.st_size, st.st_mtime_ns
+
+
+def stat_files(files, workers=None, chunk_size=1024):
+    """ Stat many files in parallel. ``os.stat`` releases the GIL, so threads overlap
+    the round trips, which is what dominates on network filesystems.
+
+    Args:
+        files (list): File paths.
+        workers (int, optional): Number of threads. (default: ``min(32, cpu_count + 4)``)
+        chunk_size (int, optional): Number of files stat-ed per task. (default: ``1024``)
+
+    Returns:
+        A list of ``(size, mtime_ns)`` tuples, in the order of ``files``.
+
+    """
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [stat for chunk in executor.map(_stat_chunk, chunks) for stat in chunk]
+
+
+def _stat_chunk(files):
+    return [file_stat(f) for f in files]
+
+
+def get_fingerprint(files, stats=None):
+    """ Returns a hex digest over the path, size and mtime of every file.
+
+    Unlike a sum of file sizes, any added, removed, renamed or rewritten file changes it.
+
+    Args:
+        files (list): File paths.
+        stats (list, optional): Precomputed ``stat_files(files)``. (default: ``None``)
+
+    """
+    stats = stat_files(files) if stats is None else stats
+    h = hashlib.sha1()
+    h.update("\n".join(f"{f}\0{size}\0{mtime}" for f, (size, mtime) in zip(files, stats)).encode())
+    return h.hexdigest()
@@ -12,9 +12,12 @@
 # limitations under the License.
 # ==============================================================================
 import glob
+import hashlib
 import math
 import os
 import random
+from functools import partial
+from multiprocessing import Pool
 from pathlib import Path
 
 import cv2
@@ -26,10 +29,19 @@ from PIL import Image
 from torch.utils.data import Dataset
 from tqdm import tqdm
 
+from .augment import BatchAugment
+from .augment import BatchAugmentLoader
+from .cache import create_image_cache
+from .cache import open_image_cache
 from .common import create_folder
 from .common import exif_size
 from .common import letterbox
-from .common import random_affine
+from .common import letterbox_params
+from .common import random_affine_matrix
+from .common import warp_targets
+from .fingerprint import get_fingerprint
+from .fingerprint import stat_files
+from .labels import LabelStore
 from ..utils import xywh2xyxy
 from ..utils import xyxy2xywh
 
@@ -39,7 +51,7 @@ vid_formats = ['.mov', '.avi', '.mp4', '.mpg', '.mpeg', '.m4v', '.wmv', '.mkv']
 
 
 class LoadImages:  # for inference
-    def __init__(self, dataroot, image_size=640):
+    def __init__(self, dataroot, image_size=640, verbose=True):
         p = str(Path(dataroot))  # os-agnostic
         p = os.path.abspath(p)  # absolute path
         if '*' in p:
@@ -56,6 +68,7 @@ class LoadImages:  # for inference
         ni, nv = len(images), len(videos)
 
         self.image_size = image_size
+        self.verbose = verbose  # print the progress of every image
         self.files = images + videos
         self.nf = ni + nv  # number of files
         self.video_flag = [False] * ni + [True] * nv
@@ -91,14 +104,16 @@ class LoadImages:  # for inference
                     ret_val, raw_image = self.cap.read()
 
             self.frame += 1
-            print('video %g/%g (%g/%g) %s: ' % (self.count + 1, self.nf, self.frame, self.nframes, path), end='')
+            if self.verbose:
+                print('video %g/%g (%g/%g) %s: ' % (self.count + 1, self.nf, self.frame, self.nframes, path), end='')
 
         else:
             # Read image
             self.count += 1
             raw_image = cv2.imread(path)  # BGR
             assert raw_image is not None, 'Image Not Found ' + path
-            print('image %g/%g %s: ' % (self.count, self.nf, path), end='')
+            if self.verbose:
+                print('image %g/%g %s: ' % (self.count, self.nf, path), end='')
 
         # Padded resize
         image = letterbox(raw_image, new_shape=self.image_size)[0]
@@ -119,6 +134,47 @@ class LoadImages:  # for inference
         return self.nf  # number of files
 
 
+def batch_by_shape(dataset, batch_size=1):
+    """ Group consecutive images of ``LoadImages`` into batches of images with the same letterboxed shape.
+
+    A batch ends at ``batch_size`` images, at a change of shape and at the start of another video, so
+    directories of same-size images and the frames of a video run in full batches.
+
+    Yields:
+        The paths, the (n, 3, height, width) images, the raw images, the ``(fps, width, height)`` of the video,
+        ``None`` for images, the progress description and video frame of every image and the mode, ``images``
+        or ``video``, of the batch.
+
+    """
+    batch = []
+    for path, image, raw_image, video_capture in dataset:
+        if dataset.mode == 'video':
+            # Read while the capture is open, LoadImages releases it after the last frame
+            video = (video_capture.get(cv2.CAP_PROP_FPS), int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                     int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            frame = dataset.frame
+            context = 'video %g/%g (%g/%g) %s: ' % (dataset.count + 1, dataset.nf, frame, dataset.nframes, path)
+        else:
+            video, frame = None, 0  # no frame counter without videos
+            context = 'image %g/%g %s: ' % (dataset.count, dataset.nf, path)
+        key = image.shape, path if dataset.mode == 'video' else None
+        if batch and batch[0][0] != key:
+            yield collate_images(batch)
+            batch = []
+        batch.append((key, path, image, raw_image, video, context, frame, dataset.mode))
+        if len(batch) == batch_size:
+            yield collate_images(batch)
+            batch = []
+    if batch:
+        yield collate_images(batch)
+
+
+def collate_images(batch):
+    # Items of batch_by_shape() to a batch
+    _, paths, images, raw_images, videos, contexts, frames, modes = zip(*batch)
+    return list(paths), np.stack(images), list(raw_images), videos[-1], list(contexts), list(frames), modes[-1]
+
+
 class LoadImagesAndLabels(Dataset):  # for training/testing
     def __init__(self, dataroot, image_size=640, batch_size=16, augment=False, hyper_parameters=None, rect=False,
                  cache_images=False, stride=32):
@@ -140,6 +196,26 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
         except Exception as e:
             raise Exception('Error loading data from %s: %s\nSee %s' % (dataroot, e, help_url))
 
+        assert len(self.image_files) > 0, 'No images found in %s. See %s' % (dataroot, help_url)
+
+        # Define labels
+        self.label_files = [x.replace('images', 'labels').replace(os.path.splitext(x)[-1], '.txt') for x in
+                            self.image_files]
+
+        # Check cache
+        cache_path = str(Path(self.label_files[0]).parent) + '.cache'  # cached labels
+        store = LabelStore.load(cache_path)  # memory-mapped
+        if store is None or store.fingerprint != get_fingerprint(self.label_files + self.image_files):
+            store = self.cache_labels(cache_path, store)  # re-cache added or changed files only
+
+        # Skip corrupt images
+        valid = np.flatnonzero(store.shapes[:, 0] > 0)
+        if len(valid) < len(store):
+            print('WARNING: skipping %g corrupt images' % (len(store) - len(valid)))
+            store = store.take(valid)
+            self.image_files = [self.image_files[i] for i in valid]
+            self.label_files = [self.label_files[i] for i in valid]
+
         n = len(self.image_files)
         assert n > 0, 'No images found in %s. See %s' % (dataroot, help_url)
         bi = np.floor(np.arange(n) / batch_size).astype(np.int)  # batch index
@@ -153,25 +229,13 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
         self.rect = rect
         self.mosaic = self.augment and not self.rect  # load 4 images at a time into a mosaic (only during training)
         self.mosaic_border = [-image_size // 2, -image_size // 2]
+        self.augment_buffer = None  # output image of the geometric augmentation, allocated once per worker
+        self.batch_augment = False  # color jitter and flips are left to a BatchAugment after collate
         self.stride = stride
 
-        # Define labels
-        self.label_files = [x.replace('images', 'labels').replace(os.path.splitext(x)[-1], '.txt') for x in
-                            self.image_files]
-
-        # Check cache
-        cache_path = str(Path(self.label_files[0]).parent) + '.cache'  # cached labels
-        if os.path.isfile(cache_path):
-            cache = torch.load(cache_path)  # load
-            if cache['hash'] != get_hash(self.label_files + self.image_files):  # dataset changed
-                cache = self.cache_labels(cache_path)  # re-cache
-        else:
-            cache = self.cache_labels(cache_path)  # cache
-
-        # Get labels
-        labels, shapes = zip(*[cache[x] for x in self.image_files])
-        self.shapes = np.array(shapes, dtype=np.float64)
-        self.labels = list(labels)
+        # Get labels, self.labels[i] is a view into one (N_boxes, 5) array shared by all images
+        self.labels = store
+        self.shapes = np.array(store.shapes, dtype=np.float64)
 
         # Rectangular Training  https://github.com/ultralytics/yolov3/issues/232
         if self.rect:
@@ -181,7 +245,7 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
             irect = ar.argsort()
             self.image_files = [self.image_files[i] for i in irect]
             self.label_files = [self.label_files[i] for i in irect]
-            self.labels = [self.labels[i] for i in irect]
+            self.labels = self.labels.take(irect)  # reorders offsets only, boxes are not moved
             self.shapes = s[irect]  # wh
             ar = ar[irect]
 
@@ -197,180 +261,169 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
 
             self.batch_shapes = np.ceil(np.array(shapes) * image_size / stride).astype(np.int) * stride
 
-        # Cache labels
-        create_datasubset, extract_bounding_boxes, labels_loaded = False, False, False
-        nm, nf, ne, ns, nd = 0, 0, 0, 0, 0  # number missing, found, empty, datasubset, duplicate
-        pbar = tqdm(self.label_files)
-        for i, file in enumerate(pbar):
-            l = self.labels[i]  # label
-            if l.shape[0]:
-                assert l.shape[1] == 5, '> 5 label columns: %s' % file
-                assert (l >= 0).all(), 'negative labels: %s' % file
-                assert (l[:, 1:] <= 1).all(), 'non-normalized or out of bounds coordinate labels: %s' % file
-                if np.unique(l, axis=0).shape[0] < l.shape[0]:  # duplicate rows
-                    nd += 1  # print('WARNING: duplicate rows in %s' % self.label_files[i])  # duplicate rows
-
-                self.labels[i] = l
-                nf += 1  # file found
-
-                # Create subdataset (a smaller dataset)
-                if create_datasubset and ns < 1E4:
-                    if ns == 0:
-                        create_folder(path='./datasubset')
-                        os.makedirs('./datasubset/images')
-                    exclude_classes = 43
-                    if exclude_classes not in l[:, 0]:
-                        ns += 1
-                        with open('./datasubset/images.txt', 'a') as f:
-                            f.write(self.image_files[i] + '\n')
-
-                # Extract object detection boxes for a second stage classifier
-                if extract_bounding_boxes:
-                    p = Path(self.image_files[i])
-                    img = cv2.imread(str(p))
-                    h, w = img.shape[:2]
-                    for j, x in enumerate(l):
-                        f = '%s%sclassifier%s%g_%g_%s' % (p.parent.parent, os.sep, os.sep, x[0], j, p.name)
-                        if not os.path.exists(Path(f).parent):
-                            os.makedirs(Path(f).parent)  # make new output folder
-
-                        b = x[1:] * [w, h, w, h]  # box
-                        b[2:] = b[2:].max()  # rectangle to square
-                        b[2:] = b[2:] * 1.3 + 30  # pad
-                        b = xywh2xyxy(b.reshape(-1, 4)).ravel().astype(np.int)
-
-                        b[[0, 2]] = np.clip(b[[0, 2]], 0, w)  # clip boxes outside of image
-                        b[[1, 3]] = np.clip(b[[1, 3]], 0, h)
-                        assert cv2.imwrite(f, img[b[1]:b[3], b[0]:b[2]]), 'Failure extracting classifier boxes'
-            else:
-                ne += 1  # print('empty labels for image %s' % self.img_files[i])  # file empty
-                # os.system("rm '%s' '%s'" % (self.img_files[i], self.label_files[i]))  # remove
-
-            pbar.desc = 'Scanning labels %s (%g found, %g missing, %g empty, %g duplicate, for %g images)' % (
-                cache_path, nf, nm, ne, nd, n)
+        # Check labels, vectorized over all boxes
+        boxes, rows = self.labels.flat()
+        counts = self.labels.counts()
+        nf, ne = int((counts > 0).sum()), int((counts == 0).sum())  # number found, empty
+        bad = (boxes < 0).any(1)
+        assert not bad.any(), 'negative labels: %s' % self.label_files[rows[bad.argmax()]]
+        bad = (boxes[:, 1:] > 1).any(1)
+        assert not bad.any(), 'non-normalized or out of bounds coordinate labels: %s' % \
+                              self.label_files[rows[bad.argmax()]]
+        unique = np.unique(np.concatenate((rows[:, None], boxes), 1), axis=0)  # duplicate rows
+        nd = int((np.bincount(unique[:, 0].astype(np.int64), minlength=n) < counts).sum())  # number duplicate
+        nm = 0  # number missing, missing label files are empty
+        print('Scanning labels %s (%g found, %g missing, %g empty, %g duplicate, for %g images)' % (
+            cache_path, nf, nm, ne, nd, n))
         if nf == 0:
-            s = 'WARNING: No labels found in %s. See %s' % (os.path.dirname(file) + os.sep, help_url)
+            s = 'WARNING: No labels found in %s. See %s' % (os.path.dirname(self.label_files[0]) + os.sep, help_url)
             print(s)
             assert not augment, '%s. Can not train without labels.' % s
 
-        # Cache images into memory for faster training (WARNING: large datasets may exceed system RAM)
-        self.images = [None] * n
+        # Create subdataset (a smaller dataset) or extract object detection boxes for a second stage classifier
+        create_datasubset, extract_bounding_boxes = False, False
+        if create_datasubset or extract_bounding_boxes:
+            self.export_labels(create_datasubset, extract_bounding_boxes)
+
+        # Cache images into a memory-mapped file for faster training, shared by all workers and later runs
+        self.images = None
         if cache_images:
-            gb = 0  # Gigabytes of cached images
-            pbar = tqdm(range(len(self.image_files)), desc='Caching images')
-            self.image_hw0, self.image_hw = [None] * n, [None] * n
-            for i in pbar:  # max 10k images
-                self.images[i], self.image_hw0[i], self.image_hw[i] = load_image(self,
-                                                                                 i)  # img, hw_original, hw_resized
-                gb += self.images[i].nbytes
-                pbar.desc = 'Caching images (%.1fGB)' % (gb / 1E9)
-
-    def cache_labels(self, path='labels.cache'):
-        # Cache dataset labels, check images and read shapes
-        x = {}  # dict
-        pbar = tqdm(zip(self.image_files, self.label_files), desc='Scanning images', total=len(self.image_files))
-        for (img, label) in pbar:
-            try:
-                l = []
-                image = Image.open(img)
-                image.verify()  # PIL verify
-                # _ = io.imread(img)  # skimage verify (from skimage import io)
-                shape = exif_size(image)  # image size
-                assert (shape[0] > 9) & (shape[1] > 9), 'image size <10 pixels'
-                if os.path.isfile(label):
-                    with open(label, 'r') as f:
-                        l = np.array([x.split() for x in f.read().splitlines()], dtype=np.float32)  # labels
-                if len(l) == 0:
-                    l = np.zeros((0, 5), dtype=np.float32)
-                x[img] = [l, shape]
-            except Exception as e:
-                x[img] = None
-                print('WARNING: %s: %s' % (img, e))
-
-        x['hash'] = get_hash(self.label_files + self.image_files)
-        torch.save(x, path)  # save for next time
-        return x
+            interpolation = 'linear' if augment else 'area'  # see read_image()
+            key = '\n'.join(self.image_files + [str(image_size), interpolation])
+            path = '%s.%s.images' % (Path(self.image_files[0]).parent, hashlib.md5(key.encode()).hexdigest()[:8])
+            fingerprint = get_fingerprint(self.image_files)
+            self.images = open_image_cache(path, fingerprint)
+            if self.images is None:
+                load_fn = partial(read_image, image_size=image_size, augment=augment)
+                self.images = create_image_cache(path, self.image_files, load_fn, fingerprint)
+
+    def cache_labels(self, path='labels.cache', store=None):
+        # Cache dataset labels into a columnar LabelStore, check images and read shapes in a process pool
+        # Rows of a previous `store` are reused for files whose size and mtime did not change
+        n = len(self.image_files)
+        files = self.label_files + self.image_files
+        stats = stat_files(files)  # (size, mtime) of every file, in parallel
+        stats = np.concatenate((np.array(stats[n:], dtype=np.int64).reshape(-1, 2),
+                                np.array(stats[:n], dtype=np.int64).reshape(-1, 2)), 1)  # image, label
+        labels, shapes = [None] * n, np.zeros((n, 2), dtype=np.int64)
+
+        scan = list(range(n))  # files to (re)scan
+        if store is not None:
+            index = store.index()
+            old = np.array([index.get(x, -1) for x in self.image_files], dtype=np.int64)
+            cached = np.flatnonzero((old >= 0) & (store.stats[old] == stats).all(1))  # unchanged
+            for i in cached:
+                labels[i] = store[old[i]]
+            shapes[cached] = store.shapes[old[cached]]
+            scan = np.setdiff1d(scan, cached).tolist()
+
+        if scan:
+            nc = n - len(scan)  # number cached
+            with Pool(min(os.cpu_count() or 1, 8)) as pool:
+                args = [(self.image_files[i], self.label_files[i]) for i in scan]
+                results = pool.imap(verify_image_label, args, chunksize=64)
+                pbar = tqdm(zip(scan, results), desc='Scanning images', total=len(scan))
+                for j, (i, (l, shape, message)) in enumerate(pbar):
+                    labels[i], shapes[i] = l, shape
+                    if message:
+                        print(message)
+                    pbar.desc = 'Scanning images (%g cached, %g changed)' % (nc, j + 1)
+
+        fingerprint = get_fingerprint(files, [tuple(x) for x in stats[:, 2:]] + [tuple(x) for x in stats[:, :2]])
+        store = LabelStore.from_labels(labels, shapes, stats, self.image_files, fingerprint)
+        store.save(path)  # save for next time
+        return LabelStore.load(path)
+
+    def export_labels(self, create_datasubset=False, extract_bounding_boxes=False):
+        # Debug helpers, write a subset of the dataset or crops of every box for a second stage classifier
+        ns = 0  # number datasubset
+        for i, file in enumerate(tqdm(self.label_files)):
+            l = self.labels[i]  # label
+            if not l.shape[0]:
+                continue
+
+            # Create subdataset (a smaller dataset)
+            if create_datasubset and ns < 1E4:
+                if ns == 0:
+                    create_folder(path='./datasubset')
+                    os.makedirs('./datasubset/images')
+                exclude_classes = 43
+                if exclude_classes not in l[:, 0]:
+                    ns += 1
+                    with open('./datasubset/images.txt', 'a') as f:
+                        f.write(self.image_files[i] + '\n')
+
+            # Extract object detection boxes for a second stage classifier
+            if extract_bounding_boxes:
+                p = Path(self.image_files[i])
+                img = cv2.imread(str(p))
+                h, w = img.shape[:2]
+                for j, x in enumerate(l):
+                    f = '%s%sclassifier%s%g_%g_%s' % (p.parent.parent, os.sep, os.sep, x[0], j, p.name)
+                    if not os.path.exists(Path(f).parent):
+                        os.makedirs(Path(f).parent)  # make new output folder
+
+                    b = x[1:] * [w, h, w, h]  # box
+                    b[2:] = b[2:].max()  # rectangle to square
+                    b[2:] = b[2:] * 1.3 + 30  # pad
+                    b = xywh2xyxy(b.reshape(-1, 4)).ravel().astype(np.int)
+
+                    b[[0, 2]] = np.clip(b[[0, 2]], 0, w)  # clip boxes outside of image
+                    b[[1, 3]] = np.clip(b[[1, 3]], 0, h)
+                    assert cv2.imwrite(f, img[b[1]:b[3], b[0]:b[2]]), 'Failure extracting classifier boxes'
 
     def __len__(self):
         return len(self.image_files)
 
     def __getitem__(self, index):
-        hyper_parameters = self.hyper_parameters
+        index, batch_shape = index if isinstance(index, tuple) else (index, None)  # from AspectRatioBatchSampler
         if self.mosaic:
-            # Load mosaic
+            # Load mosaic, random affine and left-right flip are part of its warps
             img, labels = load_mosaic(self, index)
+            if batch_shape is not None and img.shape[:2] != tuple(batch_shape):  # multi-scale
+                h, w = batch_shape
+                if len(labels):
+                    labels[:, [1, 3]] *= w / img.shape[1]
+                    labels[:, [2, 4]] *= h / img.shape[0]
+                img = cv2.resize(img, (w, h), interpolation=cv2.INTER_LINEAR)
             shapes = None
 
         else:
             # Load image
             img, (h0, w0), (h, w) = load_image(self, index)
+            if batch_shape is not None:
+                shape = batch_shape
+            else:
+                # Final letterboxed shape
+                shape = self.batch_shapes[self.batch[index]] if self.rect else self.image_size
 
-            # Letterbox
-            shape = self.batch_shapes[self.batch[index]] if self.rect else self.image_size  # final letterboxed shape
-            img, ratio, pad = letterbox(img, shape, auto=False, scaleup=self.augment)
-            shapes = (h0, w0), ((h / h0, w / w0), pad)  # for COCO mAP rescaling
-
-            # Load labels
-            labels = []
-            x = self.labels[index]
-            if x.size > 0:
-                # Normalized xywh to pixel xyxy format
-                labels = x.copy()
-                labels[:, 1] = ratio[0] * w * (x[:, 1] - x[:, 3] / 2) + pad[0]  # pad width
-                labels[:, 2] = ratio[1] * h * (x[:, 2] - x[:, 4] / 2) + pad[1]  # pad height
-                labels[:, 3] = ratio[0] * w * (x[:, 1] + x[:, 3] / 2) + pad[0]
-                labels[:, 4] = ratio[1] * h * (x[:, 2] + x[:, 4] / 2) + pad[1]
-
-        if self.augment:
-            # Augment imagespace
-            if not self.mosaic:
-                img, labels = random_affine(img, labels,
-                                            degrees=hyper_parameters['degrees'],
-                                            translate=hyper_parameters['translate'],
-                                            scale=hyper_parameters['scale'],
-                                            shear=hyper_parameters['shear'])
-
-            # Augment colorspace
-            augment_hsv(img, hgain=hyper_parameters['hsv_h'], sgain=hyper_parameters['hsv_s'],
-                        vgain=hyper_parameters['hsv_v'])
-
-            # Apply cutouts
-            # if random.random() < 0.9:
-            #     labels = cutout(img, labels)
-
-        nL = len(labels)  # number of labels
-        if nL:
-            # convert xyxy to xywh
-            labels[:, 1:5] = xyxy2xywh(labels[:, 1:5])
-
-            # Normalize coordinates 0 - 1
-            labels[:, [2, 4]] /= img.shape[0]  # height
-            labels[:, [1, 3]] /= img.shape[1]  # width
-
-        if self.augment:
-            # random left-right flip
-            lr_flip = True
-            if lr_flip and random.random() < 0.5:
-                img = np.fliplr(img)
-                if nL:
-                    labels[:, 1] = 1 - labels[:, 1]
-
-            # random up-down flip
-            ud_flip = False
-            if ud_flip and random.random() < 0.5:
-                img = np.flipud(img)
-                if nL:
-                    labels[:, 2] = 1 - labels[:, 2]
-
-        labels_out = torch.zeros((nL, 6))
-        if nL:
-            labels_out[:, 1:] = torch.from_numpy(labels)
+            if self.augment:
+                # Letterbox, random affine and left-right flip in one warp
+                shape = (shape, shape) if isinstance(shape, int) else tuple(shape)
+                self.augment_buffer = reuse_buffer(self.augment_buffer, shape)
+                img, labels, pad = random_letterbox(img, self.labels[index], shape, self.hyper_parameters,
+                                                    out=self.augment_buffer, lr_flip=not self.batch_augment)
+                shapes = (h0, w0), ((h / h0, w / w0), pad)  # for COCO mAP rescaling
 
-        # Convert
-        img = img[:, :, ::-1].transpose(2, 0, 1)  # BGR to RGB, to 3x416x416
-        img = np.ascontiguousarray(img)
-
-        return torch.from_numpy(img), labels_out, self.image_files[index], shapes
+            else:
+                # Letterbox
+                img, ratio, pad = letterbox(img, shape, auto=False, scaleup=self.augment)
+                shapes = (h0, w0), ((h / h0, w / w0), pad)  # for COCO mAP rescaling
+
+                # Load labels
+                labels = []
+                x = self.labels[index]
+                if x.size > 0:
+                    # Normalized xywh to pixel xyxy format
+                    labels = x.copy()
+                    labels[:, 1] = ratio[0] * w * (x[:, 1] - x[:, 3] / 2) + pad[0]  # pad width
+                    labels[:, 2] = ratio[1] * h * (x[:, 2] - x[:, 4] / 2) + pad[1]  # pad height
+                    labels[:, 3] = ratio[0] * w * (x[:, 1] + x[:, 3] / 2) + pad[0]
+                    labels[:, 4] = ratio[1] * h * (x[:, 2] + x[:, 4] / 2) + pad[1]
+
+        color = self.augment and not self.batch_augment
+        img, labels_out = format_sample(img, labels, self.hyper_parameters if color else None)
+        return img, labels_out, self.image_files[index], shapes
 
     @staticmethod
     def collate_fn(batch):
@@ -380,24 +433,127 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
         return torch.stack(img, 0), torch.cat(label, 0), path, shapes
 
 
-def create_dataloader(dataroot, image_size, batch_size, hyper_parameters=None, augment=None, cache=None, rect=None):
-    dataset = LoadImagesAndLabels(dataroot=dataroot,
-                                  image_size=image_size,
-                                  batch_size=batch_size,
-                                  augment=augment,  # augment images
-                                  hyper_parameters=hyper_parameters,  # augmentation hyper parameters
-                                  rect=rect,  # rectangular training
-                                  cache_images=cache,
-                                  stride=32)
+def create_dataloader(dataroot, image_size, batch_size, hyper_parameters=None, augment=None, cache=None, rect=None,
+                      workers=8, prefetch_factor=2, persistent_workers=True, shuffle=False, seed=0, batch_augment=False,
+                      buckets=0, scales=None, scale_interval=10):
+    """ Create a dataset and its DataLoader.
+
+    Args:
+        dataroot (str): Path to images, a list of images or a directory of shards.
+        image_size (int): Size of processing picture.
+        batch_size (int): Mini-batch size per process.
+        hyper_parameters (dict, optional): Augmentation hyper parameters. (default: ``None``)
+        augment (bool, optional): Augment images. (default: ``None``)
+        cache (bool, optional): Cache images in a memory-mapped file. (default: ``None``)
+        rect (bool, optional): Rectangular batches, implies ``shuffle=False``. (default: ``None``)
+        workers (int, optional): Maximum number of worker processes, see ``get_num_workers()``. (default: ``8``)
+        prefetch_factor (int, optional): Batches loaded in advance by every worker. (default: ``2``)
+        persistent_workers (bool, optional): Keep workers alive between epochs. (default: ``True``)
+        shuffle (bool, optional): Shuffle every epoch. (default: ``False``)
+        seed (int, optional): Seed of the shuffle and of the worker random states. (default: ``0``)
+        batch_augment (bool, optional): Apply HSV jitter and flips to whole batches in a background thread instead
+            of in the workers, see ``BatchAugment``. Only used with ``augment``. (default: ``False``)
+        buckets (int, optional): Batch images of similar aspect ratio from this many buckets at rectangular shapes,
+            see ``AspectRatioBatchSampler``. Turns off mosaic, not used with shards. (default: ``0``)
+        scales (tuple, optional): Multi-scale training, range ``(min, max)`` of the image size as a fraction of
+            ``image_size``, drawn every ``scale_interval`` steps. (default: ``None``)
+        scale_interval (int, optional): Number of steps between image size changes. (default: ``10``)
+
+    Returns:
+        The dataset and the DataLoader. Under ``torch.distributed`` the DataLoader uses a ``DistributedSampler``,
+        call ``dataloader.sampler.set_epoch(epoch)`` every epoch, or ``dataloader.batch_sampler.set_epoch(epoch)``
+        with ``buckets`` or ``scales``.
+
+    """
+    from .sampler import AspectRatioBatchSampler
+    from .shard import LoadShards
+    from .shard import is_shards
+    distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+    batch_sampler = None
+    num_workers = get_num_workers(batch_size, workers)
+    if is_shards(dataroot):  # packed with scripts/pack_shards.py, streamed sequentially
+        dataset = LoadShards(dataroot=dataroot,
+                             image_size=image_size,
+                             augment=augment,
+                             hyper_parameters=hyper_parameters,
+                             batch_size=batch_size,
+                             num_workers=num_workers,  # every worker yields whole batches
+                             buffer_size=1000 if shuffle else 0,
+                             seed=seed)
+        sampler = None  # shards are split across ranks and shuffled by the dataset itself
+    else:
+        dataset = LoadImagesAndLabels(dataroot=dataroot,
+                                      image_size=image_size,
+                                      batch_size=batch_size,
+                                      augment=augment,  # augment images
+                                      hyper_parameters=hyper_parameters,  # augmentation hyper parameters
+                                      rect=rect,  # rectangular training
+                                      cache_images=cache,
+                                      stride=32)
+        shuffle = shuffle and not rect  # rect batch shapes assume images in aspect ratio order
+        if (buckets or scales) and not rect:
+            dataset.mosaic = dataset.mosaic and not buckets  # mosaic tiles ignore the aspect ratio
+            batch_sampler = AspectRatioBatchSampler(dataset.shapes, batch_size, image_size,
+                                                    stride=dataset.stride,
+                                                    buckets=buckets,
+                                                    scales=scales,
+                                                    scale_interval=scale_interval,
+                                                    shuffle=shuffle,
+                                                    seed=seed)  # splits batches across ranks itself
+            sampler = None
+        elif distributed:
+            sampler = torch.utils.data.distributed.DistributedSampler(dataset, shuffle=shuffle, seed=seed)
+        elif shuffle:
+            sampler = torch.utils.data.RandomSampler(dataset, generator=torch.Generator().manual_seed(seed))
+        else:
+            sampler = None
 
+    kwargs = {"persistent_workers": persistent_workers, "prefetch_factor": prefetch_factor} if num_workers else {}
+    if batch_sampler is not None:
+        kwargs["batch_sampler"] = batch_sampler
+    else:
+        kwargs["batch_size"] = batch_size
     dataloader = torch.utils.data.DataLoader(dataset,
-                                             batch_size=batch_size,
-                                             num_workers=8,
+                                             sampler=sampler,
+                                             num_workers=num_workers,
                                              pin_memory=True,
-                                             collate_fn=LoadImagesAndLabels.collate_fn)
+                                             collate_fn=LoadImagesAndLabels.collate_fn,
+                                             worker_init_fn=seed_worker,
+                                             generator=torch.Generator().manual_seed(seed),
+                                             **kwargs)
+    if augment and batch_augment:
+        dataset.batch_augment = True  # workers only decode, mosaic and warp
+        dataloader = BatchAugmentLoader(dataloader, BatchAugment(hgain=hyper_parameters['hsv_h'],
+                                                                 sgain=hyper_parameters['hsv_s'],
+                                                                 vgain=hyper_parameters['hsv_v'],
+                                                                 scale=hyper_parameters.get('batch_scale', 0.0),
+                                                                 seed=seed))
     return dataset, dataloader
 
 
+def get_num_workers(batch_size, workers=8):
+    # Number of DataLoader workers, limited by the CPUs available to this process, shared by all local ranks
+    try:
+        cpus = len(os.sched_getaffinity(0))  # respects taskset and container limits
+    except AttributeError:  # not available on macOS and Windows
+        cpus = os.cpu_count() or 1
+    if "LOCAL_WORLD_SIZE" in os.environ:  # set by torchrun
+        local_world_size = int(os.environ["LOCAL_WORLD_SIZE"])
+    elif torch.distributed.is_available() and torch.distributed.is_initialized():
+        local_world_size = torch.distributed.get_world_size()  # single node
+    else:
+        local_world_size = 1
+    return max(min(cpus // max(local_world_size, 1), batch_size if batch_size > 1 else 0, workers), 0)
+
+
+def seed_worker(worker_id):
+    # Seed numpy and random in every DataLoader worker, forked workers otherwise share the parent state
+    cv2.setNumThreads(0)  # prevent OpenCV from multi threading inside the DataLoader workers
+    seed = torch.initial_seed() % 2 ** 32  # base_seed + worker_id, set by the DataLoader
+    np.random.seed(seed)
+    random.seed(seed)
+
+
 def check_anchor_order(m):
     # Check anchor order against stride order for YOLOv5 Detect() module m, and correct if necessary
     a = m.anchor_grid.prod(-1).view(-1)  # anchor area
@@ -415,7 +571,8 @@ def check_anchors(dataset, model, thr=4.0, image_size=640):
     m = model.module.model[-1] if hasattr(model, 'module') else model.model[-1]  # Detect()
     shapes = image_size * dataset.shapes / dataset.shapes.max(1, keepdims=True)
     scale = np.random.uniform(0.9, 1.1, size=(shapes.shape[0], 1))  # augment scale
-    wh = torch.tensor(np.concatenate([l[:, 3:5] * s for s, l in zip(shapes * scale, dataset.labels)])).float()  # wh
+    boxes, rows = dataset.labels.flat()
+    wh = torch.tensor(boxes[:, 3:5] * (shapes * scale)[rows]).float()  # wh
 
     def metric(k):  # compute metric
         r = wh[:, None] / k[None]
@@ -441,11 +598,6 @@ def check_anchors(dataset, model, thr=4.0, image_size=640):
     print('')  # newline
 
 
-def get_hash(files):
-    # Returns a single hash value of a list of files
-    return sum(os.path.getsize(f) for f in files if os.path.isfile(f))
-
-
 def kmean_anchors(dataroot, n=9, image_size=640, thr=4.0, gen=1000, verbose=True):
     """ Creates kmeans-evolved anchors from training dataset
 
@@ -495,7 +647,8 @@ def kmean_anchors(dataroot, n=9, image_size=640, thr=4.0, gen=1000, verbose=True
 
     # Get label wh
     shapes = image_size * dataset.shapes / dataset.shapes.max(1, keepdims=True)
-    wh0 = np.concatenate([l[:, 3:5] * s for s, l in zip(shapes, dataset.labels)])  # wh
+    boxes, rows = dataset.labels.flat()
+    wh0 = boxes[:, 3:5] * shapes[rows]  # wh
 
     # Filter
     i = (wh0 < 3.0).any(1).sum()
@@ -535,35 +688,86 @@ def kmean_anchors(dataroot, n=9, image_size=640, thr=4.0, gen=1000, verbose=True
 
 def load_image(self, index):
     # loads 1 image from dataset, returns img, original hw, resized hw
-    img = self.images[index]
-    if img is None:  # not cached
-        path = self.image_files[index]
-        img = cv2.imread(path)  # BGR
-        assert img is not None, 'Image Not Found ' + path
-        h0, w0 = img.shape[:2]  # orig hw
-        r = self.image_size / max(h0, w0)  # resize image to img_size
-        if r != 1:  # always resize down, only resize up if training with augmentation
-            interp = cv2.INTER_AREA if r < 1 and not self.augment else cv2.INTER_LINEAR
-            img = cv2.resize(img, (int(w0 * r), int(h0 * r)), interpolation=interp)
-        return img, (h0, w0), img.shape[:2]  # img, hw_original, hw_resized
-    else:
-        return self.images[index], self.image_hw0[index], self.image_hw[index]  # img, hw_original, hw_resized
+    if self.images is not None:  # cached, zero-copy view into the memory-mapped cache
+        return self.images[index]
+    shape = tuple(int(x) for x in self.shapes[index])  # original wh, known from the label cache
+    return read_image(self.image_files[index], self.image_size, self.augment, shape=shape)
+
+
+def read_image(path, image_size=640, augment=False, shape=None, reduced=True):
+    # reads 1 image from disk and resizes its long side to image_size, returns img, original hw, resized hw
+    # JPEGs are decoded at 1/2, 1/4 or 1/8 resolution in the DCT domain if that still covers image_size
+    flag = cv2.IMREAD_COLOR
+    if reduced and os.path.splitext(path)[-1].lower() in ('.jpg', '.jpeg'):
+        if shape is None:
+            try:
+                shape = exif_size(Image.open(path))  # reads the header only
+            except Exception:
+                shape = None
+        flag = reduced_flag(shape, image_size)
+    img = cv2.imread(path, flag)  # BGR
+    assert img is not None, 'Image Not Found ' + path
+    return resize_image(img, image_size, augment, shape=shape if flag != cv2.IMREAD_COLOR else None)
+
+
+def reduced_flag(shape, image_size=640):
+    # returns the cv2.imread flag of the largest JPEG downscale whose long side still covers image_size
+    if shape is None:
+        return cv2.IMREAD_COLOR
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(shape) // factor >= image_size:  # decoded size is ceil(x / factor)
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def resize_image(img, image_size=640, augment=False, shape=None):
+    # resizes the long side of a decoded image to image_size, returns img, original hw, resized hw
+    # shape is the original wh if img was decoded at a reduced resolution
+    h0, w0 = img.shape[:2] if shape is None else shape[::-1]  # orig hw
+    r = image_size / max(h0, w0)  # resize image to img_size
+    size = (int(w0 * r), int(h0 * r))
+    if size != img.shape[1::-1]:  # always resize down, only resize up if training with augmentation
+        interp = cv2.INTER_AREA if r < 1 and not augment else cv2.INTER_LINEAR
+        img = cv2.resize(img, size, interpolation=interp)
+    return img, (h0, w0), img.shape[:2]  # img, hw_original, hw_resized
 
 
 def load_mosaic(self, index):
     # loads images in a mosaic
-
-    labels4 = []
-    s = self.image_size
-    yc, xc = [int(random.uniform(-x, 2 * s + x)) for x in self.mosaic_border]  # mosaic center x, y
     indices = [index] + [random.randint(0, len(self.labels) - 1) for _ in range(3)]  # 3 additional image indices
-    for i, index in enumerate(indices):
-        # Load image
-        img, _, (h, w) = load_image(self, index)
+    tiles = [(load_image(self, i)[0], self.labels[i]) for i in indices]
+    self.augment_buffer = reuse_buffer(self.augment_buffer, (self.image_size, self.image_size))
+    return build_mosaic(tiles, self.image_size, self.mosaic_border, self.hyper_parameters, out=self.augment_buffer,
+                        lr_flip=not self.batch_augment)
+
+
+def build_mosaic(tiles, image_size, mosaic_border, hyper_parameters, out=None, lr_flip=True):
+    """ Combine 4 images into a mosaic and apply a random affine transform to it.
+
+    The 2x sized mosaic is never materialized. Every tile is cropped to its quadrant and warped
+    once, with its placement folded into the affine matrix, straight into the output image.
+
+    Args:
+        tiles (list): 4 ``(img, labels)`` pairs, resized BGR images and their normalized xywh labels.
+        image_size (int): Size of the output image.
+        mosaic_border (list): Border removed from the 2x sized mosaic, ``[-image_size // 2, -image_size // 2]``.
+        hyper_parameters (dict): Augmentation hyper parameters.
+        out (np.ndarray, optional): Preallocated output image, overwritten and returned. (default: ``None``)
+        lr_flip (bool, optional): Randomly flip left-right, as part of the warps. (default: ``True``)
+
+    Returns:
+        The mosaic image and its pixel xyxy labels.
+
+    """
+    labels4, crops = [], []
+    s = image_size
+    yc, xc = [int(random.uniform(-x, 2 * s + x)) for x in mosaic_border]  # mosaic center x, y
+    for i, (img, x) in enumerate(tiles):
+        h, w = img.shape[:2]
 
         # place img in img4
         if i == 0:  # top left
-            image4 = np.full((s * 2, s * 2, img.shape[2]), 114, dtype=np.uint8)  # base image with 4 tiles
             x1a, y1a, x2a, y2a = max(xc - w, 0), max(yc - h, 0), xc, yc  # xmin, ymin, xmax, ymax (large image)
             x1b, y1b, x2b, y2b = w - (x2a - x1a), h - (y2a - y1a), w, h  # xmin, ymin, xmax, ymax (small image)
         elif i == 1:  # top right
@@ -576,12 +780,11 @@ def load_mosaic(self, index):
             x1a, y1a, x2a, y2a = xc, yc, min(xc + w, s * 2), min(s * 2, yc + h)
             x1b, y1b, x2b, y2b = 0, 0, min(w, x2a - x1a), min(y2a - y1a, h)
 
-        image4[y1a:y2a, x1a:x2a] = img[y1b:y2b, x1b:x2b]  # img4[ymin:ymax, xmin:xmax]
+        crops.append((img[y1b:y2b, x1b:x2b], x1a, y1a))  # img4[ymin:ymax, xmin:xmax], a view
         padw = x1a - x1b
         padh = y1a - y1b
 
         # Labels
-        x = self.labels[index]
         labels = x.copy()
         if x.size > 0:  # Normalized xywh to pixel xyxy format
             labels[:, 1] = w * (x[:, 1] - x[:, 3] / 2) + padw
@@ -595,17 +798,152 @@ def load_mosaic(self, index):
         labels4 = np.concatenate(labels4, 0)
         np.clip(labels4[:, 1:], 0, 2 * s, out=labels4[:, 1:])  # use with random_affine
 
-    # Augment
-    image4, labels4 = random_affine(image4, labels4,
-                                    degrees=self.hyper_parameters['degrees'],
-                                    translate=self.hyper_parameters['translate'],
-                                    scale=self.hyper_parameters['scale'],
-                                    shear=self.hyper_parameters['shear'],
-                                    border=self.mosaic_border)  # border to remove
+    # Augment, same transform as random_affine() on the 2x sized mosaic
+    height, width = s * 2 + mosaic_border[0] * 2, s * 2 + mosaic_border[1] * 2
+    M, scale = random_affine_matrix((s * 2, s * 2),
+                                    degrees=hyper_parameters['degrees'],
+                                    translate=hyper_parameters['translate'],
+                                    scale=hyper_parameters['scale'],
+                                    shear=hyper_parameters['shear'],
+                                    border=mosaic_border)  # border to remove
+    flip = lr_flip and random.random() < 0.5
+    F = flip_matrix(width) if flip else np.eye(3)
+    image4 = np.empty((height, width, 3), dtype=np.uint8) if out is None else out
+    image4.fill(114)
+    for crop, x1a, y1a in crops:
+        if crop.size == 0:
+            continue
+
+        # Output region covered by the tile
+        h, w = crop.shape[:2]
+        corners = np.array([[x1a, y1a, 1], [x1a + w, y1a, 1], [x1a, y1a + h, 1], [x1a + w, y1a + h, 1]]) @ (F @ M)[:2].T
+        x0, y0 = np.floor(corners.min(0)).astype(int).clip(0, (width, height))
+        x1, y1 = np.ceil(corners.max(0)).astype(int).clip(0, (width, height))
+        if x1 <= x0 or y1 <= y0:
+            continue  # tile warped out of the image
+
+        # Warp the tile, padded by 1 pixel so bilinear taps at the seams between tiles exist, into that region only
+        crop = cv2.copyMakeBorder(crop, 1, 1, 1, 1, cv2.BORDER_REPLICATE)
+        T = np.array([[1, 0, x1a - 1], [0, 1, y1a - 1], [0, 0, 1]])  # padded tile to mosaic coordinates
+        A = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]]) @ F @ M @ T
+        cv2.warpAffine(crop, A[:2], dsize=(x1 - x0, y1 - y0), dst=image4[y0:y1, x0:x1], flags=cv2.INTER_LINEAR,
+                       borderMode=cv2.BORDER_TRANSPARENT)
+    labels4 = warp_targets(labels4, M, scale, width, height)
+    if flip and len(labels4):
+        labels4[:, [1, 3]] = width - labels4[:, [3, 1]]
 
     return image4, labels4
 
 
+def random_letterbox(img, labels, shape, hyper_parameters, out=None, lr_flip=True):
+    """ Letterbox, random affine and left-right flip of one image as a single warp.
+
+    Same result as ``letterbox()``, ``random_affine()`` and ``np.fliplr()`` one after the other,
+    without the intermediate images.
+
+    Args:
+        img (np.ndarray): Resized BGR image, shape(h, w, 3).
+        labels (np.ndarray): Normalized xywh labels, shape(n, 5).
+        shape (tuple): Output (height, width).
+        hyper_parameters (dict): Augmentation hyper parameters.
+        out (np.ndarray, optional): Preallocated output image, overwritten and returned. (default: ``None``)
+        lr_flip (bool, optional): Randomly flip left-right. (default: ``True``)
+
+    Returns:
+        The output image, its pixel xyxy labels and the letterbox (width, height) padding.
+
+    """
+    h, w = img.shape[:2]
+    height, width = shape
+    ratio, pad, new_unpad, (top, _, left, _) = letterbox_params((h, w), shape, auto=False, scaleup=True)
+
+    # Letterbox as a matrix, pixel centers aligned like cv2.resize()
+    rx, ry = new_unpad[0] / w, new_unpad[1] / h
+    L = np.array([[rx, 0, left + 0.5 * rx - 0.5], [0, ry, top + 0.5 * ry - 0.5], [0, 0, 1]])
+    M, scale = random_affine_matrix((height, width),
+                                    degrees=hyper_parameters['degrees'],
+                                    translate=hyper_parameters['translate'],
+                                    scale=hyper_parameters['scale'],
+                                    shear=hyper_parameters['shear'])
+    flip = lr_flip and random.random() < 0.5
+    F = flip_matrix(width) if flip else np.eye(3)
+    out = np.empty((height, width, 3), dtype=np.uint8) if out is None else out
+    cv2.warpAffine(img, (F @ M @ L)[:2], dsize=(width, height), dst=out, flags=cv2.INTER_LINEAR,
+                   borderMode=cv2.BORDER_CONSTANT, borderValue=(114, 114, 114))
+
+    # Normalized xywh to letterboxed pixel xyxy format, then warp
+    x = labels
+    labels = x.copy()
+    if x.size > 0:
+        labels[:, 1] = ratio[0] * w * (x[:, 1] - x[:, 3] / 2) + pad[0]  # pad width
+        labels[:, 2] = ratio[1] * h * (x[:, 2] - x[:, 4] / 2) + pad[1]  # pad height
+        labels[:, 3] = ratio[0] * w * (x[:, 1] + x[:, 3] / 2) + pad[0]
+        labels[:, 4] = ratio[1] * h * (x[:, 2] + x[:, 4] / 2) + pad[1]
+    labels = warp_targets(labels, M, scale, width, height)
+    if flip and len(labels):
+        labels[:, [1, 3]] = width - labels[:, [3, 1]]
+
+    return out, labels, pad
+
+
+def flip_matrix(width):
+    # left-right flip of pixel indices, like np.fliplr()
+    return np.array([[-1, 0, width - 1], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+
+
+def reuse_buffer(buffer, shape):
+    # returns buffer if it is a (height, width, 3) image of this shape, else a new one
+    if buffer is None or buffer.shape[:2] != tuple(shape):
+        buffer = np.empty((*shape, 3), dtype=np.uint8)
+    return buffer
+
+
+def format_sample(img, labels, hyper_parameters=None):
+    """ Apply color augmentation and convert an image and its labels to tensors.
+
+    The HSV jitter runs in place, the BGR to RGB and HWC to CHW conversion is a single split
+    into the planes of the output tensor.
+
+    Args:
+        img (np.ndarray): BGR image, shape(h, w, 3). Modified in place if ``hyper_parameters`` is given.
+        labels (np.ndarray): Pixel xyxy labels, shape(n, 5).
+        hyper_parameters (dict, optional): Augmentation hyper parameters, no color augmentation if ``None``.
+            (default: ``None``)
+
+    Returns:
+        The RGB uint8 image tensor, shape(3, h, w), and normalized xywh labels, shape(n, 6).
+
+    """
+    nL = len(labels)  # number of labels
+    if nL:
+        # convert xyxy to xywh
+        labels[:, 1:5] = xyxy2xywh(labels[:, 1:5])
+
+        # Normalize coordinates 0 - 1
+        labels[:, [2, 4]] /= img.shape[0]  # height
+        labels[:, [1, 3]] /= img.shape[1]  # width
+
+    labels_out = torch.zeros((nL, 6))
+    if nL:
+        labels_out[:, 1:] = torch.from_numpy(labels)
+
+    if hyper_parameters is not None:
+        # Augment colorspace
+        augment_hsv(img, hgain=hyper_parameters['hsv_h'], sgain=hyper_parameters['hsv_s'],
+                    vgain=hyper_parameters['hsv_v'])
+
+        # Apply cutouts
+        # if random.random() < 0.9:
+        #     labels = cutout(img, labels)
+
+    # Convert, BGR to RGB, to 3x416x416
+    out = torch.empty((3, *img.shape[:2]), dtype=torch.uint8)
+    planes = out.numpy()
+    cv2.split(np.ascontiguousarray(img), [planes[2], planes[1], planes[0]])
+
+    return out, labels_out
+
+
 def scale_image(image, ratio=1.0, same_shape=False):  # image(16,3,256,416), r=ratio
     # scales image(bs,3,y,x) by ratio
     if ratio == 1.0:
@@ -630,8 +968,8 @@ def copy_attr(a, b, include=(), exclude=()):
 
 
 def augment_hsv(img, hgain=0.5, sgain=0.5, vgain=0.5):
+    # in place, one LUT pass over all 3 HSV channels
     r = np.random.uniform(-1, 1, 3) * [hgain, sgain, vgain] + 1  # random gains
-    hue, sat, val = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
     dtype = img.dtype  # uint8
 
     x = np.arange(0, 256, dtype=np.int16)
@@ -639,10 +977,32 @@ def augment_hsv(img, hgain=0.5, sgain=0.5, vgain=0.5):
     lut_sat = np.clip(x * r[1], 0, 255).astype(dtype)
     lut_val = np.clip(x * r[2], 0, 255).astype(dtype)
 
-    img_hsv = cv2.merge((cv2.LUT(hue, lut_hue), cv2.LUT(sat, lut_sat), cv2.LUT(val, lut_val))).astype(dtype)
-    cv2.cvtColor(img_hsv, cv2.COLOR_HSV2BGR, dst=img)  # no return needed
+    cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=img)
+    cv2.LUT(img, np.stack((lut_hue, lut_sat, lut_val), 1).reshape(1, 256, 3), dst=img)
+    cv2.cvtColor(img, cv2.COLOR_HSV2BGR, dst=img)  # no return needed
 
     # Histogram equalization
     # if random.random() < 0.2:
     #     for i in range(3):
     #         img[:, :, i] = cv2.equalizeHist(img[:, :, i])
+
+
+def verify_image_label(args):
+    # Verify one image-label pair (runs in a worker process), returns labels, image size, warning message
+    img, label = args
+    try:
+        l = []
+        image = Image.open(img)
+        image.verify()  # PIL verify
+        # _ = io.imread(img)  # skimage verify (from skimage import io)
+        shape = exif_size(image)  # image size
+        assert (shape[0] > 9) & (shape[1] > 9), 'image size <10 pixels'
+        if os.path.isfile(label):
+            with open(label, 'r') as f:
+                l = np.array([x.split() for x in f.read().splitlines()], dtype=np.float32)  # labels
+        if len(l) == 0:
+            l = np.zeros((0, 5), dtype=np.float32)
+        assert l.ndim == 2 and l.shape[1] == 5, '> 5 label columns: %s' % label
+        return l, shape, ''
+    except Exception as e:
+        return np.zeros((0, 5), dtype=np.float32), (0, 0), 'WARNING: %s: %s' % (img, e)  # (0, 0) marks corrupt
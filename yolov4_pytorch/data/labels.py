@@ -0,0 +1,141 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+import shutil
+
+import numpy as np
+
+
+class LabelStore:
+    """ Columnar store of dataset labels.
+
+    All boxes live in one ``(N_boxes, 5)`` float32 array of ``class, x, y, w, h`` rows, and image ``i``
+    owns the rows ``boxes[starts[i]:ends[i]]``. Indexing returns a view into that array, so
+    nothing is copied per image. On disk the store is a directory of ``.npy`` files which
+    are memory-mapped on load.
+
+    Args:
+        boxes (np.ndarray): Labels of all images, shape(N_boxes, 5).
+        offsets (np.ndarray): Row offsets of every image into ``boxes``, shape(n + 1).
+        shapes (np.ndarray): Image sizes (width, height), shape(n, 2). ``(0, 0)`` marks a corrupt image.
+        stats (np.ndarray): Size and mtime of every image and label file, shape(n, 4).
+        paths (list): Image file paths.
+        fingerprint (str, optional): Fingerprint of the dataset the store was built from. (default: ``''``)
+
+    """
+
+    def __init__(self, boxes, offsets, shapes, stats, paths, fingerprint=""):
+        self.boxes = boxes
+        self.starts, self.ends = offsets[:-1], offsets[1:]
+        self.shapes = shapes
+        self.stats = stats
+        self.paths = paths
+        self.fingerprint = fingerprint
+        self.path = None  # directory the boxes are mapped from
+
+    @classmethod
+    def from_labels(cls, labels, shapes, stats, paths, fingerprint=""):
+        """ Build a store from a list of per-image ``(n, 5)`` label arrays. """
+        counts = np.array([len(l) for l in labels], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        boxes = np.concatenate(labels, 0) if len(labels) else np.zeros((0, 5), dtype=np.float32)
+        return cls(boxes.astype(np.float32, copy=False).reshape(-1, 5), offsets, shapes, stats, paths, fingerprint)
+
+    @classmethod
+    def load(cls, path):
+        """ Memory-map a store saved with ``save()``, returns ``None`` if it is missing or unreadable. """
+        if not os.path.isdir(path):
+            return None
+        try:
+            arrays = {k: np.load(os.path.join(path, k + ".npy"), mmap_mode="r")
+                      for k in ("boxes", "offsets", "shapes", "stats")}
+            with open(os.path.join(path, "paths.txt")) as f:
+                paths = f.read().split("\n")
+            with open(os.path.join(path, "fingerprint")) as f:
+                fingerprint = f.read()
+        except (OSError, ValueError):
+            return None
+        store = cls(arrays["boxes"], np.asarray(arrays["offsets"]), arrays["shapes"], arrays["stats"], paths,
+                    fingerprint)
+        store.path = path
+        return store
+
+    def save(self, path):
+        """ Save the store as a directory of ``.npy`` files, replacing ``path`` atomically. """
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        offsets = np.concatenate(([0], np.cumsum(self.counts())))
+        np.save(os.path.join(tmp, "boxes.npy"), self.flat()[0])
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp, "shapes.npy"), np.ascontiguousarray(self.shapes))
+        np.save(os.path.join(tmp, "stats.npy"), np.ascontiguousarray(self.stats))
+        with open(os.path.join(tmp, "paths.txt"), "w") as f:
+            f.write("\n".join(self.paths))
+        with open(os.path.join(tmp, "fingerprint"), "w") as f:
+            f.write(self.fingerprint)
+
+        if os.path.isfile(path):  # label cache written by an older version
+            os.remove(path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        return self.boxes[self.starts[index]:self.ends[index]]  # view, shape(n, 5)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state["boxes"] = None  # re-map in the worker instead of pickling every box
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.boxes is None:
+            self.boxes = np.load(os.path.join(self.path, "boxes.npy"), mmap_mode="r")
+
+    def counts(self):
+        """ Number of boxes of every image. """
+        return self.ends - self.starts
+
+    def index(self):
+        """ Map of image path to row. """
+        return {p: i for i, p in enumerate(self.paths)}
+
+    def take(self, indices):
+        """ Returns a store with the rows ``indices``, sharing the boxes array. """
+        store = LabelStore.__new__(LabelStore)
+        store.__dict__.update(self.__dict__)
+        store.starts, store.ends = self.starts[indices], self.ends[indices]
+        store.shapes, store.stats = self.shapes[indices], self.stats[indices]
+        store.paths = [self.paths[i] for i in indices]
+        return store
+
+    def flat(self):
+        """ Boxes of all rows in order, and the row every box belongs to.
+
+        Returns:
+            boxes (np.ndarray): shape(N, 5).
+            rows (np.ndarray): shape(N).
+
+        """
+        counts = self.counts()
+        rows = np.repeat(np.arange(len(self)), counts)
+        index = np.repeat(self.starts - np.cumsum(counts) + counts, counts) + np.arange(len(rows))
+        return self.boxes[index], rows
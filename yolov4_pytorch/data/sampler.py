@@ -0,0 +1,126 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import math
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class AspectRatioBatchSampler(Sampler):
+    """ Batch sampler grouping images of similar aspect ratio, with an optional multi-scale schedule.
+
+    Images are split into ``buckets`` groups by aspect ratio. Every epoch the images are shuffled
+    within their bucket, cut into batches and the batches are shuffled across buckets. Every batch
+    gets the smallest stride-multiple shape covering its aspect ratios, like the ``rect`` batch
+    shapes of ``LoadImagesAndLabels``, so little of it is letterbox padding.
+
+    The sampler yields lists of ``(index, (height, width))`` pairs, ``LoadImagesAndLabels`` builds
+    every image of the batch at that shape.
+
+    Args:
+        shapes (np.ndarray): Image sizes (width, height), shape(n, 2).
+        batch_size (int): Mini-batch size per process.
+        image_size (int, optional): Long side of the batch shapes. (default: ``640``)
+        stride (int, optional): Batch shapes are multiples of the model stride. (default: ``32``)
+        buckets (int, optional): Number of aspect ratio buckets, ``0`` for square batches. (default: ``8``)
+        scales (tuple, optional): Range ``(min, max)`` of the random image size as a fraction of ``image_size``,
+            ``None`` trains at ``image_size`` only. (default: ``None``)
+        scale_interval (int, optional): Number of steps between image size changes. (default: ``10``)
+        shuffle (bool, optional): Shuffle every epoch. (default: ``True``)
+        drop_last (bool, optional): Drop the last incomplete batch of every bucket. (default: ``False``)
+        seed (int, optional): Seed of the shuffle and of the image sizes, equal on all ranks. (default: ``0``)
+
+    """
+
+    def __init__(self, shapes, batch_size, image_size=640, stride=32, buckets=8, scales=None, scale_interval=10,
+                 shuffle=True, drop_last=False, seed=0):
+        from .shard import get_rank
+        self.rank, self.world_size = get_rank()
+        self.batch_size = batch_size
+        self.image_size = image_size
+        self.stride = stride
+        self.scales = scales
+        self.scale_interval = max(scale_interval, 1)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+        shapes = np.asarray(shapes, dtype=np.float64)
+        self.aspect_ratios = shapes[:, 1] / shapes[:, 0]  # h / w
+        if buckets > 1:  # equally populated buckets
+            edges = np.quantile(self.aspect_ratios, np.linspace(0, 1, buckets + 1)[1:-1])
+            bucket_index = np.searchsorted(edges, self.aspect_ratios, side="right")
+        else:
+            bucket_index = np.zeros(len(shapes), dtype=np.int64)
+        order = np.argsort(self.aspect_ratios, kind="stable")  # sorted within a bucket without shuffle
+        self.buckets = [order[bucket_index[order] == i] for i in np.unique(bucket_index)]
+        self.square = buckets <= 0
+
+    def set_epoch(self, epoch):
+        # Reshuffle and draw new image sizes, call before creating the iterator
+        self.epoch = epoch
+
+    def batches(self):
+        """ Batches of this epoch on all ranks, lists of image indices. """
+        rng = np.random.default_rng(self.seed + self.epoch)
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = rng.permutation(bucket)
+            stop = len(bucket) - len(bucket) % self.batch_size if self.drop_last else len(bucket)
+            batches += [bucket[i:i + self.batch_size] for i in range(0, stop, self.batch_size)]
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        # Same number of batches on every rank, wrap around
+        total = math.ceil(len(batches) / self.world_size) * self.world_size
+        return (batches * math.ceil(total / max(len(batches), 1)))[:total]
+
+    def image_sizes(self, steps):
+        """ Long side of the batches at every step, one size per ``scale_interval`` steps. """
+        if self.scales is None:
+            return np.full(steps, self.image_size, dtype=np.int64)
+        rng = np.random.default_rng((self.seed, self.epoch))  # independent of the shuffle
+        low = max(math.floor(self.image_size * self.scales[0] / self.stride), 1)
+        high = max(math.ceil(self.image_size * self.scales[1] / self.stride), low)
+        sizes = rng.integers(low, high + 1, size=math.ceil(steps / self.scale_interval)) * self.stride
+        return np.repeat(sizes, self.scale_interval)[:steps]
+
+    def batch_shape(self, indices, image_size):
+        # Smallest (height, width) multiple of stride with long side image_size covering all aspect ratios
+        if self.square:
+            return image_size, image_size
+        ar = self.aspect_ratios[indices]
+        shape = [1, 1]
+        if ar.max() < 1:
+            shape = [ar.max(), 1]
+        elif ar.min() > 1:
+            shape = [1, 1 / ar.min()]
+        h, w = np.ceil(np.array(shape) * image_size / self.stride).astype(np.int64) * self.stride
+        return int(h), int(w)
+
+    def __iter__(self):
+        batches = self.batches()[self.rank::self.world_size]
+        sizes = self.image_sizes(len(batches))  # step k has the same size on every rank
+        for indices, image_size in zip(batches, sizes):
+            shape = self.batch_shape(indices, image_size)
+            yield [(int(i), shape) for i in indices]
+
+    def __len__(self):
+        if self.drop_last:
+            n = sum(len(x) // self.batch_size for x in self.buckets)
+        else:
+            n = sum(math.ceil(len(x) / self.batch_size) for x in self.buckets)
+        return math.ceil(n / self.world_size)
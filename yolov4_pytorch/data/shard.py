@@ -0,0 +1,284 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Sharded dataset format. Images and labels are packed into large tar files which are
+    read sequentially, instead of opening two small files per image.
+
+    Shard layout::
+
+        shards/
+            shard-000000.tar    # 000000000.jpg, 000000000.labels, 000000001.jpg, ...
+            shard-000001.tar
+            labels/             # LabelStore of all samples, row i is the sample with key i
+"""
+import glob
+import io
+import math
+import os
+import random
+import tarfile
+
+import cv2
+import numpy as np
+import torch.distributed
+from torch.utils.data import IterableDataset
+from torch.utils.data import get_worker_info
+from tqdm import tqdm
+
+from .common import letterbox
+from .image import build_mosaic
+from .image import reduced_flag
+from .image import resize_image
+from .image import reuse_buffer
+from .image import format_sample
+from .labels import LabelStore
+
+shard_format = "shard-%06d.tar"
+
+
+def is_shards(dataroot):
+    """ Returns ``True`` if ``dataroot`` is a directory of packed shards. """
+    return isinstance(dataroot, str) and os.path.isdir(dataroot) and \
+        os.path.isdir(os.path.join(dataroot, "labels")) and len(glob.glob(os.path.join(dataroot, "*.tar"))) > 0
+
+
+def write_shards(dataset, output, shard_size=1 << 30, min_shards=1):
+    """ Pack the images and labels of a dataset into tar shards.
+
+    Args:
+        dataset (LoadImagesAndLabels): Dataset to pack, its checked labels are written with the images.
+        output (str): Output directory.
+        shard_size (int, optional): Approximate size of every shard in bytes. (default: ``1 << 30``)
+        min_shards (int, optional): Write at least this many shards, e.g. DDP world size x DataLoader workers,
+            smaller shards are written if needed. (default: ``1``)
+
+    Returns:
+        The list of written shard paths.
+
+    """
+    os.makedirs(output, exist_ok=True)
+    shards, tar, size, count = [], None, 0, 0
+    shard_length = max(len(dataset.image_files) // min_shards, 1)  # samples per shard for min_shards
+    for i, path in enumerate(tqdm(dataset.image_files, desc=f"Packing shards to {output}")):
+        if tar is None or size >= shard_size or count >= shard_length:
+            if tar is not None:
+                tar.close()
+            shards.append(os.path.join(output, shard_format % len(shards)))
+            tar, size, count = tarfile.open(shards[-1], "w"), 0, 0
+
+        key = "%09d" % i
+        with open(path, "rb") as f:
+            image = f.read()  # encoded bytes, decoded by the reader
+        labels = np.ascontiguousarray(dataset.labels[i], dtype=np.float32).tobytes()
+        for name, data in ((key + os.path.splitext(path)[-1].lower(), image), (key + ".labels", labels)):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            size += len(data)
+        count += 1
+    if tar is not None:
+        tar.close()
+
+    dataset.labels.save(os.path.join(output, "labels"))  # row i is the sample with key i
+    return shards
+
+
+def read_shards(shards):
+    # Samples of the shards one after the other
+    for shard in shards:
+        yield from read_shard(shard)
+
+
+def take(samples, number):
+    # Exactly number samples of the generator function samples(), restarted to pad with repeated samples
+    count = 0
+    while count < number:
+        empty = True
+        for sample in samples():
+            if count == number:
+                return
+            yield sample
+            count, empty = count + 1, False
+        assert not empty, "No samples to repeat"
+
+
+def read_shard(path):
+    """ Read a shard sequentially, yields ``(key, image bytes, labels bytes)`` for every sample. """
+    key, sample = None, {}
+    with tarfile.open(path, "r|") as tar:  # stream mode, no seeks
+        for member in tar:
+            if not member.isfile():
+                continue
+            name, ext = os.path.splitext(member.name)
+            if name != key:
+                if key is not None:
+                    yield key, sample.get("image"), sample.get("labels", b"")
+                key, sample = name, {}
+            sample["labels" if ext == ".labels" else "image"] = tar.extractfile(member).read()
+    if key is not None:
+        yield key, sample.get("image"), sample.get("labels", b"")
+
+
+class LoadShards(IterableDataset):  # for training/testing on packed shards
+    """ Streaming dataset over shards written by ``write_shards()``.
+
+    Shards are shuffled once per epoch and split across DDP ranks, then across the DataLoader workers
+    of a rank. With fewer shards than workers, the workers of a rank split the samples of every shard
+    of the rank instead. Every rank yields ``len(self)`` samples, truncated or padded with repeated
+    samples like ``DistributedSampler``, so all ranks run the same number of steps. The samples of a rank
+    are rounded up to whole batches and split across its workers batch by batch, as every worker collates
+    its own batches, so no worker yields a partial batch and ``len(dataloader)`` is exact. Every worker reads
+    its shards front to back and shuffles samples through a buffer. Mosaic draws the 3 additional
+    tiles from that buffer. The buffer holds encoded images, so it is cheap to make it large.
+
+    Args:
+        dataroot (str): Directory of shards.
+        image_size (int, optional): Size of processing picture. (default: ``640``)
+        augment (bool, optional): Apply mosaic and image augmentation. (default: ``False``)
+        hyper_parameters (dict, optional): Augmentation hyper parameters. (default: ``None``)
+        batch_size (int, optional): Mini-batch size of the DataLoader. (default: ``1``)
+        num_workers (int, optional): Worker processes of the DataLoader, ``0`` loads in the main process.
+            (default: ``0``)
+        buffer_size (int, optional): Samples in the shuffle buffer, ``0`` keeps the shard order. (default: ``1000``)
+        seed (int, optional): Seed of the shard and buffer shuffle. (default: ``0``)
+
+    """
+
+    def __init__(self, dataroot, image_size=640, augment=False, hyper_parameters=None, batch_size=1, num_workers=0,
+                 buffer_size=1000, seed=0):
+        self.shards = sorted(glob.glob(os.path.join(dataroot, "*.tar")))
+        assert len(self.shards) > 0, f"No shards found in {dataroot}"
+        self.labels = LabelStore.load(os.path.join(dataroot, "labels"))
+        assert self.labels is not None, f"No labels found in {dataroot}, pack it with scripts/pack_shards.py"
+        self.shapes = np.array(self.labels.shapes, dtype=np.float64)
+        self.image_files = self.labels.paths
+
+        self.n = len(self.labels)  # number of images
+        self.image_size = image_size
+        self.augment = augment
+        self.hyper_parameters = hyper_parameters
+        self.mosaic = augment
+        self.mosaic_border = [-image_size // 2, -image_size // 2]
+        self.augment_buffer = None  # output image of build_mosaic(), allocated once per worker
+        self.batch_augment = False  # color jitter and flips are left to a BatchAugment after collate
+        self.batch_size = batch_size
+        self.num_workers = max(num_workers, 1)  # the main process loads like a single worker
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        # Reshuffle shards and the buffer differently every epoch, call before creating the iterator
+        self.epoch = epoch
+
+    def __len__(self):
+        rank, world_size = get_rank()
+        samples = math.ceil(self.n / world_size)  # samples per rank, padded like DistributedSampler
+        return math.ceil(samples / self.batch_size) * self.batch_size  # whole batches
+
+    def worker_length(self, worker_id):
+        # Samples of a worker, the batches of the rank split across the workers
+        batches = len(self) // self.batch_size
+        return (batches // self.num_workers + (worker_id < batches % self.num_workers)) * self.batch_size
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        assert num_workers == self.num_workers, \
+            f"LoadShards is built for {self.num_workers} workers, the DataLoader runs {num_workers}"
+        rank, world_size = get_rank()
+        slot, slots = rank * num_workers + worker_id, world_size * num_workers
+        assert len(self.shards) >= world_size, \
+            f"{len(self.shards)} shards can not be split across {world_size} ranks, " \
+            f"repack with `python scripts/pack_shards.py --min-shards {slots}`"
+
+        epoch = self.epoch
+        self.epoch += 1  # persistent workers keep their copy of the dataset, set_epoch() does not reach them
+        shards = list(self.shards)
+        if self.buffer_size > 0:
+            random.Random(self.seed + epoch).shuffle(shards)  # same order in every worker and rank
+        shards = shards[rank::world_size]
+
+        # Samples of this worker, the workers of a rank yield len(self) samples together
+        number = self.worker_length(worker_id)
+        if len(shards) >= num_workers:
+            samples = take(lambda: read_shards(shards[worker_id::num_workers]), number)
+        else:  # fewer shards than workers, the workers of this rank split the samples of every shard
+            samples = take(lambda: (x for i, x in enumerate(read_shards(shards)) if i % num_workers == worker_id),
+                           number)
+
+        if self.buffer_size <= 0:
+            for sample in samples:
+                yield self.transform(sample, None)
+            return
+
+        rng = random.Random(self.seed + epoch * slots + slot)
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            i = rng.randrange(len(buffer))
+            sample, buffer[i] = buffer[i], sample
+            yield self.transform(sample, buffer)
+        rng.shuffle(buffer)
+        while buffer:
+            yield self.transform(buffer.pop(), buffer)
+
+    def decode(self, sample):
+        key, image, labels = sample
+        shape = tuple(int(x) for x in self.shapes[int(key)])  # original wh
+        flag = reduced_flag(shape, self.image_size) if image[:2] == b"\xff\xd8" else cv2.IMREAD_COLOR  # JPEG
+        img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flag)  # BGR
+        assert img is not None, 'Image Not Found ' + self.image_files[int(key)]
+        img = resize_image(img, self.image_size, self.augment, shape=shape if flag != cv2.IMREAD_COLOR else None)
+        return img, np.frombuffer(labels, dtype=np.float32).reshape(-1, 5)
+
+    def transform(self, sample, buffer):
+        path = self.image_files[int(sample[0])]
+        if self.mosaic:
+            # Load mosaic, 3 additional tiles from the shuffle buffer
+            others = random.choices(buffer, k=3) if buffer else [sample] * 3
+            tiles = [(img, labels) for (img, _, _), labels in map(self.decode, [sample] + others)]
+            self.augment_buffer = reuse_buffer(self.augment_buffer, (self.image_size, self.image_size))
+            img, labels = build_mosaic(tiles, self.image_size, self.mosaic_border, self.hyper_parameters,
+                                       out=self.augment_buffer, lr_flip=not self.batch_augment)
+            shapes = None
+
+        else:
+            # Load image
+            (img, (h0, w0), (h, w)), x = self.decode(sample)
+
+            # Letterbox
+            img, ratio, pad = letterbox(img, self.image_size, auto=False, scaleup=self.augment)
+            shapes = (h0, w0), ((h / h0, w / w0), pad)  # for COCO mAP rescaling
+
+            # Normalized xywh to pixel xyxy format
+            labels = x.copy()
+            if x.size > 0:
+                labels[:, 1] = ratio[0] * w * (x[:, 1] - x[:, 3] / 2) + pad[0]  # pad width
+                labels[:, 2] = ratio[1] * h * (x[:, 2] - x[:, 4] / 2) + pad[1]  # pad height
+                labels[:, 3] = ratio[0] * w * (x[:, 1] + x[:, 3] / 2) + pad[0]
+                labels[:, 4] = ratio[1] * h * (x[:, 2] + x[:, 4] / 2) + pad[1]
+
+        color = self.augment and not self.batch_augment
+        img, labels_out = format_sample(img, labels, self.hyper_parameters if color else None)
+        return img, labels_out, path, shapes
+
+
+def get_rank():
+    # Returns (rank, world size) of this process, (0, 1) if not distributed
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return 0, 1
@@ -11,43 +11,64 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-from .classifier import apply_classifier
-from .classifier import load_classifier
-from .common import model_info
-from .common import strip_optimizer
-from .concat import Concat
-from .fuse import fuse_conv_and_bn
-from .module import Bottleneck
-from .module import BottleneckCSP
-from .module import Concat
-from .module import Conv
-from .module import DWConv
-from .module import Detect
-from .module import Focus
-from .module import HardSwish
-from .module import MemoryEfficientMish
-from .module import MemoryEfficientSwish
-from .module import Mish
-from .module import MishImplementation
-from .module import MixConv2d
-from .module import SPP
-from .module import Swish
-from .module import SwishImplementation
-from .module import YOLO
-from .module import parse_model
+"""
+    Attributes are imported from their submodule on first use, so that e.g. the inference core does not
+    load the second-stage classifier (torchvision models) until they are needed.
+"""
+from ..utils.lazy import lazy_attributes
+
+_submodules = {
+    "apply_classifier": "classifier",
+    "load_classifier": "classifier",
+    "model_flops": "common",
+    "model_info": "common",
+    "strip_optimizer": "common",
+    "Concat": "module",
+    "export_torchscript": "export",
+    "load_torchscript": "export",
+    "fuse_concat_and_bn": "fuse",
+    "fuse_conv_and_bn": "fuse",
+    "CPUInference": "inference",
+    "Bottleneck": "module",
+    "BottleneckCSP": "module",
+    "Conv": "module",
+    "DWConv": "module",
+    "Detect": "module",
+    "Focus": "module",
+    "HardSwish": "module",
+    "MemoryEfficientMish": "module",
+    "MemoryEfficientSwish": "module",
+    "Mish": "module",
+    "MishImplementation": "module",
+    "ScriptedMish": "module",
+    "MixConv2d": "module",
+    "SPP": "module",
+    "Swish": "module",
+    "SwishImplementation": "module",
+    "YOLO": "module",
+    "parse_model": "module",
+}
+
+__getattr__, __dir__ = lazy_attributes(__name__, _submodules)
 
 __all__ = [
     "apply_classifier",
     "load_classifier",
+    "model_flops",
     "model_info",
     "strip_optimizer",
     "Concat",
+    "export_torchscript",
+    "load_torchscript",
+    "fuse_concat_and_bn",
     "fuse_conv_and_bn",
+    "CPUInference",
     "HardSwish",
     "MemoryEfficientMish",
     "MemoryEfficientSwish",
     "Mish",
     "MishImplementation",
+    "ScriptedMish",
     "Swish",
     "SwishImplementation",
     "Concat",
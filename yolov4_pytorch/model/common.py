@@ -19,6 +19,34 @@ import torch
 ONNX_EXPORT = False
 
 
+_flops = {}  # key: GFLOPS of model_flops()
+
+
+def model_flops(model, key=None):
+    """ GFLOPS of a model at 640x640, profiled with thop at 64x64 on a copy of the model.
+
+    Args:
+        model (nn.Module): Model to profile.
+        key (hashable, optional): Cache the result under this key, e.g. the config hash, and return the cached
+            value on later calls. (default: ``None``, not cached)
+
+    Returns:
+        The GFLOPS, ``None`` when thop is not installed or can not profile the model.
+
+    """
+    if key is not None and key in _flops:
+        return _flops[key]
+    try:
+        from thop import profile
+        flops = profile(deepcopy(model), inputs=(torch.zeros(1, 3, 64, 64),), verbose=False)[0] / 1E9 * 2
+        flops *= 100  # 640x640 FLOPS
+    except:
+        flops = None
+    if key is not None:
+        _flops[key] = flops
+    return flops
+
+
 def model_info(model, verbose=False):
     # Plots a line-by-line description of a PyTorch model
     n_p = sum(x.numel() for x in model.parameters())  # number parameters
@@ -30,12 +58,8 @@ def model_info(model, verbose=False):
             print('%5g %40s %9s %12g %20s %10.3g %10.3g' %
                   (i, name, p.requires_grad, p.numel(), list(p.shape), p.mean(), p.std()))
 
-    try:  # FLOPS
-        from thop import profile
-        flops = profile(deepcopy(model), inputs=(torch.zeros(1, 3, 64, 64),), verbose=False)[0] / 1E9 * 2
-        fs = ', %.1f GFLOPS' % (flops * 100)  # 640x640 FLOPS
-    except:
-        fs = ''
+    flops = model.flops() if hasattr(model, 'flops') else model_flops(model)
+    fs = ', %.1f GFLOPS' % flops if flops is not None else ''
 
     print('Model Summary: %g layers, %g parameters, %g gradients%s' % (len(list(model.parameters())), n_p, n_g, fs))
 
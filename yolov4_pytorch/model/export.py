@@ -0,0 +1,115 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Self-contained TorchScript model files, loaded without the YAML config or ``parse_model``.
+"""
+import json
+import warnings
+from typing import List
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+
+METADATA = "metadata.json"  # name of the metadata in the TorchScript file
+
+
+class DetectDecode(nn.Module):
+    # Scriptable inference decode of Detect(), grids are built per call so any input shape works
+    def __init__(self, detect):
+        super(DetectDecode, self).__init__()
+        self.register_buffer('stride', detect.stride.clone().float())
+        self.register_buffer('anchor_grid', detect.anchor_grid.clone())
+
+    def forward(self, x: List[torch.Tensor]) -> torch.Tensor:
+        z: List[torch.Tensor] = []
+        for i, xi in enumerate(x):  # x(bs,na,ny,nx,no)
+            bs, ny, nx, no = xi.shape[0], xi.shape[2], xi.shape[3], xi.shape[4]
+            yv, xv = torch.meshgrid([torch.arange(ny, device=xi.device), torch.arange(nx, device=xi.device)])
+            grid = torch.stack((xv, yv), 2).view(1, 1, ny, nx, 2).to(xi.dtype)
+            y = xi.sigmoid()
+            xy = (y[..., 0:2] * 2. - 0.5 + grid) * self.stride[i].to(xi.dtype)
+            wh = (y[..., 2:4] * 2) ** 2 * self.anchor_grid[i].to(xi.dtype)
+            z.append(torch.cat((xy, wh, y[..., 4:]), -1).view(bs, -1, no))
+        return torch.cat(z, 1)
+
+
+class ExportedYOLO(nn.Module):
+    # Traced layers and a scripted decode, returns (prediction, outputs) like YOLO in eval mode
+    def __init__(self, layers, detect):
+        super(ExportedYOLO, self).__init__()
+        self.layers = layers
+        self.decode = DetectDecode(detect)
+
+    def forward(self, x: torch.Tensor, augment: bool = False) -> Tuple[torch.Tensor, List[torch.Tensor]]:
+        assert not augment, "augmented inference needs the YOLO model"
+        outputs: List[torch.Tensor] = self.layers(x)
+        return self.decode(outputs), outputs
+
+
+def export_torchscript(model, path, names, image_size=640, half=False):
+    """ Write a fused, frozen TorchScript file of a ``YOLO`` model, with its metadata.
+
+    The layers are traced with ``Detect`` in export mode, which returns the raw outputs of every layer.
+    The decode is scripted and builds its grids from the output shapes, so the file runs at every input
+    shape, e.g. rect letterboxed images. Strides, class names and the letterbox settings of ``LoadImages``
+    are stored as ``metadata.json`` in the file.
+
+    Args:
+        model (YOLO): Model with its weights loaded, it is fused and put in eval mode.
+        path (str): TorchScript file to write.
+        names (list): Class names.
+        image_size (int, optional): Letterbox size of the inputs. (default: ``640``)
+        half (bool, optional): Export in FP16, only supported on CUDA. (default: ``False``)
+
+    Returns:
+        The metadata.
+
+    """
+    detect = model.model[-1]
+    device = next(model.parameters()).device
+    model = model.float().fuse(verbose=False).eval()
+    if half:
+        model.half()
+
+    image = torch.zeros(1, 3, image_size, image_size, device=device, dtype=torch.half if half else torch.float)
+    detect.export = True  # raw outputs, the decode is scripted separately
+    try:
+        with warnings.catch_warnings(), torch.no_grad():
+            warnings.simplefilter("ignore", torch.jit.TracerWarning)
+            layers = torch.jit.trace(model, image, strict=False, check_trace=False)
+    finally:
+        detect.export = False
+    detect.training = False  # export mode sets it
+
+    module = torch.jit.freeze(torch.jit.script(ExportedYOLO(layers, detect).eval()))
+    metadata = {"stride": detect.stride.tolist(),
+                "names": list(names),
+                "image_size": image_size,
+                "half": half,
+                "letterbox": {"auto": True, "color": [114, 114, 114], "scaleFill": False, "scaleup": True}}
+    torch.jit.save(module, path, _extra_files={METADATA: json.dumps(metadata)})
+    return metadata
+
+
+def load_torchscript(path, device=None):
+    """ Load a file written by ``export_torchscript()``.
+
+    Returns:
+        The TorchScript module, called like ``YOLO`` in eval mode, and its metadata.
+
+    """
+    extra_files = {METADATA: ""}
+    module = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    return module, json.loads(extra_files[METADATA])
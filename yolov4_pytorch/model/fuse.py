@@ -24,6 +24,8 @@ def fuse_conv_and_bn(conv, bn):
                               kernel_size=conv.kernel_size,
                               stride=conv.stride,
                               padding=conv.padding,
+                              dilation=conv.dilation,
+                              groups=conv.groups,
                               bias=True).to(conv.weight.device)
 
         # prepare filters
@@ -37,3 +39,19 @@ def fuse_conv_and_bn(conv, bn):
         fusedconv.bias.copy_(torch.mm(w_bn, b_conv.reshape(-1, 1)).reshape(-1) + b_bn)
 
         return fusedconv
+
+
+def fuse_concat_and_bn(convs, bn):
+    # Fold a BatchNorm2d() applied to torch.cat([conv(x) for conv in convs], 1) into each of the convolutions
+    fused, start = [], 0
+    for conv in convs:
+        end = start + conv.out_channels
+        part = nn.BatchNorm2d(conv.out_channels, eps=bn.eps).to(bn.weight.device)
+        with torch.no_grad():
+            part.weight.copy_(bn.weight[start:end])
+            part.bias.copy_(bn.bias[start:end])
+            part.running_mean.copy_(bn.running_mean[start:end])
+            part.running_var.copy_(bn.running_var[start:end])
+        fused.append(fuse_conv_and_bn(conv, part))
+        start = end
+    return fused
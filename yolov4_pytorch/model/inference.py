@@ -0,0 +1,79 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Inference engines for devices without half precision.
+"""
+import warnings
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+
+class CPUInference(nn.Module):
+    """ Channels-last, optionally bfloat16, inference of a fused ``YOLO`` model on CPU.
+
+    The model is converted to ``channels_last`` once. Every new input shape is traced, frozen and, in
+    float32, passed through ``torch.jit.optimize_for_inference``, which pre-packs the convolution
+    weights for oneDNN. Traced models are kept per input shape in a bounded LRU cache, as ``Detect``
+    bakes the grid of the traced shape into the graph. Calls with ``augment=True`` run the eager model.
+
+    Returns the same ``(prediction, outputs)`` as ``YOLO`` in eval mode, in float32.
+
+    Args:
+        model (YOLO): Model to run, fuse it first.
+        bfloat16 (bool, optional): Run convolutions and matmuls under bfloat16 autocast. (default: ``False``)
+        trace (bool, optional): Trace, freeze and pre-pack per input shape, else run the model eagerly.
+            (default: ``True``)
+        cache_size (int, optional): Number of traced input shapes to keep. (default: ``8``)
+
+    """
+
+    def __init__(self, model, bfloat16=False, trace=True, cache_size=8):
+        super(CPUInference, self).__init__()
+        self.model = model.eval().to(memory_format=torch.channels_last)
+        self.bfloat16 = bfloat16
+        self.trace = trace
+        self.cache_size = cache_size
+        self.traced = OrderedDict()  # input shape: frozen module
+
+    def _autocast(self):
+        return torch.cpu.amp.autocast(enabled=self.bfloat16, dtype=torch.bfloat16)
+
+    def _compile(self, x):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", torch.jit.TracerWarning)
+            with torch.no_grad(), self._autocast():
+                module = torch.jit.trace(self.model, x, strict=False, check_trace=False)
+                module = torch.jit.freeze(module.eval())
+        if not self.bfloat16:  # pre-packed oneDNN convolutions are float32 only
+            module = torch.jit.optimize_for_inference(module)
+        return module
+
+    def forward(self, x, augment=False):
+        x = x.float().contiguous(memory_format=torch.channels_last)
+        if augment or not self.trace:
+            with torch.no_grad(), self._autocast():
+                prediction, outputs = self.model(x, augment=augment)
+        else:
+            key = tuple(x.shape)
+            if key in self.traced:
+                self.traced.move_to_end(key)
+            else:
+                self.traced[key] = self._compile(x)
+                if len(self.traced) > self.cache_size:
+                    self.traced.popitem(last=False)  # least recently used
+            with torch.no_grad():
+                prediction, outputs = self.traced[key](x)
+        return prediction.float(), outputs if outputs is None else [o.float() for o in outputs]
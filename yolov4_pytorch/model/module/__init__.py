@@ -12,12 +12,16 @@
 # limitations under the License.
 # ==============================================================================
 from .activations import HardSwish
+from .activations import MISH_IMPLEMENTATIONS
 from .activations import MemoryEfficientMish
 from .activations import MemoryEfficientSwish
 from .activations import Mish
 from .activations import MishImplementation
+from .activations import ScriptedMish
+from .activations import ScriptedMishImplementation
 from .activations import Swish
 from .activations import SwishImplementation
+from .activations import mish
 from .common import Concat
 from .common import Focus
 from .common import check_anchor_order
@@ -39,12 +43,16 @@ from .neck import YOLOv4_Bottleneck
 
 __all__ = [
     "HardSwish",
+    "MISH_IMPLEMENTATIONS",
     "MemoryEfficientMish",
     "MemoryEfficientSwish",
     "Mish",
     "MishImplementation",
+    "ScriptedMish",
+    "ScriptedMishImplementation",
     "Swish",
     "SwishImplementation",
+    "mish",
     "Concat",
     "Focus",
     "check_anchor_order",
@@ -18,6 +18,8 @@ import torch
 import torch.nn.functional as F
 import torch.nn as nn
 
+from ...utils.lazy import lazy_script
+
 
 class HardSwish(nn.Module):  # https://arxiv.org/pdf/1905.02244.pdf
     @staticmethod
@@ -57,6 +59,51 @@ class Mish(nn.Module):  # https://github.com/digantamisra98/Mish
         return x * F.softplus(x).tanh()
 
 
+def mish_forward(x):
+    return x * F.softplus(x).tanh()
+
+
+def mish_backward(grad_output, x):
+    # TorchScript fuses the element-wise ops into one kernel on GPU
+    fx = F.softplus(x).tanh()
+    return grad_output * (fx + x * torch.sigmoid(x) * (1 - fx * fx))
+
+
+class ScriptedMish(nn.Module):
+    @staticmethod
+    def forward(x):
+        return ScriptedMishImplementation.apply(x)
+
+
+class ScriptedMishImplementation(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, x):
+        ctx.save_for_backward(x)
+        return lazy_script(mish_forward)(x)  # compiled on first use, not at import
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        return lazy_script(mish_backward)(grad_output, ctx.saved_tensors[0])
+
+
+MISH_IMPLEMENTATIONS = {"plain": Mish,  # autograd keeps the softplus and tanh outputs
+                        "memory_efficient": MemoryEfficientMish,  # keeps only the input
+                        "scripted": ScriptedMish}  # keeps only the input, fused forward and backward kernels
+
+
+def mish(implementation="plain"):
+    """ Mish activation module of an implementation in ``MISH_IMPLEMENTATIONS``.
+
+    Args:
+        implementation (str, optional): ``plain``, ``memory_efficient`` or ``scripted``. (default: ``plain``)
+
+    """
+    if implementation not in MISH_IMPLEMENTATIONS:
+        raise ValueError(f"Unknown Mish implementation `{implementation}`, "
+                         f"expected one of {', '.join(MISH_IMPLEMENTATIONS)}")
+    return MISH_IMPLEMENTATIONS[implementation]()
+
+
 class Swish(nn.Module):
     @staticmethod
     def forward(x):
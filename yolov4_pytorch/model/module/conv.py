@@ -18,7 +18,7 @@ import numpy as np
 import torch
 import torch.nn as nn
 
-from .activations import Mish
+from .activations import mish as make_mish
 
 
 def autopad(k, p=None):  # kernel, padding
@@ -46,6 +46,11 @@ class C3(nn.Module):
         y2 = self.cv2(x)
         return self.cv4(self.act(self.bn(torch.cat((y1, y2), dim=1))))
 
+    def fuseforward(self, x):
+        y1 = self.cv3(self.m(self.cv1(x)))
+        y2 = self.cv2(x)
+        return self.cv4(self.act(torch.cat((y1, y2), dim=1)))
+
 
 class Conv(nn.Module):
     # Standard convolution
@@ -64,12 +69,12 @@ class Conv(nn.Module):
 
 class ConvBNMish(nn.Module):
     # YOLOv4 conventional convolution module
-    def __init__(self, in_channels, out_channels, kernel_size=1, stride=1, padding=None, groups=1):
+    def __init__(self, in_channels, out_channels, kernel_size=1, stride=1, padding=None, groups=1, mish="plain"):
         super(ConvBNMish, self).__init__()
         self.conv = nn.Conv2d(in_channels, out_channels, kernel_size, stride,
                               padding=autopad(kernel_size, padding), groups=groups, bias=False)
         self.bn = nn.BatchNorm2d(out_channels)
-        self.act = Mish()
+        self.act = make_mish(mish)
 
     def forward(self, x):
         return self.act(self.bn(self.conv(x)))
@@ -120,6 +125,9 @@ class MixConv2d(nn.Module):
     def forward(self, x):
         return x + self.act(self.bn(torch.cat([m(x) for m in self.m], 1)))
 
+    def fuseforward(self, x):
+        return x + self.act(torch.cat([m(x) for m in self.m], 1))
+
 
 class MobileNetConv(nn.Module):
     # Standard convolution
@@ -11,13 +11,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import hashlib
+import json
 import math
+from collections import OrderedDict
+from contextlib import contextmanager
 from copy import deepcopy
 from pathlib import Path
 
 import torch
 import torch.nn as nn
 from torch.cuda import amp
+from torch.utils.checkpoint import checkpoint
 
 from .common import Concat
 from .common import Focus
@@ -35,23 +40,25 @@ from .neck import BottleneckCSP
 from .neck import YOLOv4_Bottleneck
 from .neck import YOLOv4_BottleneckCSP
 from .pooling import Maxpool
+from ..common import model_flops
 from ..common import model_info
+from ..fuse import fuse_concat_and_bn
 from ..fuse import fuse_conv_and_bn
-from ...data.image import scale_image
 from ...utils.common import make_divisible
 from ...utils.device import time_synchronized
 from ...utils.weights import initialize_weights
 
 
 class Detect(nn.Module):
-    def __init__(self, nc=80, anchors=(), ch=()):  # detection layer
+    def __init__(self, nc=80, anchors=(), ch=(), cache_size=16):  # detection layer
         super(Detect, self).__init__()
         self.stride = None  # strides computed during build
         self.nc = nc  # number of classes
         self.no = nc + 5  # number of outputs per anchor
         self.nl = len(anchors)  # number of detection layers
         self.na = len(anchors[0]) // 2  # number of anchors
-        self.grid = [torch.zeros(1)] * self.nl  # init grid
+        self.grids = OrderedDict()  # (layer, ny, nx, device, dtype): decode tensors, least recently used first
+        self.cache_size = cache_size  # number of grids kept, inputs of a few shapes alternate in rect batches
         a = torch.tensor(anchors).float().view(self.nl, -1, 2)
         self.register_buffer('anchors', a)  # shape(nl,na,2)
         self.register_buffer('anchor_grid', a.clone().view(self.nl, 1, -1, 1, 1, 2))  # shape(nl,1,na,1,1,2)
@@ -60,7 +67,8 @@ class Detect(nn.Module):
 
     def forward(self, x):
         # x = x.copy()  # for profiling
-        z = []  # inference output
+        z = None  # inference output of all layers, (bs, anchors * grid cells, no)
+        cells, start = sum(xi.shape[-2] * xi.shape[-1] for xi in x), 0  # grid cells of all layers
         self.training |= self.export
         for i in range(self.nl):
             x[i] = self.m[i](x[i])  # conv
@@ -68,15 +76,43 @@ class Detect(nn.Module):
             x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()
 
             if not self.training:  # inference
-                if self.grid[i].shape[2:4] != x[i].shape[2:4]:
-                    self.grid[i] = self._make_grid(nx, ny).to(x[i].device)
+                if z is None:  # dtype of the convolution output, e.g. under autocast
+                    z = x[i].new_empty(bs, self.na * cells, self.no)
+                xy_offset, wh_gain, xy_gain = self._grid(i, nx, ny, x[i])
 
-                y = x[i].sigmoid()
-                y[..., 0:2] = (y[..., 0:2] * 2. - 0.5 + self.grid[i].to(x[i].device)) * self.stride[i]  # xy
-                y[..., 2:4] = (y[..., 2:4] * 2) ** 2 * self.anchor_grid[i]  # wh
-                z.append(y.view(bs, -1, self.no))
+                # Decode in place into this layer's part of z
+                # xy = (sigmoid * 2 - 0.5 + grid) * stride, wh = (sigmoid * 2) ** 2 * anchor
+                y = z[:, start:start + self.na * ny * nx].view(bs, self.na, ny, nx, self.no)
+                if x[i].requires_grad:  # out= can not be recorded by autograd
+                    y.copy_(x[i].sigmoid())
+                else:
+                    torch.sigmoid(x[i], out=y)
+                y[..., 0:2].mul_(xy_gain).add_(xy_offset)  # xy
+                y[..., 2:4].pow_(2).mul_(wh_gain)  # wh
+                start += self.na * ny * nx
 
-        return x if self.training else (torch.cat(z, 1), x)
+        return x if self.training else (z, x)
+
+    def _grid(self, i, nx, ny, x):
+        # Cached (grid - 0.5) * stride, 4 * anchors and 2 * stride of layer i, the anchors version invalidates them
+        key = (i, ny, nx, x.device, x.dtype)
+        version = self.anchor_grid._version  # bumped by in-place updates, e.g. check_anchors() and load_state_dict()
+        entry = self.grids.get(key)
+        if entry is None or entry[0] != version:
+            stride = float(self.stride[i])
+            grid = self._make_grid(nx, ny).to(x.device)
+            entry = (version, ((grid - 0.5) * stride).to(x.dtype), (self.anchor_grid[i] * 4).to(x.device, x.dtype),
+                     2. * stride)
+            self.grids[key] = entry
+            if len(self.grids) > self.cache_size:
+                self.grids.popitem(last=False)  # least recently used
+        else:
+            self.grids.move_to_end(key)
+        return entry[1:]
+
+    def _apply(self, *args, **kwargs):
+        self.grids.clear()  # .to(), .half() and .float() replace the anchor_grid buffer
+        return super(Detect, self)._apply(*args, **kwargs)
 
     @staticmethod
     def _make_grid(nx=20, ny=20):
@@ -85,7 +121,8 @@ class Detect(nn.Module):
 
 
 class YOLO(nn.Module):
-    def __init__(self, config_file='configs/yolov5-small.yaml', channels=3, number_classes=None):
+    def __init__(self, config_file='configs/yolov5-small.yaml', channels=3, number_classes=None,
+                 checkpoint_layers=None, mish=None, verbose=True):
         super(YOLO, self).__init__()
         if isinstance(config_file, dict):
             self.yaml = config_file  # model dict
@@ -97,9 +134,16 @@ class YOLO(nn.Module):
 
         # Define model
         if number_classes and number_classes != self.yaml['number_classes']:
-            print('Overriding %s nc=%g with nc=%g' % (config_file, self.yaml['number_classes'], number_classes))
+            if verbose:
+                print('Overriding %s nc=%g with nc=%g' % (config_file, self.yaml['number_classes'], number_classes))
             self.yaml['number_classes'] = number_classes  # override yaml value
-        self.model, self.save = parse_model(deepcopy(self.yaml), ch=[channels])  # model, savelist, ch_out
+        if mish:
+            self.yaml['mish'] = mish  # override yaml value
+        self.config_hash = hashlib.sha1(json.dumps(self.yaml, sort_keys=True, default=str).encode()).hexdigest()
+        self.model, self.save = parse_model(deepcopy(self.yaml), ch=[channels], verbose=verbose)  # model, savelist
+        if checkpoint_layers is None:
+            checkpoint_layers = self.yaml.get('checkpoint_layers', False)  # recomputed during backward
+        self.set_checkpoint(checkpoint_layers)
         # print([x.shape for x in self.forward(torch.zeros(1, ch, 64, 64))])
 
         # Build strides, anchors
@@ -114,12 +158,15 @@ class YOLO(nn.Module):
 
         # Init weights, biases
         initialize_weights(self)
-        self.info()
-        print('')
+        if verbose:
+            self.info()
+            print('')
 
     @amp.autocast()
     def forward(self, x, augment=False, profile=False):
         if augment:
+            from ...data.image import scale_image  # the data pipeline is not loaded for plain inference
+
             image_size = x.shape[-2:]  # height, width
             s = [1, 0.83, 0.67]  # scales
             f = [None, 3, None]  # flips (2-ud, 3-lr)
@@ -156,13 +203,31 @@ class YOLO(nn.Module):
                 dt.append((time_synchronized() - t) * 100)
                 print('%10.1f%10.0f%10.1fms %-40s' % (o, m.np, dt[-1], m.type))
 
-            x = m(x)  # run
+            if m.i in self.checkpoint_layers and self.training and torch.is_grad_enabled():
+                x = checkpoint_layer(m, x)  # run, recompute during backward
+            else:
+                x = m(x)  # run
             y.append(x if m.i in self.save else None)  # save output
 
         if profile:
             print('%.1fms total' % sum(dt))
         return x
 
+    def set_checkpoint(self, layers=True):
+        """ Recompute the activations of some layers during backward instead of keeping them, trades compute for memory.
+
+        BatchNorm layers run their forward twice, the running statistics are only updated by the first pass.
+
+        Args:
+            layers (bool or list): ``True`` for every backbone layer, ``False`` for none or a list of layer indices.
+                The ``checkpoint_layers`` key of the model YAML takes the same values. (default: ``True``)
+
+        """
+        if layers is True:
+            layers = range(len(self.yaml['backbone']))
+        self.checkpoint_layers = set(layers or [])
+        return self
+
     def _initialize_biases(self, cf=None):  # initialize biases into Detect(), cf is class frequency
         # cf = torch.bincount(torch.tensor(np.concatenate(dataset.labels, 0)[:, 0]).long(), minlength=nc) + 1.
         m = self.model[-1]  # Detect() module
@@ -183,23 +248,89 @@ class YOLO(nn.Module):
     #         if type(m) is Bottleneck:
     #             print('%10.3g' % (m.w.detach().sigmoid() * 2))  # shortcut weights
 
-    def fuse(self):  # fuse model Conv2d() + BatchNorm2d() layers
-        print('Fusing layers... ', end='')
+    def fuse(self, verbose=True):  # fuse model Conv2d() + BatchNorm2d() layers
+        if verbose:
+            print('Fusing layers... ', end='')
+        for i, m in enumerate(self.model):
+            if type(m) is nn.BatchNorm2d and m.f == -1 and type(self.model[i - 1]) is nn.Conv2d \
+                    and self.model[i - 1].i not in self.save:  # BN layer in YAML, conv output not read by later layers
+                conv, fused, identity = self.model[i - 1], fuse_conv_and_bn(self.model[i - 1], m), nn.Identity()
+                for a in ('i', 'f', 'type', 'np', 'n', 'args'):  # keep layer attributes
+                    setattr(fused, a, getattr(conv, a))
+                    setattr(identity, a, getattr(m, a))
+                identity.np = 0
+                self.model[i - 1], self.model[i] = fused, identity
         for m in self.model.modules():
-            if type(m) is Conv:
+            if type(m) in (Conv, ConvBNMish, MobileNetConv):
                 m.conv = fuse_conv_and_bn(m.conv, m.bn)  # update conv
                 m.bn = None  # remove batchnorm
                 m.forward = m.fuseforward  # update forward
-        self.info()
+            elif type(m) in (BottleneckCSP, C3, YOLOv4_BottleneckCSP):  # bn applied to cat(cv3, cv2)
+                m.cv3, m.cv2 = fuse_concat_and_bn([m.cv3, m.cv2], m.bn)
+                m.bn = None
+                m.forward = m.fuseforward
+            elif type(m) is MixConv2d:  # bn applied to cat of the convolutions
+                m.m = nn.ModuleList(fuse_concat_and_bn(m.m, m.bn))
+                m.bn = None
+                m.forward = m.fuseforward
+        if verbose:
+            self.info()
         return self
 
-    def info(self):  # print model information
-        model_info(self)
+    def info(self, verbose=False):  # print model information
+        model_info(self, verbose)
+
+    def flops(self):
+        """ GFLOPS at 640x640, profiled with thop once per config and number of parameters, ``None`` without thop. """
+        return model_flops(self, key=(self.config_hash, sum(x.numel() for x in self.parameters())))
+
+    def layer_table(self):
+        """ Table of the layers as printed by ``parse_model()``, with their current number of parameters. """
+        rows = [layer_row('', 'from', 'n', 'params', 'module', 'arguments')]
+        for m in self.model:
+            rows.append(layer_row(m.i, m.f, m.n, '%.0f' % sum(x.numel() for x in m.parameters()), m.type, m.args))
+        return '\n'.join(rows)
+
+
+def checkpoint_layer(m, x):
+    # m(x) with its activations recomputed during backward, the recompute leaves the BatchNorm statistics as they are
+    recompute = False
+
+    def forward(x):
+        nonlocal recompute
+        if recompute:
+            with frozen_batchnorm_stats(m):
+                return m(x)
+        recompute = True
+        return m(x)
+
+    return checkpoint(forward, x, use_reentrant=False)
+
+
+@contextmanager
+def frozen_batchnorm_stats(module):
+    # Restore the running statistics of every BatchNorm in module on exit
+    bns = [b for b in module.modules() if isinstance(b, nn.modules.batchnorm._BatchNorm) and b.track_running_stats]
+    stats = [(b.running_mean.clone(), b.running_var.clone(), b.num_batches_tracked.clone()) for b in bns]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for b, (mean, var, n) in zip(bns, stats):
+                b.running_mean.copy_(mean)
+                b.running_var.copy_(var)
+                b.num_batches_tracked.copy_(n)
+
+
+def layer_row(i, f, n, np, t, args):  # one line of the layer table
+    return '%3s%18s%3s%10s  %-40s%-30s' % (i, f, n, np, t, args)
 
 
-def parse_model(d, ch):  # model_dict, input_channels(3)
-    print('\n%3s%18s%3s%10s  %-40s%-30s' % ('', 'from', 'n', 'params', 'module', 'arguments'))
+def parse_model(d, ch, verbose=True):  # model_dict, input_channels(3), print the layer table
+    if verbose:
+        print('\n' + layer_row('', 'from', 'n', 'params', 'module', 'arguments'))
     anchors, number_classes, gd, gw = d['anchors'], d['number_classes'], d['depth_multiple'], d['width_multiple']
+    mish = d.get('mish', 'plain')  # Mish implementation of the YOLOv4 modules
     na = (len(anchors[0]) // 2) if isinstance(anchors, list) else anchors  # number of anchors
     no = na * (number_classes + 5)  # number of outputs = anchors * (classes + 5)
 
@@ -237,11 +368,14 @@ def parse_model(d, ch):  # model_dict, input_channels(3)
         else:
             c2 = ch[f]
 
-        m_ = nn.Sequential(*[m(*args) for _ in range(n)]) if n > 1 else m(*args)  # module
+        kwargs = {'mish': mish} if m in [ConvBNMish, YOLOv4_Bottleneck, YOLOv4_BottleneckCSP] else {}
+        m_ = nn.Sequential(*[m(*args, **kwargs) for _ in range(n)]) if n > 1 else m(*args, **kwargs)  # module
         t = str(m)[8:-2].replace('__main__.', '')  # module type
         np = sum([x.numel() for x in m_.parameters()])  # number params
         m_.i, m_.f, m_.type, m_.np = i, f, t, np  # attach index, 'from' index, type, number params
-        print('%3s%18s%3s%10.0f  %-40s%-30s' % (i, f, n, np, t, args))  # print
+        m_.n, m_.args = n, args  # for YOLO.layer_table()
+        if verbose:
+            print(layer_row(i, f, n, '%.0f' % np, t, args))
         save.extend(x % i for x in ([f] if isinstance(f, int) else f) if x != -1)  # append to savelist
         layers.append(m_)
         ch.append(c2)
@@ -14,7 +14,7 @@
 import torch
 import torch.nn as nn
 
-from .activations import Mish
+from .activations import mish as make_mish
 from .conv import Conv
 from .conv import ConvBNMish
 
@@ -50,14 +50,20 @@ class BottleneckCSP(nn.Module):
         y2 = self.cv2(x)
         return self.cv4(self.act(self.bn(torch.cat((y1, y2), dim=1))))
 
+    def fuseforward(self, x):
+        y1 = self.cv3(self.m(self.cv1(x)))
+        y2 = self.cv2(x)
+        return self.cv4(self.act(torch.cat((y1, y2), dim=1)))
+
 
 class YOLOv4_Bottleneck(nn.Module):
     # Standard bottleneck
-    def __init__(self, c1, c2, shortcut=True, groups=1, expansion=0.5):  # ch_in, ch_out, shortcut, groups, expansion
+    def __init__(self, c1, c2, shortcut=True, groups=1, expansion=0.5, mish="plain"):
+        # ch_in, ch_out, shortcut, groups, expansion, Mish implementation
         super(YOLOv4_Bottleneck, self).__init__()
         c_ = int(c2 * expansion)  # hidden channels
-        self.cv1 = ConvBNMish(c1, c_, 1, 1)
-        self.cv2 = ConvBNMish(c_, c2, 3, 1, groups=groups)
+        self.cv1 = ConvBNMish(c1, c_, 1, 1, mish=mish)
+        self.cv2 = ConvBNMish(c_, c2, 3, 1, groups=groups, mish=mish)
         self.add = shortcut and c1 == c2
 
     def forward(self, x):
@@ -66,18 +72,24 @@ class YOLOv4_Bottleneck(nn.Module):
 
 class YOLOv4_BottleneckCSP(nn.Module):
     # CSP Bottleneck https://github.com/WongKinYiu/CrossStagePartialNetworks
-    def __init__(self, c1, c2, n=1, shortcut=True, groups=1, expansion=0.5):
+    def __init__(self, c1, c2, n=1, shortcut=True, groups=1, expansion=0.5, mish="plain"):
         super(YOLOv4_BottleneckCSP, self).__init__()
         c_ = int(c2 * expansion)  # hidden channels
-        self.cv1 = ConvBNMish(c1, c_, 1, 1)
+        self.cv1 = ConvBNMish(c1, c_, 1, 1, mish=mish)
         self.cv2 = nn.Conv2d(c1, c_, 1, 1, bias=False)
         self.cv3 = nn.Conv2d(c_, c_, 1, 1, bias=False)
-        self.cv4 = ConvBNMish(2 * c_, c2, 1, 1)
+        self.cv4 = ConvBNMish(2 * c_, c2, 1, 1, mish=mish)
         self.bn = nn.BatchNorm2d(2 * c_)  # applied to cat(cv2, cv3)
-        self.act = Mish()
-        self.m = nn.Sequential(*[YOLOv4_Bottleneck(c_, c_, shortcut, groups, expansion=1.0) for _ in range(n)])
+        self.act = make_mish(mish)
+        self.m = nn.Sequential(*[YOLOv4_Bottleneck(c_, c_, shortcut, groups, expansion=1.0, mish=mish)
+                                 for _ in range(n)])
 
     def forward(self, x):
         y1 = self.cv3(self.m(self.cv1(x)))
         y2 = self.cv2(x)
         return self.cv4(self.act(self.bn(torch.cat((y1, y2), dim=1))))
+
+    def fuseforward(self, x):
+        y1 = self.cv3(self.m(self.cv1(x)))
+        y2 = self.cv2(x)
+        return self.cv4(self.act(torch.cat((y1, y2), dim=1)))
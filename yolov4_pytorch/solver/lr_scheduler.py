@@ -17,7 +17,6 @@ from copy import deepcopy
 from typing import List
 
 import torch
-from torchvision.models.resnet import ResNet
 
 from ..utils import is_parallel
 
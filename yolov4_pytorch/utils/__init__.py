@@ -11,38 +11,49 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-from .common import clip_coords
-from .common import coco80_to_coco91_class
-from .common import make_divisible
-from .common import output_to_target
-from .common import scale_coords
-from .common import xywh2xyxy
-from .common import xyxy2xywh
-from .device import init_seeds
-from .device import is_parallel
-from .device import select_device
-from .device import time_synchronized
-from .iou import bbox_iou
-from .iou import box_iou
-from .iou import wh_iou
-from .loss import BCEBlurWithLogitsLoss
-from .loss import FocalLoss
-from .loss import ap_per_class
-from .loss import build_targets
-from .loss import compute_ap
-from .loss import compute_loss
-from .loss import fitness
-from .loss import smooth_BCE
-from .nms import non_max_suppression
-from .plot import plot_images
-from .plot import plot_labels
-from .plot import plot_one_box
-from .plot import plot_results
-from .prune import prune
-from .prune import sparsity
-from .weights import Ensemble
-from .weights import create_pretrained
-from .weights import initialize_weights
+"""
+    Attributes are imported from their submodule on first use, so that e.g. the inference core does not
+    load plotting, loss and pruning until they are needed.
+"""
+from .lazy import lazy_attributes
+
+_submodules = {
+    "clip_coords": "common",
+    "coco80_to_coco91_class": "common",
+    "make_divisible": "common",
+    "output_to_target": "common",
+    "scale_coords": "common",
+    "xywh2xyxy": "common",
+    "xyxy2xywh": "common",
+    "init_seeds": "device",
+    "is_parallel": "device",
+    "select_device": "device",
+    "time_synchronized": "device",
+    "bbox_iou": "iou",
+    "box_iou": "iou",
+    "wh_iou": "iou",
+    "import_time": "lazy",
+    "BCEBlurWithLogitsLoss": "loss",
+    "FocalLoss": "loss",
+    "YOLOLoss": "loss",
+    "ap_per_class": "loss",
+    "compute_ap": "loss",
+    "fitness": "loss",
+    "smooth_BCE": "loss",
+    "non_max_suppression": "nms",
+    "plot_images": "plot",
+    "plot_labels": "plot",
+    "plot_one_box": "plot",
+    "plot_results": "plot",
+    "StageTimer": "profiler",
+    "prune": "prune",
+    "sparsity": "prune",
+    "Ensemble": "weights",
+    "create_pretrained": "weights",
+    "initialize_weights": "weights",
+}
+
+__getattr__, __dir__ = lazy_attributes(__name__, _submodules)
 
 __all__ = [
     "clip_coords",
@@ -59,12 +70,12 @@ __all__ = [
     "bbox_iou",
     "box_iou",
     "wh_iou",
+    "import_time",
     "BCEBlurWithLogitsLoss",
     "FocalLoss",
+    "YOLOLoss",
     "ap_per_class",
-    "build_targets",
     "compute_ap",
-    "compute_loss",
     "fitness",
     "smooth_BCE",
     "non_max_suppression",
@@ -72,6 +83,7 @@ __all__ = [
     "plot_labels",
     "plot_one_box",
     "plot_results",
+    "StageTimer",
     "prune",
     "sparsity",
     "Ensemble",
@@ -15,53 +15,164 @@ import math
 
 import torch
 
+from .lazy import lazy_script
 
-def bbox_iou(box1, box2, x1y1x2y2=True, GIoU=False, DIoU=False, CIoU=False):
-    # Returns the IoU of box1 to box2. box1 is 4, box2 is nx4
-    box2 = box2.t()
 
-    # Get the coordinates of bounding boxes
-    if x1y1x2y2:  # x1, y1, x2, y2 = box1
-        b1_x1, b1_y1, b1_x2, b1_y2 = box1[0], box1[1], box1[2], box1[3]
-        b2_x1, b2_y1, b2_x2, b2_y2 = box2[0], box2[1], box2[2], box2[3]
-    else:  # transform from xywh to xyxy
-        b1_x1, b1_x2 = box1[0] - box1[2] / 2, box1[0] + box1[2] / 2
-        b1_y1, b1_y2 = box1[1] - box1[3] / 2, box1[1] + box1[3] / 2
-        b2_x1, b2_x2 = box2[0] - box2[2] / 2, box2[0] + box2[2] / 2
-        b2_y1, b2_y2 = box2[1] - box2[3] / 2, box2[1] + box2[3] / 2
+def bbox_iou(box1, box2, x1y1x2y2: bool = True, GIoU: bool = False, DIoU: bool = False, CIoU: bool = False,
+             save_memory: bool = False):
+    # Returns the IoU of box1 to box2. box1 is 4 or 4xn, box2 is nx4
+    # save_memory=True saves only the boxes for backward and recomputes the rest, slower on CPU from 10k boxes
+    if torch.jit.is_scripting():  # compiled with the scripted caller
+        return bbox_iou_pairwise(box1.t(), box2, x1y1x2y2, GIoU, DIoU, CIoU)
+    return bbox_iou_eager(box1.t(), box2, x1y1x2y2, GIoU, DIoU, CIoU, save_memory)
+
+
+@torch.jit.unused
+def bbox_iou_eager(box1, box2, x1y1x2y2: bool, GIoU: bool, DIoU: bool, CIoU: bool,
+                   save_memory: bool) -> torch.Tensor:
+    # bbox_iou() outside TorchScript, the scripted functions are compiled on first use instead of at import
+    if save_memory:  # autograd Functions can not be scripted
+        return BoxIoU.apply(box1, box2, x1y1x2y2, GIoU, DIoU, CIoU)
+    return lazy_script(bbox_iou_pairwise)(box1, box2, x1y1x2y2, GIoU, DIoU, CIoU)
+
+
+class BoxIoU(torch.autograd.Function):
+    """ ``bbox_iou_pairwise()`` with a hand-written backward.
 
-    # Intersection area
-    inter = (torch.min(b1_x2, b2_x2) - torch.max(b1_x1, b2_x1)).clamp(0) * \
-            (torch.min(b1_y2, b2_y2) - torch.max(b1_y1, b2_y1)).clamp(0)
+    Only the two box tensors are saved for backward, the backward recomputes the few
+    intermediates it needs, instead of autograd keeping every intermediate of the forward.
+    """
+
+    @staticmethod
+    def forward(ctx, box1, box2, x1y1x2y2=True, GIoU=False, DIoU=False, CIoU=False):
+        ctx.save_for_backward(box1, box2)
+        ctx.flags = (x1y1x2y2, GIoU, DIoU, CIoU)
+        return lazy_script(bbox_iou_pairwise)(box1, box2, x1y1x2y2, GIoU, DIoU, CIoU)
+
+    @staticmethod
+    def backward(ctx, grad):
+        box1, box2 = ctx.saved_tensors
+        grad1, grad2 = lazy_script(bbox_iou_backward)(grad, box1, box2, *ctx.flags)
+        grad1 = grad1.sum_to_size(box1.shape).to(box1.dtype) if ctx.needs_input_grad[0] else None
+        grad2 = grad2.sum_to_size(box2.shape).to(box2.dtype) if ctx.needs_input_grad[1] else None
+        return grad1, grad2, None, None, None, None
 
-    # Union Area
-    w1, h1 = b1_x2 - b1_x1, b1_y2 - b1_y1
-    w2, h2 = b2_x2 - b2_x1, b2_y2 - b2_y1
-    union = (w1 * h1 + 1e-16) + w2 * h2 - inter
 
-    iou = inter / union  # iou
+def bbox_iou_pairwise(box1, box2, x1y1x2y2: bool = True, GIoU: bool = False, DIoU: bool = False,
+                      CIoU: bool = False, eps: float = 1e-16):
+    # IoU, GIoU, DIoU or CIoU of box1 to box2, both nx4 (or broadcastable), pair by pair
+    # x and y are computed together on nx2 halves of the boxes, TorchScript fuses the element-wise ops where it can
+    if x1y1x2y2:
+        p1, p2 = box1[..., :2], box1[..., 2:]  # top left, bottom right
+        q1, q2 = box2[..., :2], box2[..., 2:]
+        wh1, wh2 = p2 - p1, q2 - q1
+    else:  # transform from xywh to xyxy
+        wh1, wh2 = box1[..., 2:], box2[..., 2:]
+        p1 = box1[..., :2] - wh1 / 2
+        p2 = p1 + wh1
+        q1 = box2[..., :2] - wh2 / 2
+        q2 = q1 + wh2
+
+    # Intersection and union area
+    inter = (torch.min(p2, q2) - torch.max(p1, q1)).clamp(0)
+    inter = inter[..., 0] * inter[..., 1]
+    union = (wh1[..., 0] * wh1[..., 1] + eps) + wh2[..., 0] * wh2[..., 1] - inter
+    iou = inter / union
     if GIoU or DIoU or CIoU:
-        cw = torch.max(b1_x2, b2_x2) - torch.min(b1_x1, b2_x1)  # convex (smallest enclosing box) width
-        ch = torch.max(b1_y2, b2_y2) - torch.min(b1_y1, b2_y1)  # convex height
+        c = torch.max(p2, q2) - torch.min(p1, q1)  # convex (smallest enclosing box) width, height
         if GIoU:  # Generalized IoU https://arxiv.org/pdf/1902.09630.pdf
-            c_area = cw * ch + 1e-16  # convex area
+            c_area = c[..., 0] * c[..., 1] + eps  # convex area
             return iou - (c_area - union) / c_area  # GIoU
-        if DIoU or CIoU:  # Distance or Complete IoU https://arxiv.org/abs/1911.08287v1
-            # convex diagonal squared
-            c2 = cw ** 2 + ch ** 2 + 1e-16
-            # centerpoint distance squared
-            rho2 = ((b2_x1 + b2_x2) - (b1_x1 + b1_x2)) ** 2 / 4 + ((b2_y1 + b2_y2) - (b1_y1 + b1_y2)) ** 2 / 4
-            if DIoU:
-                return iou - rho2 / c2  # DIoU
-            elif CIoU:  # https://github.com/Zzh-tju/DIoU-SSD-pytorch/blob/master/utils/box/box_utils.py#L47
-                v = (4 / math.pi ** 2) * torch.pow(torch.atan(w2 / h2) - torch.atan(w1 / h1), 2)
-                with torch.no_grad():
-                    alpha = v / (1 - iou + v)
-                return iou - (rho2 / c2 + v * alpha)  # CIoU
+        # Distance or Complete IoU https://arxiv.org/abs/1911.08287v1
+        c2 = c.pow(2).sum(-1) + eps  # convex diagonal squared
+        rho2 = ((q1 + q2) - (p1 + p2)).pow(2).sum(-1) / 4  # centerpoint distance squared
+        if DIoU:
+            return iou - rho2 / c2  # DIoU
+        # CIoU https://github.com/Zzh-tju/DIoU-SSD-pytorch/blob/master/utils/box/box_utils.py#L47
+        v = (4 / math.pi ** 2) * (torch.atan(wh2[..., 0] / wh2[..., 1]) - torch.atan(wh1[..., 0] / wh1[..., 1])).pow(2)
+        alpha = (v / (1 - iou + v)).detach()
+        return iou - (rho2 / c2 + v * alpha)  # CIoU
 
     return iou
 
 
+def bbox_iou_backward(grad, box1, box2, x1y1x2y2: bool = True, GIoU: bool = False, DIoU: bool = False,
+                      CIoU: bool = False, eps: float = 1e-16):
+    # Gradients of bbox_iou_pairwise() to box1 and box2 from the gradient of its output, chain rule by hand
+    if x1y1x2y2:
+        p1, p2 = box1[..., :2], box1[..., 2:]
+        q1, q2 = box2[..., :2], box2[..., 2:]
+        wh1, wh2 = p2 - p1, q2 - q1
+    else:
+        wh1, wh2 = box1[..., 2:], box2[..., 2:]
+        p1 = box1[..., :2] - wh1 / 2
+        p2 = p1 + wh1
+        q1 = box2[..., :2] - wh2 / 2
+        q2 = q1 + wh2
+    grad = grad.unsqueeze(-1)  # broadcast over x, y
+
+    # IoU
+    inter_wh = torch.min(p2, q2) - torch.max(p1, q1)
+    i = inter_wh.clamp(0)
+    inter = i[..., :1] * i[..., 1:]
+    union = (wh1[..., :1] * wh1[..., 1:] + eps) + wh2[..., :1] * wh2[..., 1:] - inter
+    grad_union = -grad * inter / union ** 2
+    grad_inter = grad / union
+
+    zero = torch.zeros_like(p1)
+    grad_c, grad_d = zero, zero  # enclosing box width, height and center distance
+    grad_wh1, grad_wh2 = zero, zero  # CIoU aspect ratio term
+    if GIoU or DIoU or CIoU:
+        c = torch.max(p2, q2) - torch.min(p1, q1)
+        if GIoU:  # iou - 1 + union / c_area
+            c_area = c[..., :1] * c[..., 1:] + eps
+            grad_union = grad_union + grad / c_area
+            grad_c = (-grad * union / c_area ** 2) * c.flip(-1)
+        else:  # iou - rho2 / c2 (- v * alpha)
+            c2 = c.pow(2).sum(-1, keepdim=True) + eps
+            d = (q1 + q2) - (p1 + p2)
+            rho2 = d.pow(2).sum(-1, keepdim=True) / 4
+            grad_c = (grad * rho2 / c2 ** 2) * 2 * c
+            grad_d = (-grad / c2) * d / 2
+            if CIoU and not DIoU:
+                iou = inter / union
+                angle = torch.atan(wh2[..., :1] / wh2[..., 1:]) - torch.atan(wh1[..., :1] / wh1[..., 1:])
+                v = (4 / math.pi ** 2) * angle.pow(2)
+                alpha = v / (1 - iou + v)  # constant
+                grad_angle = -grad * alpha * (8 / math.pi ** 2) * angle
+                # d atan(w / h) / d(w, h) = (h, -w) / (w^2 + h^2)
+                grad_wh2 = grad_angle * torch.cat((wh2[..., 1:], -wh2[..., :1]), -1) / wh2.pow(2).sum(-1, keepdim=True)
+                grad_wh1 = -grad_angle * torch.cat((wh1[..., 1:], -wh1[..., :1]), -1) / wh1.pow(2).sum(-1, keepdim=True)
+
+    # Intersection, min(p2, q2) - max(p1, q1) clamped at 0, also subtracted from the union
+    grad_i = ((grad_inter - grad_union) * i.flip(-1)) * (inter_wh >= 0)
+    right, bottom = p2 <= q2, p1 >= q1  # which box bounds the intersection
+    grad_p2, grad_q2 = grad_i * right, grad_i * ~right
+    grad_p1, grad_q1 = -grad_i * bottom, -grad_i * ~bottom
+
+    # Enclosing box, max(p2, q2) - min(p1, q1)
+    right, bottom = p2 >= q2, p1 <= q1
+    grad_p2, grad_q2 = grad_p2 + grad_c * right, grad_q2 + grad_c * ~right
+    grad_p1, grad_q1 = grad_p1 - grad_c * bottom, grad_q1 - grad_c * ~bottom
+
+    # Center distance, (q1 + q2) - (p1 + p2)
+    grad_p1, grad_p2 = grad_p1 - grad_d, grad_p2 - grad_d
+    grad_q1, grad_q2 = grad_q1 + grad_d, grad_q2 + grad_d
+
+    # Areas
+    grad_wh1 = grad_wh1 + grad_union * wh1.flip(-1)
+    grad_wh2 = grad_wh2 + grad_union * wh2.flip(-1)
+
+    # Back to the input format
+    if x1y1x2y2:  # wh = p2 - p1
+        grad1 = torch.cat((grad_p1 - grad_wh1, grad_p2 + grad_wh1), -1)
+        grad2 = torch.cat((grad_q1 - grad_wh2, grad_q2 + grad_wh2), -1)
+    else:  # p1 = xy - wh / 2, p2 = xy + wh / 2
+        grad1 = torch.cat((grad_p1 + grad_p2, grad_wh1 + (grad_p2 - grad_p1) / 2), -1)
+        grad2 = torch.cat((grad_q1 + grad_q2, grad_wh2 + (grad_q2 - grad_q1) / 2), -1)
+    return grad1, grad2
+
+
 def box_iou(box1, box2):
     # https://github.com/pytorch/vision/blob/master/torchvision/ops/boxes.py
     """
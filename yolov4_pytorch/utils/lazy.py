@@ -0,0 +1,86 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+    Lazy attributes of packages, so importing a package only loads the submodules that are used.
+"""
+import functools
+import importlib
+import os
+import subprocess
+import sys
+
+
+def lazy_attributes(package, submodules):
+    """ Module ``__getattr__`` and ``__dir__`` importing an attribute's submodule on first access (PEP 562).
+
+    Args:
+        package (str): ``__name__`` of the package.
+        submodules (dict): Attribute name to the name of the submodule that defines it, relative to ``package``.
+
+    Example:
+        >>> __getattr__, __dir__ = lazy_attributes(__name__, {"YOLO": "module"})
+
+    """
+    namespace = importlib.import_module(package).__dict__
+
+    def __getattr__(name):
+        if name not in submodules:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        module = importlib.import_module(f".{submodules[name]}", package)
+        for attribute, submodule in submodules.items():  # later lookups do not call __getattr__
+            if submodule == submodules[name]:
+                namespace[attribute] = getattr(module, attribute)  # also replaces a submodule of the same name
+        return namespace[name]
+
+    def __dir__():
+        return sorted(set(namespace) | set(submodules))
+
+    return __getattr__, __dir__
+
+
+def import_time(statement):
+    """ Time ``python -X importtime`` spends on this package while running ``statement`` in a fresh process.
+
+    Args:
+        statement (str): Python statement, e.g. ``import torch; from yolov4_pytorch.utils import box_iou``.
+
+    Returns:
+        The cumulative import time of the top level ``yolov4_pytorch`` imports in microseconds, and the names
+        of all modules the process imported.
+
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=root,
+                            env=dict(os.environ, PYTHONPATH=root), capture_output=True, text=True, check=True).stderr
+    total, modules = 0, []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append(name.strip())
+        if name.startswith(" yolov4_pytorch"):  # top level, nested imports are part of its cumulative time
+            total += int(cumulative)
+    return total, modules
+
+
+@functools.lru_cache(maxsize=None)
+def lazy_script(fn):
+    """ ``torch.jit.script(fn)``, compiled on the first call of every function instead of at import.
+
+    Example:
+        >>> y = lazy_script(mish_forward)(x)
+
+    """
+    import torch
+    return torch.jit.script(fn)
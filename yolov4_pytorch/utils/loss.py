@@ -11,9 +11,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+from typing import List
+from typing import Tuple
+
 import numpy as np
 import torch
 import torch.nn as nn
+from torch import Tensor
 
 from .iou import bbox_iou
 
@@ -118,57 +122,45 @@ def ap_per_class(tp, conf, pred_cls, target_cls):
     return p, r, ap, f1, unique_classes.astype('int32')
 
 
-def build_targets(p, targets, model):
-    # Build targets for compute_loss(), input targets(image,class,x,y,w,h)
-    det = model.module.model[-1] if type(model) in (nn.parallel.DataParallel, nn.parallel.DistributedDataParallel) \
-        else model.model[-1]  # Detect() module
-    na, nt = det.na, targets.shape[0]  # number of anchors, targets
-    tcls, tbox, indices, anch = [], [], [], []
-    gain = torch.ones(6, device=targets.device)  # normalized to gridspace gain
-    off = torch.tensor([[1, 0], [0, 1], [-1, 0], [0, -1]], device=targets.device).float()  # overlap offsets
-    at = torch.arange(na).view(na, 1).repeat(1, nt)  # anchor tensor, same as .repeat_interleave(nt)
-
+def match_targets(targets, gain, anchors, offsets, anchor_t: float):
+    # Targets of all layers, anchors and neighbour cell offsets matched in one pass
+    # targets(nt, 6) image,class,x,y,w,h, gain(nl, 6), anchors(nl, na, 2) in grid units, offsets(5, 2)
     g = 0.5  # offset
-    style = 'rect4'
-    for i in range(det.nl):
-        anchors = det.anchors[i]
-        gain[2:] = torch.tensor(p[i].shape)[[3, 2, 3, 2]]  # xyxy gain
-
-        # Match targets to anchors
-        a, t, offsets = [], targets * gain, 0
-        if nt:
-            r = t[None, :, 4:6] / anchors[:, None]  # wh ratio
-            j = torch.max(r, 1. / r).max(2)[0] < model.hyper_parameters['anchor_t']  # compare
-            # j = wh_iou(anchors, t[:, 4:6]) > model.hyp['iou_t']  # iou(3,n) = wh_iou(anchors(3,2), gwh(n,2))
-            a, t = at[j], t.repeat(na, 1, 1)[j]  # filter
-
-            # overlaps
-            gxy = t[:, 2:4]  # grid xy
-            z = torch.zeros_like(gxy)
-            if style == 'rect2':
-                j, k = ((gxy % 1. < g) & (gxy > 1.)).T
-                a, t = torch.cat((a, a[j], a[k]), 0), torch.cat((t, t[j], t[k]), 0)
-                offsets = torch.cat((z, z[j] + off[0], z[k] + off[1]), 0) * g
-            elif style == 'rect4':
-                j, k = ((gxy % 1. < g) & (gxy > 1.)).T
-                l, m = ((gxy % 1. > (1 - g)) & (gxy < (gain[[2, 3]] - 1.))).T
-                a, t = torch.cat((a, a[j], a[k], a[l], a[m]), 0), torch.cat((t, t[j], t[k], t[l], t[m]), 0)
-                offsets = torch.cat((z, z[j] + off[0], z[k] + off[1], z[l] + off[2], z[m] + off[3]), 0) * g
-
-        # Define
-        b, c = t[:, :2].long().T  # image, class
-        gxy = t[:, 2:4]  # grid xy
-        gwh = t[:, 4:6]  # grid wh
-        gij = (gxy - offsets).long()
-        gi, gj = gij.T  # grid xy indices
-
-        # Append
-        indices.append((b, a, gj, gi))  # image, anchor, grid indices
-        tbox.append(torch.cat((gxy - gij, gwh), 1))  # box
-        anch.append(anchors[a])  # anchors
-        tcls.append(c)  # class
-
-    return tcls, tbox, indices, anch
+
+    # Match targets to anchors, t(nl, nt, 6) in grid units of every layer
+    t = targets[None] * gain[:, None]
+    r = t[:, None, :, 4:6] / anchors[:, :, None]  # wh ratio, shape(nl, na, nt, 2)
+    match = torch.max(r, 1. / r).max(3)[0] < anchor_t  # compare, shape(nl, na, nt)
+    # match = wh_iou(anchors, t[:, 4:6]) > model.hyp['iou_t']  # iou(3,n) = wh_iou(anchors(3,2), gwh(n,2))
+
+    # Overlaps, the target cell and the 2 closest of its 4 neighbours, 'rect4' style
+    gxy = t[..., 2:4]  # grid xy
+    near = gxy % 1.
+    jk = (near < g) & (gxy > 1.)
+    lm = (near > (1 - g)) & (gxy < gain[:, None, 2:4] - 1.)
+    cells = torch.stack((torch.ones_like(jk[..., 0]), jk[..., 0], jk[..., 1], lm[..., 0], lm[..., 1]), 1)
+
+    # Flat indices in the order of the per layer concatenation: layer, offset, anchor, target
+    i = (cells[:, :, None] & match[:, None]).nonzero()
+    layer, o, a = i[:, 0], i[:, 1], i[:, 2]
+    t = t[layer, i[:, 3]]
+    counts: List[int] = torch.bincount(layer, minlength=anchors.shape[0]).tolist()  # the only device to host copy
+
+    # Define
+    b, c = t[:, 0].long(), t[:, 1].long()  # image, class
+    gxy = t[:, 2:4]  # grid xy
+    gwh = t[:, 4:6]  # grid wh
+    gij = (gxy - offsets[o]).long()
+    gi, gj = gij[:, 0], gij[:, 1]  # grid xy indices
+    tbox = torch.cat((gxy - gij, gwh), 1)  # box
+    anch = anchors[layer, a]
+
+    # Split by layer
+    b, a, gj, gi = b.split(counts), a.split(counts), gj.split(counts), gi.split(counts)
+    indices: List[Tuple[Tensor, Tensor, Tensor, Tensor]] = []
+    for j in range(len(counts)):
+        indices.append((b[j], a[j], gj[j], gi[j]))  # image, anchor, grid indices
+    return list(c.split(counts)), list(tbox.split(counts)), indices, list(anch.split(counts))
 
 
 def compute_ap(recall, precision):
@@ -200,75 +192,101 @@ def compute_ap(recall, precision):
     return ap
 
 
-def compute_loss(p, targets, model):  # predictions, targets, model
-    device = targets.device
-    ft = torch.cuda.FloatTensor if p[0].is_cuda else torch.Tensor
-    lcls, lbox, lobj = ft([0]).to(device), ft([0]).to(device), ft([0]).to(device)
-    tcls, tbox, indices, anchors = build_targets(p, targets, model)  # targets
-    h = model.hyper_parameters  # hyperparameters
-    red = 'mean'  # Loss reduction (sum or mean)
-
-    # Define criteria
-    BCEcls = nn.BCEWithLogitsLoss(pos_weight=ft([h['cls_pw']]), reduction=red).to(device)
-    BCEobj = nn.BCEWithLogitsLoss(pos_weight=ft([h['obj_pw']]), reduction=red).to(device)
-
-    # class label smoothing https://arxiv.org/pdf/1902.04103.pdf eqn 3
-    cp, cn = smooth_BCE(eps=0.0)
-
-    # focal loss
-    g = h['fl_gamma']  # focal loss gamma
-    if g > 0:
-        BCEcls, BCEobj = FocalLoss(BCEcls, g), FocalLoss(BCEobj, g)
-
-    # per output
-    nt = 0  # number of targets
-    np = len(p)  # number of outputs
-    balance = [4.0, 1.0, 0.4] if np == 3 else [4.0, 1.0, 0.4, 0.1]  # P3-5 or P3-6
-    for i, pi in enumerate(p):  # layer index, layer predictions
-        b, a, gj, gi = indices[i]  # image, anchor, gridy, gridx
-        tobj = torch.zeros_like(pi[..., 0]).to(device)  # target obj
-
-        nb = b.shape[0]  # number of targets
-        if nb:
-            nt += nb  # cumulative targets
-            ps = pi[b, a, gj, gi]  # prediction subset corresponding to targets
-
-            # GIoU
-            pxy = ps[:, :2].sigmoid() * 2. - 0.5
-            pwh = (ps[:, 2:4].sigmoid() * 2) ** 2 * anchors[i]
-            pbox = torch.cat((pxy, pwh), 1).to(device)  # predicted box
-            giou = bbox_iou(pbox.t(), tbox[i], x1y1x2y2=False, GIoU=True)  # giou(prediction, target)
-            lbox += (1.0 - giou).sum() if red == 'sum' else (1.0 - giou).mean()  # giou loss
-
-            # Obj
-            tobj[b, a, gj, gi] = (1.0 - 1.0) + 1.0 * giou.detach().clamp(0).type(tobj.dtype)  # giou ratio
-
-            # Class
-            if model.number_classes > 1:  # cls loss (only if multiple classes)
-                t = torch.full_like(ps[:, 5:], cn).to(device)  # targets
-                t[range(nb), tcls[i]] = cp
-                lcls += BCEcls(ps[:, 5:], t)  # BCE
-
-            # Append targets to text file
-            # with open('targets.txt', 'a') as file:
-            #     [file.write('%11.5g ' * 4 % tuple(x) + '\n') for x in torch.cat((txy[i], twh[i]), 1)]
-
-        lobj += BCEobj(pi[..., 4], tobj) * balance[i]  # obj loss
-
-    s = 3 / np  # output count scaling
-    lbox *= h['giou'] * s
-    lobj *= h['obj'] * s * (1.4 if np == 4 else 1.)
-    lcls *= h['cls'] * s
-    bs = tobj.shape[0]  # batch size
-    if red == 'sum':
-        g = 3.0  # loss gain
-        lobj *= g / bs
-        if nt:
-            lcls *= g / nt / model.number_classes
-            lbox *= g / nt
-
-    loss = lbox + lobj + lcls
-    return loss * bs, torch.cat((lbox, lobj, lcls, loss)).detach()
+class YOLOLoss(nn.Module):
+    """ GIoU box, objectness and class loss of the ``Detect`` outputs.
+
+    Built once from ``model.hyper_parameters`` and the ``Detect`` module. The criteria, the anchors
+    and the target matching constants are kept as submodules and buffers, so they follow ``.to()``
+    and the module can be compiled with ``torch.jit.script``. Create it after ``check_anchors()``,
+    the anchors are copied.
+
+    Args:
+        model (nn.Module): ``YOLO`` model with ``hyper_parameters`` and ``number_classes`` attached.
+
+    Returns:
+        The loss scaled by the batch size, and the detached ``GIoU, obj, cls, total`` losses, shape(4).
+
+    """
+    shapes: List[int]  # for torch.jit.script
+
+    def __init__(self, model):
+        super(YOLOLoss, self).__init__()
+        det = model.module.model[-1] if type(model) in (nn.parallel.DataParallel,
+                                                        nn.parallel.DistributedDataParallel) else model.model[-1]
+        h = model.hyper_parameters  # hyperparameters
+        self.number_classes = int(model.number_classes)
+        self.anchor_t = float(h['anchor_t'])
+        self.giou_gain, self.obj_gain, self.cls_gain = float(h['giou']), float(h['obj']), float(h['cls'])
+        self.balance = [4.0, 1.0, 0.4] if det.nl == 3 else [4.0, 1.0, 0.4, 0.1]  # P3-5 or P3-6
+
+        # Define criteria
+        BCEcls = nn.BCEWithLogitsLoss(pos_weight=torch.tensor([h['cls_pw']]))
+        BCEobj = nn.BCEWithLogitsLoss(pos_weight=torch.tensor([h['obj_pw']]))
+        g = h['fl_gamma']  # focal loss gamma
+        if g > 0:
+            BCEcls, BCEobj = FocalLoss(BCEcls, g), FocalLoss(BCEobj, g)
+        self.BCEcls, self.BCEobj = BCEcls, BCEobj
+
+        # class label smoothing https://arxiv.org/pdf/1902.04103.pdf eqn 3
+        self.cp, self.cn = smooth_BCE(eps=0.0)
+
+        self.register_buffer('anchors', det.anchors.detach().clone())  # shape(nl, na, 2), grid units
+        self.register_buffer('offsets', torch.tensor([[0, 0], [1, 0], [0, 1], [-1, 0], [0, -1]]).float() * 0.5)
+        self.register_buffer('gain', torch.ones(det.nl, 6))  # xyxy gain of every layer
+        self.shapes = []  # ny, nx of every layer the gain was computed for
+
+    def build_targets(self, p: List[Tensor], targets):
+        # Targets of every output layer in p, input targets(image,class,x,y,w,h)
+        shapes: List[int] = []
+        for pi in p:
+            shapes += [pi.shape[2], pi.shape[3]]
+        if shapes != self.shapes:  # new image size, the only time the gain is copied to the device
+            ny, nx = torch.tensor(shapes[0::2]), torch.tensor(shapes[1::2])
+            self.gain = torch.stack((torch.ones_like(nx), torch.ones_like(nx), nx, ny, nx, ny), 1).to(self.gain)
+            self.shapes = shapes
+        return match_targets(targets, self.gain, self.anchors, self.offsets, self.anchor_t)
+
+    def forward(self, p: List[Tensor], targets):
+        device = targets.device
+        tcls, tbox, indices, anchors = self.build_targets(p, targets)
+
+        # per output
+        lcls, lbox, lobj = torch.zeros(1, device=device), torch.zeros(1, device=device), torch.zeros(1, device=device)
+        n = len(p)  # number of outputs
+        for i, pi in enumerate(p):  # layer index, layer predictions
+            b, a, gj, gi = indices[i]  # image, anchor, gridy, gridx
+            tobj = torch.zeros_like(pi[..., 0])  # target obj, kept by BCE for backward, so not reused
+
+            nb = b.shape[0]  # number of targets
+            if nb:
+                ps = pi[b, a, gj, gi]  # prediction subset corresponding to targets
+
+                # GIoU
+                pxy = ps[:, :2].sigmoid() * 2. - 0.5
+                pwh = (ps[:, 2:4].sigmoid() * 2) ** 2 * anchors[i]
+                pbox = torch.cat((pxy, pwh), 1)  # predicted box
+                giou = bbox_iou(pbox.t(), tbox[i], x1y1x2y2=False, GIoU=True)  # giou(prediction, target)
+                lbox += (1.0 - giou).mean()  # giou loss
+
+                # Obj
+                tobj[b, a, gj, gi] = giou.detach().clamp(0).type(tobj.dtype)  # giou ratio
+
+                # Class
+                if self.number_classes > 1:  # cls loss (only if multiple classes)
+                    t = torch.full_like(ps[:, 5:], self.cn)  # targets
+                    t[torch.arange(nb, device=device), tcls[i]] = self.cp
+                    lcls += self.BCEcls(ps[:, 5:], t)  # BCE
+
+            lobj += self.BCEobj(pi[..., 4], tobj) * self.balance[i]  # obj loss
+
+        s = 3 / n  # output count scaling
+        lbox *= self.giou_gain * s
+        lobj *= self.obj_gain * s * (1.4 if n == 4 else 1.)
+        lcls *= self.cls_gain * s
+        bs = p[0].shape[0]  # batch size
+
+        loss = lbox + lobj + lcls
+        return loss * bs, torch.cat((lbox, lobj, lcls, loss)).detach()
 
 
 def fitness(x):
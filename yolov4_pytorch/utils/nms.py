@@ -14,7 +14,6 @@
 import time
 
 import torch
-import torchvision
 
 from .common import xywh2xyxy
 from .iou import box_iou
@@ -27,6 +26,8 @@ def non_max_suppression(prediction, confidence_thresholds=0.1, iou_thresholds=0.
     Returns:
          detections with shape: nx6 (x1, y1, x2, y2, confidence, classes)
     """
+    from torchvision.ops import nms  # imported on first use, torchvision loads all of its models
+
     if prediction.dtype is torch.float16:
         prediction = prediction.float()  # to FP32
 
@@ -75,7 +76,7 @@ def non_max_suppression(prediction, confidence_thresholds=0.1, iou_thresholds=0.
         # Batched NMS
         c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
         boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
-        i = torchvision.ops.boxes.nms(boxes, scores, iou_thresholds)
+        i = nms(boxes, scores, iou_thresholds)
         if i.shape[0] > max_det:  # limit detections
             i = i[:max_det]
         if merge and (1 < n < 3E3):  # Merge NMS (boxes merged using weighted mean)
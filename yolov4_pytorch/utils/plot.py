@@ -27,13 +27,6 @@ from ..utils import xywh2xyxy
 
 matplotlib.rc("font", **{"size": 11})
 
-# format short g, %precision=5
-np.set_printoptions(linewidth=320, formatter={"float_kind": "{:11.5g}".format})
-
-# Prevent OpenCV from multi threading (to use PyTorch DataLoader)
-# for apply_classifier and plot one box
-cv2.setNumThreads(0)
-
 
 def plot_images(images, targets, paths=None, fname='images.jpg', names=None, max_size=640, max_subplots=16):
     tl = 3  # line thickness
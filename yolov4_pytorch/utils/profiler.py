@@ -0,0 +1,106 @@
+# Copyright 2020 Lorna Authors. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+
+class StageTimer:
+    """ Wall time of the stages of a training iteration.
+
+    ``lap(name)`` charges the time since the previous lap to ``name``, so the stages of an
+    iteration add up to its wall time. On CUDA devices the device is synchronized first, so
+    asynchronous kernels are charged to the stage that launched them. A disabled timer does nothing.
+
+    Args:
+        device (torch.device, optional): Device to synchronize, ``None`` never synchronizes. (default: ``None``)
+        enabled (bool, optional): Record timings. (default: ``True``)
+        window (int, optional): Number of recent laps per stage written to TensorBoard. (default: ``1000``)
+
+    """
+
+    def __init__(self, device=None, enabled=True, window=1000):
+        self.sync = device is not None and torch.device(device).type == "cuda"
+        self.device = device
+        self.enabled = enabled
+        self.window = window
+        self.times = defaultdict(list)  # seconds of every lap this epoch, per stage
+        self.last = time.perf_counter()
+
+    def _now(self):
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+        return time.perf_counter()
+
+    def reset(self):
+        # Restart the clock without charging a stage, e.g. before the dataloader loop
+        if self.enabled:
+            self.last = self._now()
+
+    def lap(self, name):
+        if self.enabled:
+            now = self._now()
+            self.times[name].append(now - self.last)
+            self.last = now
+
+    def summary(self):
+        """ Statistics of every stage since the last ``clear()``, times in milliseconds.
+
+        Returns:
+            ``{stage: {"count", "total_s", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "fraction"}}``, fraction
+            is the share of the total time of all stages.
+
+        """
+        total = sum(sum(x) for x in self.times.values()) or 1.0
+        results = {}
+        for name, x in self.times.items():
+            x = np.array(x) * 1E3
+            p50, p90, p99 = np.percentile(x, [50, 90, 99])
+            results[name] = {"count": len(x),
+                             "total_s": float(x.sum() / 1E3),
+                             "mean_ms": float(x.mean()),
+                             "p50_ms": float(p50),
+                             "p90_ms": float(p90),
+                             "p99_ms": float(p99),
+                             "fraction": float(x.sum() / 1E3 / total)}
+        return results
+
+    def write(self, tb_writer, step):
+        # Histograms and mean of the recent laps of every stage, in milliseconds
+        if not self.enabled:
+            return
+        for name, x in self.times.items():
+            x = np.array(x[-self.window:]) * 1E3
+            if len(x):
+                tb_writer.add_histogram(f"time/{name}", x, step)
+                tb_writer.add_scalar(f"time/{name}_ms", x.mean(), step)
+
+    def save(self, path, epoch):
+        # Add the summary of this epoch to a JSON file of {epoch: summary}
+        if not self.enabled:
+            return
+        results = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                results = json.load(f)
+        results[str(epoch)] = self.summary()
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    def clear(self):
+        self.times.clear()